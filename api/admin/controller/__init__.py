@@ -16,7 +16,7 @@ from flask import (
 )
 from flask_babel import lazy_gettext as _
 from sqlalchemy.sql import func
-from sqlalchemy.sql.expression import desc, nullslast, and_, distinct, select, join
+from sqlalchemy.sql.expression import case, desc, nullslast, and_, distinct, select, join
 
 from api.admin.exceptions import *
 from api.admin.google_oauth_admin_authentication_provider import GoogleOAuthAdminAuthenticationProvider
@@ -950,6 +950,7 @@ class LanesController(AdminCirculationManagerController):
                 if list.id not in custom_list_ids:
                     lane.customlists.remove(list)
             lane.update_size(self._db, self.search_engine)
+            Configuration.set_lanes_updated(library)
 
             if is_new:
                 return Response(unicode(lane.id), 201)
@@ -974,6 +975,7 @@ class LanesController(AdminCirculationManagerController):
                 self._db.delete(lane)
 
             delete_lane_and_sublanes(lane)
+            Configuration.set_lanes_updated(library)
             return Response(unicode(_("Deleted")), 200)
 
     def show_lane(self, lane_identifier):
@@ -986,6 +988,7 @@ class LanesController(AdminCirculationManagerController):
         if lane.parent and not lane.parent.visible:
             return CANNOT_SHOW_LANE_WITH_HIDDEN_PARENT
         lane.visible = True
+        Configuration.set_lanes_updated(library)
         return Response(unicode(_("Success")), 200)
 
     def hide_lane(self, lane_identifier):
@@ -996,12 +999,14 @@ class LanesController(AdminCirculationManagerController):
         if not lane:
             return MISSING_LANE
         lane.visible = False
+        Configuration.set_lanes_updated(library)
         return Response(unicode(_("Success")), 200)
 
     def reset(self):
         self.require_library_manager(flask.request.library)
 
         create_default_lanes(self._db, flask.request.library)
+        Configuration.set_lanes_updated(flask.request.library)
         return Response(unicode(_("Success")), 200)
 
     def change_order(self):
@@ -1017,174 +1022,84 @@ class LanesController(AdminCirculationManagerController):
                 update_lane_order(lane_data.get("sublanes", []))
 
         update_lane_order(submitted_lanes)
+        Configuration.set_lanes_updated(flask.request.library)
 
         return Response(unicode(_("Success")), 200)
 
 
 class DashboardController(AdminCirculationManagerController):
 
+    # How long a snapshot of the dashboard statistics may be served
+    # before it is recalculated.
+    STATS_MAX_AGE = timedelta(minutes=5)
+
+    def __init__(self, manager):
+        super(DashboardController, self).__init__(manager)
+        self._stats_snapshot = None
+
     def stats(self):
+        snapshot = self.stats_snapshot()
+        generated = snapshot["generated"].strftime("%Y-%m-%dT%H:%M:%SZ")
         library_stats = {}
 
         total_title_count = 0
         total_license_count = 0
         total_available_license_count = 0
 
+        empty_collection_counts = dict(
+            licensed_titles=0,
+            open_access_titles=0,
+            licenses=0,
+            available_licenses=0,
+        )
         collection_counts = dict()
         for collection in self._db.query(Collection):
             if not flask.request.admin or not flask.request.admin.can_see_collection(collection):
                 continue
 
-            licensed_title_count = self._db.query(
-                LicensePool
-            ).filter(
-                LicensePool.collection_id == collection.id
-            ).filter(
-                and_(
-                    LicensePool.licenses_owned > 0,
-                    LicensePool.open_access == False,
-                )
-            ).count()
-
-            open_title_count = self._db.query(
-                LicensePool
-            ).filter(
-                LicensePool.collection_id == collection.id
-            ).filter(
-                LicensePool.open_access == True
-            ).count()
-
-            # The sum queries return None instead of 0 if there are
-            # no license pools in the db.
-
-            license_count = self._db.query(
-                func.sum(LicensePool.licenses_owned)
-            ).filter(
-                LicensePool.collection_id == collection.id
-            ).filter(
-                LicensePool.open_access == False,
-            ).all()[0][0] or 0
-
-            available_license_count = self._db.query(
-                func.sum(LicensePool.licenses_available)
-            ).filter(
-                LicensePool.collection_id == collection.id
-            ).filter(
-                LicensePool.open_access == False,
-            ).all()[0][0] or 0
-
-            total_title_count += licensed_title_count + open_title_count
-            total_license_count += license_count
-            total_available_license_count += available_license_count
-
-            collection_counts[collection.name] = dict(
-                licensed_titles=licensed_title_count,
-                open_access_titles=open_title_count,
-                licenses=license_count,
-                available_licenses=available_license_count,
-            )
-
-
+            counts = dict(snapshot["collections"].get(
+                collection.id, empty_collection_counts
+            ))
+            total_title_count += counts["licensed_titles"] + counts["open_access_titles"]
+            total_license_count += counts["licenses"]
+            total_available_license_count += counts["available_licenses"]
+            collection_counts[collection.name] = counts
+
+        empty_patron_counts = dict(
+            total=0,
+            with_active_loans=0,
+            with_active_loans_or_holds=0,
+            loans=0,
+            holds=0,
+        )
         for library in self._db.query(Library):
             # Only include libraries this admin has librarian access to.
             if not flask.request.admin or not flask.request.admin.is_librarian(library):
                 continue
 
-            patron_count = self._db.query(Patron).filter(Patron.library_id==library.id).count()
-
-            active_loans_patron_count = self._db.query(
-                distinct(Patron.id)
-            ).join(
-                Patron.loans
-            ).filter(
-                Loan.end >= datetime.now(),
-            ).filter(
-                Patron.library_id == library.id
-            ).count()
-
-            active_patrons = select(
-                [Patron.id]
-            ).select_from(
-                join(
-                    Loan,
-                    Patron,
-                    and_(
-                        Patron.id == Loan.patron_id,
-                        Patron.library_id == library.id,
-                        Loan.id != None,
-                        Loan.end >= datetime.now()
-                    )
-                )
-            ).union(
-                select(
-                    [Patron.id]
-                ).select_from(
-                    join(
-                        Hold,
-                        Patron,
-                        and_(
-                            Patron.id == Hold.patron_id,
-                            Patron.library_id == library.id,
-                            Hold.id != None,
-                        )
-                    )
-                )
-            ).alias()
-
-
-            active_loans_or_holds_patron_count_query = select(
-                [func.count(distinct(active_patrons.c.id))]
-            ).select_from(
-                active_patrons
-            )
-
-            result = self._db.execute(active_loans_or_holds_patron_count_query)
-            active_loans_or_holds_patron_count = [r[0] for r in result][0]
-
-            loan_count = self._db.query(
-                Loan
-            ).join(
-                Loan.patron
-            ).filter(
-                Patron.library_id == library.id
-            ).filter(
-                Loan.end >= datetime.now()
-            ).count()
-
-            hold_count = self._db.query(
-                Hold
-            ).join(
-                Hold.patron
-            ).filter(
-                Patron.library_id == library.id
-            ).count()
-
             title_count = 0
             license_count = 0
             available_license_count = 0
 
             library_collection_counts = dict()
             for collection in library.all_collections:
-                counts = collection_counts[collection.name]
+                counts = collection_counts.get(collection.name, empty_collection_counts)
                 library_collection_counts[collection.name] = counts
                 title_count += counts.get("licensed_titles", 0) + counts.get("open_access_titles", 0)
                 license_count += counts.get("licenses", 0)
                 available_license_count += counts.get("available_licenses", 0)
 
             library_stats[library.short_name] = dict(
-                patrons=dict(
-                    total=patron_count,
-                    with_active_loans=active_loans_patron_count,
-                    with_active_loans_or_holds=active_loans_or_holds_patron_count,
-                    loans=loan_count,
-                    holds=hold_count,
-                ),
+                patrons=dict(snapshot["libraries"].get(
+                    library.id, empty_patron_counts
+                )),
                 inventory=dict(
                     titles=title_count,
                     licenses=license_count,
                     available_licenses=available_license_count,
                 ),
                 collections=library_collection_counts,
+                generated=generated,
             )
 
         total_patrons = sum([
@@ -1220,10 +1135,144 @@ class DashboardController(AdminCirculationManagerController):
                 available_licenses=total_available_license_count,
             ),
             collections=collection_counts,
+            generated=generated,
         )
 
         return library_stats
 
+    def stats_snapshot(self):
+        """Return the raw dashboard counts for every collection and
+        library, recalculating them if the last snapshot is older than
+        STATS_MAX_AGE.
+
+        The snapshot isn't filtered by what the current admin is
+        allowed to see, so one snapshot can serve every admin.
+        """
+        now = datetime.utcnow()
+        snapshot = self._stats_snapshot
+        if snapshot and now - snapshot["generated"] < self.STATS_MAX_AGE:
+            return snapshot
+
+        snapshot = dict(
+            generated=now,
+            collections=self.collection_counts(),
+            libraries=self.patron_counts(),
+        )
+        self._stats_snapshot = snapshot
+        return snapshot
+
+    def collection_counts(self):
+        """Count titles and licenses for every collection in a single
+        query.
+
+        :return: A dictionary mapping collection IDs to dictionaries of
+            counts.
+        """
+        not_open_access = LicensePool.open_access == False
+        query = self._db.query(
+            LicensePool.collection_id,
+            func.count(case([(
+                and_(LicensePool.licenses_owned > 0, not_open_access), 1
+            )])),
+            func.count(case([(LicensePool.open_access == True, 1)])),
+            func.sum(case(
+                [(not_open_access, LicensePool.licenses_owned)], else_=0
+            )),
+            func.sum(case(
+                [(not_open_access, LicensePool.licenses_available)], else_=0
+            )),
+        ).group_by(LicensePool.collection_id)
+
+        counts = dict()
+        for (collection_id, licensed_titles, open_access_titles,
+             licenses, available_licenses) in query:
+            # The sum queries return None instead of 0 if none of
+            # the license pools have a value.
+            counts[collection_id] = dict(
+                licensed_titles=licensed_titles,
+                open_access_titles=open_access_titles,
+                licenses=licenses or 0,
+                available_licenses=available_licenses or 0,
+            )
+        return counts
+
+    def patron_counts(self):
+        """Count patrons, loans and holds for every library, using a
+        fixed number of grouped queries no matter how many libraries
+        there are.
+
+        :return: A dictionary mapping library IDs to dictionaries of
+            counts.
+        """
+        now = datetime.now()
+        counts = dict()
+
+        def set_counts(query, *keys):
+            for row in query:
+                library_id = row[0]
+                library_counts = counts.setdefault(library_id, dict(
+                    total=0,
+                    with_active_loans=0,
+                    with_active_loans_or_holds=0,
+                    loans=0,
+                    holds=0,
+                ))
+                for key, value in zip(keys, row[1:]):
+                    library_counts[key] = value
+
+        set_counts(
+            self._db.query(
+                Patron.library_id, func.count(Patron.id)
+            ).group_by(Patron.library_id),
+            "total"
+        )
+
+        set_counts(
+            self._db.query(
+                Patron.library_id, func.count(Loan.id),
+                func.count(distinct(Patron.id))
+            ).join(
+                Patron.loans
+            ).filter(
+                Loan.end >= now
+            ).group_by(Patron.library_id),
+            "loans", "with_active_loans"
+        )
+
+        set_counts(
+            self._db.query(
+                Patron.library_id, func.count(Hold.id)
+            ).join(
+                Patron.holds
+            ).group_by(Patron.library_id),
+            "holds"
+        )
+
+        active_patrons = select(
+            [Patron.library_id, Patron.id]
+        ).select_from(
+            join(Loan, Patron, Patron.id == Loan.patron_id)
+        ).where(
+            Loan.end >= now
+        ).union(
+            select(
+                [Patron.library_id, Patron.id]
+            ).select_from(
+                join(Hold, Patron, Patron.id == Hold.patron_id)
+            )
+        ).alias()
+
+        set_counts(
+            self._db.execute(
+                select(
+                    [active_patrons.c.library_id,
+                     func.count(distinct(active_patrons.c.id))]
+                ).group_by(active_patrons.c.library_id)
+            ),
+            "with_active_loans_or_holds"
+        )
+        return counts
+
     def circulation_events(self):
         annotator = AdminAnnotator(self.circulation, flask.request.library)
         num = min(int(flask.request.args.get("num", "100")), 500)
@@ -1281,7 +1330,7 @@ class DashboardController(AdminCirculationManagerController):
         library_short_name = library.short_name if library else None
 
         analytics_exporter = analytics_exporter or LocalAnalyticsExporter()
-        data = analytics_exporter.export(
+        data = analytics_exporter.export_chunks(
             self._db, date_start, date_end, locations, library
         )
         return (data, date_start.strftime(date_format),
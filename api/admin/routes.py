@@ -3,11 +3,13 @@ import flask
 from flask import (
     Response,
     redirect,
-    make_response
 )
 import os
 
-from api.app import app
+from api.app import (
+    app,
+    initializer,
+)
 from api.config import Configuration
 
 from core.util.problem_detail import ProblemDetail
@@ -35,7 +37,7 @@ from core.local_analytics_provider import LocalAnalyticsProvider
 # the admin will have to log in again.
 app.permanent_session_lifetime = timedelta(hours=9)
 
-@app.before_first_request
+@initializer
 def setup_admin(_db=None):
     if getattr(app, 'manager', None) is not None:
         setup_admin_controllers(app.manager)
@@ -276,7 +278,9 @@ def bulk_circulation_events():
     if isinstance(data, ProblemDetail):
         return data
 
-    response = make_response(data)
+    # The CSV file is sent as it's generated, rather than being
+    # built up in memory first.
+    response = Response(flask.stream_with_context(data))
 
     # If gathering events per library, include the library name in the file
     # for convenience. The start and end dates will always be included.
@@ -1,5 +1,7 @@
+import functools
 import os
 import logging
+import time
 import urlparse
 
 import flask
@@ -26,7 +28,28 @@ app.config['BABEL_DEFAULT_LOCALE'] = LanguageCodes.three_to_two[Configuration.lo
 app.config['BABEL_TRANSLATION_DIRECTORIES'] = "../translations"
 babel = Babel(app)
 
-@app.before_first_request
+def initializer(function, app=app):
+    """Register a function that sets up the app.
+
+    The function runs when warm_up() is called or before the first
+    request, whichever comes first. Once it has run successfully, it
+    won't run again either way. Calling the function directly always
+    runs it.
+    """
+    if not hasattr(app, 'initializers'):
+        app.initializers = []
+        app.initialized = set()
+    app.initializers.append(function)
+
+    @functools.wraps(function)
+    def run_once():
+        if function not in app.initialized:
+            function()
+            app.initialized.add(function)
+    app.before_first_request(run_once)
+    return function
+
+@initializer
 def initialize_database(autoinitialize=True):
     testing = 'TESTING' in os.environ
 
@@ -47,6 +70,49 @@ def initialize_database(autoinitialize=True):
 import routes
 import admin.routes
 
+def warm_up(app=app):
+    """Run the setup that would otherwise happen when the first request
+    comes in: connecting to the database, creating the
+    CirculationManager (and with it every library's lanes,
+    authenticators and CirculationAPIs) and setting up the admin
+    interface.
+
+    uWSGI calls this when a worker starts if the WARM_START environment
+    variable is set, so a newly spawned worker is ready before it
+    accepts any requests. If part of the setup fails, the error is
+    logged and that part is tried again when the first request comes
+    in, just as if there had been no warm start.
+
+    :return: A list of (function name, seconds) 2-tuples, one for each
+       setup phase that ran successfully.
+    """
+    log = logging.getLogger("Circulation manager web app")
+    timings = []
+    for function in getattr(app, 'initializers', []):
+        if function in app.initialized:
+            continue
+        start = time.time()
+        try:
+            function()
+        except Exception, e:
+            log.exception(
+                "Warm start: %s failed, will try again on the first request.",
+                function.__name__
+            )
+            break
+        app.initialized.add(function)
+        elapsed = time.time() - start
+        log.info("Warm start: %s took %.2fsec", function.__name__, elapsed)
+        timings.append((function.__name__, elapsed))
+    else:
+        log.info(
+            "Warm start complete in %.2fsec", sum(x for ignore, x in timings)
+        )
+    return timings
+
+if os.environ.get('WARM_START') == "True":
+    warm_up()
+
 def run(url=None):
     base_url = url or u'http://localhost:6500/'
     scheme, netloc, path, parameters, query, fragment = urlparse.urlparse(base_url)
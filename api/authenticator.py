@@ -1,13 +1,17 @@
 import datetime
+import hashlib
+import hmac
 import importlib
 import json
 import logging
+import os
 import re
 import urllib
 from abc import ABCMeta
 
 import flask
 import jwt
+from expiringdict import ExpiringDict
 from flask import (
     redirect,
     url_for)
@@ -1717,6 +1721,17 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
     BARCODE_FORMAT_CODABAR = "Codabar" # Constant defined in the extension
     BARCODE_FORMAT_NONE = ""
 
+    # Once a set of credentials has been verified with the source of
+    # truth, it can be trusted for this many seconds without asking
+    # again.
+    AUTHENTICATION_CACHE_TIME = u'authentication_cache_time'
+
+    # Remember at most this many sets of credentials.
+    AUTHENTICATION_CACHE_SIZE = 10000
+
+    # Log the authentication cache hit rate after this many lookups.
+    AUTHENTICATION_CACHE_REPORT_INTERVAL = 1000
+
     # These identifier and password are supposed to be valid
     # credentials.  If there's a problem using them, there's a problem
     # with the authenticator or with the way we have it configured.
@@ -1798,6 +1813,11 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
         { "key": PASSWORD_LABEL,
           "label": _("Label for password entry"),
         },
+        { "key": AUTHENTICATION_CACHE_TIME,
+          "label": _("Authentication cache time (seconds)"),
+          "description": _("Once a patron's credentials have been verified, don't check them with the source of truth again for this many seconds. If the patron's password is rejected in the meantime, the cached credentials are forgotten. Leave this blank to check the credentials on every request."),
+          "type": "number",
+        },
     ] + AuthenticationProvider.SETTINGS
 
     # Used in the constructor to signify that the default argument
@@ -1863,6 +1883,96 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
             or self.DEFAULT_PASSWORD_LABEL
         )
 
+        cache_time = integration.setting(
+            self.AUTHENTICATION_CACHE_TIME
+        ).int_value
+        if cache_time and cache_time > 0:
+            self.authentication_cache = ExpiringDict(
+                max_len=self.AUTHENTICATION_CACHE_SIZE,
+                max_age_seconds=cache_time
+            )
+        else:
+            self.authentication_cache = None
+
+        # Credentials are never stored in the cache as-is; they're
+        # hashed with a salt that only exists in this process.
+        self._authentication_cache_salt = os.urandom(16)
+        self.authentication_cache_hits = 0
+        self.authentication_cache_misses = 0
+
+    def _authentication_cache_hash(self, *values):
+        message = u"\0".join(
+            unicode(x) if x is not None else u"" for x in values
+        ).encode("utf8")
+        return hmac.new(
+            self._authentication_cache_salt, message, hashlib.sha256
+        ).hexdigest()
+
+    def cached_authentication(self, _db, username, password):
+        """Find the Patron who recently authenticated with these
+        credentials, if any.
+
+        :return: A Patron, or None if the credentials need to be
+            checked with the source of truth.
+        """
+        if self.authentication_cache is None:
+            return None
+        key = self._authentication_cache_hash(self.library_id, username)
+        cached = self.authentication_cache.get(key)
+        patron = None
+        if cached:
+            password_hash, patron_id = cached
+            if password_hash == self._authentication_cache_hash(
+                self.library_id, username, password
+            ):
+                patron = get_one(_db, Patron, id=patron_id)
+                if patron and patron.library_id != self.library_id:
+                    patron = None
+
+        if patron:
+            self.authentication_cache_hits += 1
+        else:
+            self.authentication_cache_misses += 1
+        lookups = self.authentication_cache_hits + self.authentication_cache_misses
+        if lookups % self.AUTHENTICATION_CACHE_REPORT_INTERVAL == 0:
+            self.log.info(
+                "Authentication cache hit rate: %.1f%% of %d lookups",
+                self.authentication_cache_hit_rate * 100, lookups
+            )
+        return patron
+
+    @property
+    def authentication_cache_hit_rate(self):
+        """What fraction of cache lookups found a Patron?"""
+        lookups = self.authentication_cache_hits + self.authentication_cache_misses
+        if not lookups:
+            return 0.0
+        return float(self.authentication_cache_hits) / lookups
+
+    def remember_authentication(self, username, password, patron):
+        """Remember that these credentials belong to the given Patron."""
+        if self.authentication_cache is None or not isinstance(patron, Patron):
+            return
+        key = self._authentication_cache_hash(self.library_id, username)
+        self.authentication_cache[key] = (
+            self._authentication_cache_hash(
+                self.library_id, username, password
+            ),
+            patron.id
+        )
+
+    def forget_authentication(self, username):
+        """Forget any cached credentials for this username.
+
+        This is called when the source of truth rejects a password, so
+        an old password that's been changed, or a card that's been
+        blocked, can't be used any longer.
+        """
+        if self.authentication_cache is None:
+            return
+        key = self._authentication_cache_hash(self.library_id, username)
+        self.authentication_cache.pop(key, None)
+
     def remote_patron_lookup(self, patron_or_patrondata):
         """Ask the remote for information about this patron, and then make sure
         the patron belongs to the library associated with thie BasicAuthenticationProvider."""
@@ -1961,11 +2071,19 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
             # need to be checked with the source of truth.
             return server_side_validation_result
 
+        # If these credentials were checked with the source of truth
+        # recently, there's no need to check them again.
+        patron = self.cached_authentication(_db, username, password)
+        if patron:
+            return patron
+
         # Check these credentials with the source of truth.
         patrondata = self.remote_authenticate(username, password)
         if not patrondata or isinstance(patrondata, ProblemDetail):
             # Either an error occured or the credentials did not correspond
             # to any patron.
+            if not patrondata:
+                self.forget_authentication(username)
             return patrondata
 
         # Check that the patron belongs to this library.
@@ -1993,6 +2111,7 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
             # Just make sure our local data is up to date with
             # whatever we just got from remote.
             self.apply_patrondata(patrondata, patron)
+            self.remember_authentication(username, password, patron)
             return patron
 
         # At this point there are two possibilities:
@@ -2021,6 +2140,7 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
             # For whatever reason, the remote lookup implementation
             # returned a Patron object instead of a PatronData. Just
             # use that Patron object.
+            self.remember_authentication(username, password, patrondata)
             return patrondata
 
         # At this point we have a _complete_ PatronData object which we
@@ -2042,6 +2162,7 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
         # we now need to update the Patron record with the account
         # information we just got from the source of truth.
         self.apply_patrondata(patrondata, patron)
+        self.remember_authentication(username, password, patron)
         return patron
 
     def apply_patrondata(self, patrondata, patron):
@@ -3,9 +3,13 @@ import json
 import logging
 import os
 import re
+import sys
+import time
 
 from collections import defaultdict
 from datetime import datetime, timedelta
+from Queue import Full, Queue
+from threading import Event, Thread
 from flask_babel import lazy_gettext as _
 from lxml import etree
 from sqlalchemy.orm import contains_eager
@@ -40,6 +44,7 @@ from core.model import (
     Classification,
     Collection,
     Contributor,
+    CoverageRecord,
     DataSource,
     DeliveryMechanism,
     Edition,
@@ -70,7 +75,7 @@ from core.opds_import import (
 from core.testing import DatabaseTest
 
 from core.util import LanguageCodes
-from core.util.xmlparser import XMLParser
+from util.xmlparser import StreamingXMLParser
 from core.util.http import (
     HTTP,
     RemoteIntegrationException,
@@ -293,7 +298,14 @@ class Axis360API(Authenticator, BaseCirculationAPI, HasCollectionSelfTests):
         else:
             return response
 
-    def availability(self, patron_id=None, since=None, title_ids=[]):
+    def availability(self, patron_id=None, since=None, title_ids=[],
+                     stream=False):
+        """Make a call to the availability endpoint.
+
+        :param stream: If this is True, the body of the response won't
+            be read until the caller reads it, e.g. with
+            StreamingXMLParser.process_stream().
+        """
         url = self.base_url + self.availability_endpoint
         args = dict()
         if since:
@@ -303,7 +315,10 @@ class Axis360API(Authenticator, BaseCirculationAPI, HasCollectionSelfTests):
             args['patronId'] = patron_id
         if title_ids:
             args['titleIds'] = ','.join(title_ids)
-        response = self.request(url, params=args, timeout=None)
+        kwargs = dict(timeout=None)
+        if stream:
+            kwargs['stream'] = True
+        response = self.request(url, params=args, **kwargs)
         return response
 
     def get_fulfillment_info(self, transaction_id):
@@ -528,12 +543,25 @@ class Axis360API(Authenticator, BaseCirculationAPI, HasCollectionSelfTests):
     def recent_activity(self, since):
         """Find books that have had recent activity.
 
-        :yield: A sequence of (Metadata, CirculationData) 2-tuples
+        Anything that needs the database is looked up here, before
+        iteration starts, so the returned generator can be run in a
+        thread other than the one that owns `self._db`.
+
+        :return: A generator of (Metadata, CirculationData) 2-tuples
+        """
+        parser = BibliographicParser(self.collection is not None)
+        return self._recent_activity(since, parser)
+
+    def _recent_activity(self, since, parser):
+        """Download and parse the availability document.
+
+        This only uses plain values set in the constructor; it never
+        touches the database.
         """
-        availability = self.availability(since=since)
-        content = availability.content
-        for bibliographic, circulation in BibliographicParser(self.collection).process_all(
-                content):
+        # The response may describe the entire collection, so parse
+        # it as it comes in rather than reading it all into memory.
+        availability = self.availability(since=since, stream=True)
+        for bibliographic, circulation in parser.process_stream(availability):
             yield bibliographic, circulation
 
     @classmethod
@@ -569,6 +597,10 @@ class Axis360CirculationMonitor(CollectionMonitor, TimelineMonitor):
     INTERVAL_SECONDS = 60
     DEFAULT_BATCH_SIZE = 50
 
+    # Books are downloaded and parsed in a background thread, at most
+    # this many books ahead of the database writes.
+    PREFETCH_SIZE = 200
+
     PROTOCOL = ExternalIntegration.AXIS_360
 
     DEFAULT_START_TIME = datetime(1970, 1, 1)
@@ -587,19 +619,102 @@ class Axis360CirculationMonitor(CollectionMonitor, TimelineMonitor):
             Axis360BibliographicCoverageProvider(collection, api_class=self.api)
         )
 
+        # While catch_up_from() is running, this is a list of
+        # Identifiers that need a CoverageRecord. The records are
+        # created in bulk, once per batch.
+        self.pending_coverage = None
+
     def catch_up_from(self, start, cutoff, progress):
         """Find Axis 360 books that changed recently.
 
         :progress: A TimestampData representing the time previously
             covered by this Monitor.
         """
+        started_at = time.time()
         count = 0
-        for bibliographic, circulation in self.api.recent_activity(start):
-            self.process_book(bibliographic, circulation)
-            count += 1
-            if count % self.batch_size == 0:
-                self._db.commit()
-        progress.achievements = "Modified titles: %d." % count
+        self.pending_coverage = []
+        try:
+            for bibliographic, circulation in self.prefetch(
+                self.api.recent_activity(start)
+            ):
+                self.process_book(bibliographic, circulation)
+                count += 1
+                if count % self.batch_size == 0:
+                    self.add_pending_coverage()
+                    self._db.commit()
+            self.add_pending_coverage()
+        finally:
+            self.pending_coverage = None
+
+        elapsed = time.time() - started_at
+        progress.achievements = "Modified titles: %d. Titles per second: %.1f." % (
+            count, count / max(elapsed, 0.001)
+        )
+
+    def prefetch(self, items):
+        """Iterate over `items` in a background thread.
+
+        Axis 360's availability document is downloaded and parsed
+        while the main thread writes the previous books to the
+        database. The background thread must never touch the
+        database, since it would share the main thread's session, so
+        `items` must not need it -- see Axis360API.recent_activity.
+
+        :yield: The items from `items`, in order. If iterating over
+            `items` raises an exception, it's raised here.
+        """
+        queue = Queue(self.PREFETCH_SIZE)
+        stop = Event()
+        done = object()
+
+        def put(value):
+            # Wait for room in the queue, unless the consumer has
+            # gone away.
+            while not stop.is_set():
+                try:
+                    queue.put(value, timeout=1)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def produce():
+            error = None
+            try:
+                for item in items:
+                    if not put((item, None)):
+                        return
+            except Exception, e:
+                error = sys.exc_info()
+            put((done, error))
+
+        thread = Thread(target=produce, name="Axis360Prefetch")
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                item, error = queue.get()
+                if item is done:
+                    if error:
+                        raise error[0], error[1], error[2]
+                    break
+                yield item
+        finally:
+            stop.set()
+
+    def add_pending_coverage(self):
+        """Register bibliographic coverage for every Identifier in
+        pending_coverage, in a single query.
+        """
+        if not self.pending_coverage:
+            return
+        provider = self.bibliographic_coverage_provider
+        CoverageRecord.bulk_add(
+            self.pending_coverage, provider.data_source,
+            operation=provider.operation,
+            collection=provider.collection_or_not, force=True
+        )
+        self.pending_coverage = []
 
     def process_book(self, bibliographic, circulation):
         edition, new_edition, license_pool, new_license_pool = self.api.update_book(
@@ -611,10 +726,12 @@ class Axis360CirculationMonitor(CollectionMonitor, TimelineMonitor):
             # work has been done so we don't have to do it again.
             identifier = edition.primary_identifier
             self.bibliographic_coverage_provider.handle_success(identifier)
-            self.bibliographic_coverage_provider.add_coverage_record_for(
-                identifier
-            )
-
+            if self.pending_coverage is None:
+                self.bibliographic_coverage_provider.add_coverage_record_for(
+                    identifier
+                )
+            else:
+                self.pending_coverage.append(identifier)
 
         return edition, license_pool
 
@@ -765,7 +882,7 @@ class AxisCollectionReaper(IdentifierSweepMonitor):
         self.api.update_licensepools_for_identifiers(identifiers)
 
 
-class Axis360Parser(XMLParser):
+class Axis360Parser(StreamingXMLParser):
 
     NS = {"axis": "http://axis360api.baker-taylor.com/vendorAPI"}
 
@@ -824,6 +941,11 @@ class BibliographicParser(Axis360Parser):
                 string, "//axis:title", self.NS):
             yield i
 
+    def process_stream(self, source):
+        for i in super(BibliographicParser, self).process_stream(
+                source, "axis:title", self.NS):
+            yield i
+
     def extract_availability(self, circulation_data, element, ns):
         identifier = self.text_of_subtag(element, 'axis:titleId', ns)
         primary_identifier = IdentifierData(Identifier.AXIS_360_ID, identifier)
@@ -1367,6 +1489,12 @@ class AvailabilityResponseParser(ResponseParser):
             if info:
                 yield info
 
+    def process_stream(self, source):
+        for info in super(AvailabilityResponseParser, self).process_stream(
+                source, "axis:title", self.NS):
+            if info:
+                yield info
+
     def process_one(self, e, ns):
 
         # Figure out which book we're talking about.
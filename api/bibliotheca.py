@@ -16,6 +16,7 @@ import dateutil.parser
 from flask_babel import lazy_gettext as _
 from lxml import etree
 from sqlalchemy import or_
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm.session import Session
 
 from circulation import (
@@ -76,7 +77,7 @@ from core.monitor import (
 )
 from core.scripts import RunCollectionMonitorScript
 from core.testing import DatabaseTest
-from core.util.xmlparser import XMLParser
+from util.xmlparser import StreamingXMLParser
 from core.util.http import (
     BadResponseException,
     HTTP
@@ -638,7 +639,7 @@ class MockBibliothecaAPI(BibliothecaAPI):
         response = self._request_with_timeout('GET', url, *args, **kwargs)
         return response.status_code, response.headers, response.content
 
-class ItemListParser(XMLParser):
+class ItemListParser(StreamingXMLParser):
 
     DATE_FORMAT = "%Y-%m-%d"
     YEAR_FORMAT = "%Y"
@@ -649,6 +650,10 @@ class ItemListParser(XMLParser):
         for i in self.process_all(xml, "//Item"):
             yield i
 
+    def parse_stream(self, source):
+        for i in self.process_stream(source, "Item"):
+            yield i
+
     parenthetical = re.compile(" \([^)]+\)$")
 
 
@@ -873,7 +878,7 @@ class ItemListParser(XMLParser):
             medium = Edition.BOOK_MEDIUM
         return medium, [format]
 
-class BibliothecaParser(XMLParser):
+class BibliothecaParser(StreamingXMLParser):
 
     INPUT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
 
@@ -1130,9 +1135,20 @@ class EventParser(BibliothecaParser):
     }
 
     def process_all(self, string, no_events_error=False):
+        events = super(EventParser, self).process_all(
+            string, "//CloudLibraryEvent"
+        )
+        return self._check_for_events(events, no_events_error)
+
+    def process_stream(self, source, no_events_error=False):
+        events = super(EventParser, self).process_stream(
+            source, "CloudLibraryEvent"
+        )
+        return self._check_for_events(events, no_events_error)
+
+    def _check_for_events(self, events, no_events_error):
         has_events = False
-        for i in super(EventParser, self).process_all(
-                string, "//CloudLibraryEvent"):
+        for i in events:
             yield i
             has_events = True
 
@@ -1460,11 +1476,7 @@ class BibliothecaEventMonitor(CollectionMonitor, TimelineMonitor):
             events = self.api.get_events_between(
                 slice_start, slice_cutoff, full_slice, raise_on_no_events
             )
-            for event in events:
-                self.handle_event(*event)
-                events_handled += 1
-                if not events_handled % 1000:
-                    self._db.commit()
+            events_handled += self.handle_events(events)
             self._db.commit()
             _events_this_request = events_handled - _events_pre_request
             if _events_this_request >= reliable_max_cloudevents_count:
@@ -1483,13 +1495,102 @@ class BibliothecaEventMonitor(CollectionMonitor, TimelineMonitor):
                             if progress.counter != recent_mode_counter_value
                             else backlog_mode_counter_value)
 
+    def handle_events(self, events):
+        """Handle a batch of events, such as all the events in one slice
+        of time.
+
+        The LicensePools, Editions and ISBNs mentioned in the batch are
+        looked up with one query each, rather than once per event.
+
+        :param events: A list of tuples, each suitable for passing into
+            handle_event().
+        :return: The number of events handled.
+        """
+        events = list(events)
+        resolved = self.resolve_events(events)
+        for event in events:
+            self.handle_event(*event, resolved=resolved)
+        return len(events)
+
+    def resolve_events(self, events):
+        """Look up everything needed to handle a batch of events.
+
+        :return: A dictionary with the keys 'pools' and 'editions'
+            (keyed by Bibliotheca ID), 'isbns' (keyed by ISBN) and
+            'equivalencies' (a set of (Bibliotheca ID, ISBN) pairs
+            that have already been registered). handle_event() fills
+            in anything that wasn't found.
+        """
+        bibliotheca_ids = set([event[0] for event in events])
+        isbns = set([event[1] for event in events if event[1]])
+        resolved = dict(
+            pools=dict(), editions=dict(), isbns=dict(),
+            equivalencies=set()
+        )
+        if bibliotheca_ids:
+            pools = self._db.query(LicensePool).join(
+                LicensePool.identifier
+            ).filter(
+                LicensePool.collection_id==self.collection.id
+            ).filter(
+                LicensePool.data_source==self.api.source
+            ).filter(
+                Identifier.type==Identifier.BIBLIOTHECA_ID
+            ).filter(
+                Identifier.identifier.in_(bibliotheca_ids)
+            ).options(
+                contains_eager(LicensePool.identifier)
+            )
+            for pool in pools:
+                resolved['pools'][pool.identifier.identifier] = pool
+
+            editions = self._db.query(Edition).join(
+                Edition.primary_identifier
+            ).filter(
+                Edition.data_source==self.api.source
+            ).filter(
+                Identifier.type==Identifier.BIBLIOTHECA_ID
+            ).filter(
+                Identifier.identifier.in_(bibliotheca_ids)
+            ).options(
+                contains_eager(Edition.primary_identifier)
+            )
+            for edition in editions:
+                resolved['editions'][edition.primary_identifier.identifier] = edition
+
+        if isbns:
+            for identifier in self._db.query(Identifier).filter(
+                Identifier.type==Identifier.ISBN
+            ).filter(
+                Identifier.identifier.in_(isbns)
+            ):
+                resolved['isbns'][identifier.identifier] = identifier
+        return resolved
+
     def handle_event(self, bibliotheca_id, isbn, foreign_patron_id,
-                     start_time, end_time, internal_event_type):
+                     start_time, end_time, internal_event_type,
+                     resolved=None):
+        """Handle a single event.
+
+        :param resolved: The result of calling resolve_events() on
+            a batch of events that includes this one. If this is not
+            provided, everything is looked up individually.
+        """
+        if resolved is None:
+            resolved = dict(
+                pools=dict(), editions=dict(), isbns=dict(),
+                equivalencies=set()
+            )
+
         # Find or lookup the LicensePool for this event.
-        license_pool, is_new = LicensePool.for_foreign_id(
-            self._db, self.api.source, Identifier.BIBLIOTHECA_ID,
-            bibliotheca_id, collection=self.collection
-        )
+        is_new = False
+        license_pool = resolved['pools'].get(bibliotheca_id)
+        if not license_pool:
+            license_pool, is_new = LicensePool.for_foreign_id(
+                self._db, self.api.source, Identifier.BIBLIOTHECA_ID,
+                bibliotheca_id, collection=self.collection
+            )
+            resolved['pools'][bibliotheca_id] = license_pool
 
         if is_new:
             # This is a new book. Immediately acquire bibliographic
@@ -1503,14 +1604,26 @@ class BibliothecaEventMonitor(CollectionMonitor, TimelineMonitor):
             )
 
         bibliotheca_identifier = license_pool.identifier
-        isbn, ignore = Identifier.for_foreign_id(
-            self._db, Identifier.ISBN, isbn)
-
-        edition, ignore = Edition.for_foreign_id(
-            self._db, self.api.source, Identifier.BIBLIOTHECA_ID, bibliotheca_id)
+        isbn_identifier = resolved['isbns'].get(isbn)
+        if not isbn_identifier:
+            isbn_identifier, ignore = Identifier.for_foreign_id(
+                self._db, Identifier.ISBN, isbn)
+            resolved['isbns'][isbn] = isbn_identifier
+
+        edition = resolved['editions'].get(bibliotheca_id)
+        if not edition:
+            edition, ignore = Edition.for_foreign_id(
+                self._db, self.api.source, Identifier.BIBLIOTHECA_ID, bibliotheca_id)
+            resolved['editions'][bibliotheca_id] = edition
 
         # The ISBN and the Bibliotheca identifier are exactly equivalent.
-        bibliotheca_identifier.equivalent_to(self.api.source, isbn, strength=1)
+        # A batch often has several events for the same book, but the
+        # equivalency only needs to be registered once.
+        if (bibliotheca_id, isbn) not in resolved['equivalencies']:
+            bibliotheca_identifier.equivalent_to(
+                self.api.source, isbn_identifier, strength=1
+            )
+            resolved['equivalencies'].add((bibliotheca_id, isbn))
 
         # Log the event.
         start = start_time or CirculationEvent.NO_DATE
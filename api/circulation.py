@@ -2,10 +2,22 @@ import datetime
 import logging
 import sys
 import time
-from threading import Thread
+from collections import defaultdict
+from Queue import Queue
+from threading import (
+    Event,
+    Lock,
+    Thread,
+    current_thread,
+)
 
 import flask
 from flask_babel import lazy_gettext as _
+from sqlalchemy import tuple_
+from sqlalchemy.orm import (
+    contains_eager,
+    scoped_session,
+)
 
 from circulation_exceptions import *
 from config import Configuration
@@ -19,12 +31,14 @@ from core.model import (
     ConfigurationSetting,
     DeliveryMechanism,
     ExternalIntegration,
+    Identifier,
     Library,
     LicensePoolDeliveryMechanism,
     LicensePool,
     Loan,
     Hold,
     Patron,
+    PolicyException,
     RightsStatus,
     Session,
     ExternalIntegrationLink)
@@ -360,6 +374,202 @@ class HoldInfo(CirculationInfo):
         )
 
 
+class PatronActivityJob(object):
+    """A request for one vendor API's view of a patron's activity,
+    to be run by a PatronActivityWorkerPool.
+
+    A job may outlive the request that created it, so it holds on to
+    nothing from that request: only the patron's database ID and
+    PIN, and a way of getting a database session of its own.
+    """
+
+    log = logging.getLogger("Patron activity")
+
+    def __init__(self, api, collection_id, patron_id, pin, session_factory):
+        """Constructor.
+
+        :param api: The vendor API to ask about the patron's activity.
+        :param collection_id: ID of the Collection `api` manages.
+        :param patron_id: ID of the Patron whose activity we want.
+        :param pin: The patron's PIN.
+        :param session_factory: A callable that returns a database
+            session for the worker thread to use. If this is a
+            scoped session it will be removed when the job is done;
+            otherwise the session it returns will be closed.
+        """
+        self.api = api
+        self.collection_id = collection_id
+        self.patron_id = patron_id
+        self.pin = pin
+        self.session_factory = session_factory
+        self.activity = None
+        self.exception = None
+        self.trace = None
+        self.patron_missing = False
+        self.started = False
+        self.abandoned = False
+        self.finished = Event()
+
+    def run(self):
+        before = time.time()
+        _db = None
+        try:
+            _db = self.session_factory()
+            patron = get_one(_db, Patron, id=self.patron_id)
+            if patron is None:
+                # The patron isn't visible to this session, probably
+                # because they were never committed.
+                self.patron_missing = True
+                self.log.warn(
+                    "Could not find patron %s, not asking %s about them.",
+                    self.patron_id, self.api.__class__.__name__
+                )
+                return
+            self.activity = self.api.patron_activity(patron, self.pin)
+        except Exception, e:
+            self.exception = e
+            self.trace = sys.exc_info()
+        finally:
+            self.close_session(_db)
+            self.finished.set()
+        after = time.time()
+        self.log.debug(
+            "Synced %s in %.2f sec", self.api.__class__.__name__,
+            after-before
+        )
+
+    def close_session(self, _db):
+        """Give this job's database connection back, since the worker
+        thread that ran it may sit idle for a long time.
+        """
+        try:
+            remove = getattr(self.session_factory, 'remove', None)
+            if callable(remove):
+                remove()
+            elif _db is not None:
+                _db.close()
+        except Exception, e:
+            self.log.error("Could not clean up session: %s", e, exc_info=e)
+
+    def wait(self, timeout):
+        """Wait up to `timeout` seconds for this job to finish.
+
+        :return: True if the job finished, False if it's still running.
+        """
+        self.finished.wait(timeout)
+        return self.finished.is_set()
+
+
+class PatronActivityWorkerPool(object):
+    """A fixed number of long-lived threads that run PatronActivityJobs.
+
+    Starting a new thread for every vendor API on every bookshelf
+    sync is wasteful, so the threads in this pool are started once
+    and reused for the lifetime of the process.
+
+    A job that's given up on may still be waiting on an unresponsive
+    vendor. When that happens the pool starts a replacement worker,
+    and the stuck worker goes away once its job finishes. To keep a
+    hung vendor from piling up stuck workers, a collection with
+    MAX_STUCK_JOBS_PER_COLLECTION such jobs can't have any more
+    jobs until one of them finishes.
+    """
+
+    DEFAULT_SIZE = 10
+
+    MAX_STUCK_JOBS_PER_COLLECTION = 2
+
+    _shared = None
+    _shared_lock = Lock()
+
+    def __init__(self, size=DEFAULT_SIZE,
+                 max_stuck_jobs_per_collection=MAX_STUCK_JOBS_PER_COLLECTION):
+        self.size = size
+        self.max_stuck_jobs_per_collection = max_stuck_jobs_per_collection
+        self.queue = Queue()
+        self.lock = Lock()
+        self.stuck_jobs_per_collection = defaultdict(int)
+        self.workers = []
+        self.workers_started = 0
+        for i in range(size):
+            self._start_worker()
+
+    @classmethod
+    def shared(cls):
+        """Return the pool shared by every CirculationAPI in this process,
+        creating it if necessary.
+        """
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def submit(self, job):
+        """Queue a PatronActivityJob to be run by the next free worker.
+
+        :return: True if the job was queued, False if its collection
+            already has as many stuck jobs as it's allowed.
+        """
+        with self.lock:
+            if (self.stuck_jobs_per_collection.get(job.collection_id, 0)
+                >= self.max_stuck_jobs_per_collection):
+                return False
+        self.queue.put(job)
+        return True
+
+    def abandon(self, job):
+        """Stop waiting for a PatronActivityJob.
+
+        If the job hasn't started, it never will. If it's running, a
+        new worker is started to take the place of the one that's
+        stuck running it.
+        """
+        with self.lock:
+            if job.finished.is_set() or job.abandoned:
+                return
+            job.abandoned = True
+            if job.started:
+                self.stuck_jobs_per_collection[job.collection_id] += 1
+                self._start_worker()
+
+    def _start_worker(self):
+        worker = Thread(
+            target=self._work,
+            name="PatronActivityWorker-%d" % self.workers_started
+        )
+        self.workers_started += 1
+        # A worker stuck on an unresponsive vendor should not keep
+        # the process from shutting down.
+        worker.daemon = True
+        self.workers.append(worker)
+        worker.start()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                run = not job.abandoned
+                job.started = run
+            try:
+                if run:
+                    job.run()
+            finally:
+                with self.lock:
+                    # If we gave up on this job while it was running,
+                    # another worker has already taken this one's place.
+                    retire = run and job.abandoned
+                    if retire:
+                        stuck = self.stuck_jobs_per_collection
+                        stuck[job.collection_id] -= 1
+                        if not stuck[job.collection_id]:
+                            del stuck[job.collection_id]
+                        self.workers.remove(current_thread())
+                self.queue.task_done()
+            if retire:
+                return
+
+
 class CirculationAPI(object):
     """Implement basic circulation logic and abstract away the details
     between different circulation APIs behind generic operations like
@@ -1071,60 +1281,71 @@ class CirculationAPI(object):
         """Return a record of the patron's current activity
         vis-a-vis all relevant external loan sources.
 
-        We check each source in a separate thread for speed.
-
-        :return: A 2-tuple (loans, holds) containing `HoldInfo` and
-            `LoanInfo` objects.
+        We check each source in parallel, using a worker pool shared
+        by every CirculationAPI in this process. Each source gets
+        until its PATRON_ACTIVITY_TIMEOUT to respond; a source that
+        takes longer than that, or that is still stuck on too many
+        earlier requests, is treated the same as a source that
+        raised an exception.
+
+        Each source is checked in its own database session, which
+        can only see the patron once they've been committed. This
+        method commits the current session before checking any
+        sources, so a patron created or changed in this request
+        (e.g. on their first login) is seen as they are now.
+
+        :return: A 3-tuple (loans, holds, complete). `loans` and
+            `holds` contain `LoanInfo` and `HoldInfo` objects;
+            `complete` is False if any source failed to respond in
+            time.
         """
-        log = self.log
-        class PatronActivityThread(Thread):
-            def __init__(self, api, patron, pin):
-                self.api = api
-                self.patron = patron
-                self.pin = pin
-                self.activity = None
-                self.exception = None
-                self.trace = None
-                super(PatronActivityThread, self).__init__()
-
-            def run(self):
-                before = time.time()
-                try:
-                    self.activity = self.api.patron_activity(
-                        self.patron, self.pin)
-                except Exception, e:
-                    self.exception = e
-                    self.trace = sys.exc_info()
-                after = time.time()
-                log.debug(
-                    "Synced %s in %.2f sec", self.api.__class__.__name__,
-                    after-before
-                )
-
-        threads = []
-        before = time.time()
-        for api in self.api_for_collection.values():
-            thread = PatronActivityThread(api, patron, pin)
-            threads.append(thread)
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
+        jobs = []
         loans = []
         holds = []
         complete = True
-        for thread in threads:
-            if thread.exception:
+        before = time.time()
+        pool = self.patron_activity_pool
+        session_factory = self.patron_activity_session_factory()
+        self._db.commit()
+        for collection_id, api in self.api_for_collection.items():
+            job = PatronActivityJob(
+                api, collection_id, patron.id, pin, session_factory
+            )
+            if not pool.submit(job):
+                # This source still hasn't answered earlier requests
+                # that we gave up on. Don't pile another one on top.
+                complete = False
+                self.log.error(
+                    "%s has too many requests stuck, skipping.",
+                    api.__class__.__name__
+                )
+                continue
+            jobs.append(job)
+        for job in jobs:
+            deadline = before + self.patron_activity_timeout(job.api)
+            if not job.wait(max(deadline - time.time(), 0)):
+                # This source is taking too long. We'll leave it to
+                # finish in the background and return what we have.
+                pool.abandon(job)
+                complete = False
+                self.log.error(
+                    "%s did not respond within %.2f sec, giving up.",
+                    job.api.__class__.__name__, deadline - before
+                )
+                continue
+            if job.patron_missing:
+                complete = False
+            if job.exception:
                 # Something went wrong, so we don't have a complete
                 # picture of the patron's loans.
                 complete = False
                 self.log.error(
-                    "%s errored out: %s", thread.api.__class__.__name__,
-                    thread.exception,
-                    exc_info=thread.trace
+                    "%s errored out: %s", job.api.__class__.__name__,
+                    job.exception,
+                    exc_info=job.trace
                 )
-            if thread.activity:
-                for i in thread.activity:
+            if job.activity:
+                for i in job.activity:
                     l = None
                     if isinstance(i, LoanInfo):
                         l = loans
@@ -1141,11 +1362,46 @@ class CirculationAPI(object):
         self.log.debug("Full sync took %.2f sec", after-before)
         return loans, holds, complete
 
+    @property
+    def patron_activity_pool(self):
+        """The PatronActivityWorkerPool used to run patron_activity
+        calls against the vendor APIs.
+        """
+        return PatronActivityWorkerPool.shared()
+
+    def patron_activity_session_factory(self):
+        """Find a way for a PatronActivityJob to get a database session
+        of its own.
+
+        A scoped session already gives each worker thread its own
+        session. Otherwise, each job gets a new session bound to the
+        same database as ours.
+        """
+        if isinstance(self._db, scoped_session):
+            return self._db
+        bind = self._db.get_bind()
+        return lambda: Session(bind=bind)
+
+    def patron_activity_timeout(self, api):
+        """How long should we wait for the given vendor API to tell us
+        about a patron's activity?
+
+        :return: A number of seconds.
+        """
+        return getattr(
+            api, 'PATRON_ACTIVITY_TIMEOUT',
+            BaseCirculationAPI.PATRON_ACTIVITY_TIMEOUT
+        )
+
     def local_loans(self, patron):
         return self._db.query(Loan).join(Loan.license_pool).filter(
             LicensePool.collection_id.in_(self.collection_ids_for_sync)
         ).filter(
             Loan.patron==patron
+        ).options(
+            contains_eager(Loan.license_pool).joinedload(
+                LicensePool.identifier
+            )
         )
 
     def local_holds(self, patron):
@@ -1153,7 +1409,49 @@ class CirculationAPI(object):
             LicensePool.collection_id.in_(self.collection_ids_for_sync)
         ).filter(
             Hold.patron==patron
+        ).options(
+            contains_eager(Hold.license_pool).joinedload(
+                LicensePool.identifier
+            )
+        )
+
+    def license_pools_for(self, infos):
+        """Find the LicensePools for a number of CirculationInfo objects
+        with a single query.
+
+        :param infos: A list of CirculationInfo objects.
+
+        :return: A dictionary mapping (collection ID, identifier type,
+            identifier) to LicensePool. If a CirculationInfo refers to a
+            LicensePool we've never seen before, the LicensePool is created
+            with `CirculationInfo.license_pool`.
+        """
+        keys = set(
+            (info.collection_id, info.identifier_type, info.identifier)
+            for info in infos
         )
+        pools = {}
+        if keys:
+            qu = self._db.query(LicensePool).join(
+                LicensePool.identifier
+            ).filter(
+                tuple_(
+                    LicensePool.collection_id, Identifier.type,
+                    Identifier.identifier
+                ).in_(list(keys))
+            ).options(contains_eager(LicensePool.identifier))
+            for pool in qu:
+                key = (
+                    pool.collection_id, pool.identifier.type,
+                    pool.identifier.identifier
+                )
+                pools[key] = pool
+
+        for info in infos:
+            key = (info.collection_id, info.identifier_type, info.identifier)
+            if key not in pools:
+                pools[key] = info.license_pool(self._db)
+        return pools
 
     def sync_bookshelf(self, patron, pin, force=False):
         """Sync our internal model of a patron's bookshelf with any external
@@ -1221,12 +1519,23 @@ class CirculationAPI(object):
             key = (i.type, i.identifier)
             local_holds_by_identifier[key] = h
 
+        # Find all the LicensePools mentioned by the remote loans and
+        # holds at once, rather than looking them up one at a time.
+        pools = self.license_pools_for(list(remote_loans) + list(remote_holds))
+
+        # Loans and holds we need to create are added to the session
+        # together and inserted on the next flush.
+        new_loans = {}
+        new_holds = {}
+
         active_loans = []
         active_holds = []
         for loan in remote_loans:
             # This is a remote loan. Find or create the corresponding
             # local loan.
-            pool = loan.license_pool(self._db)
+            pool = pools[
+                (loan.collection_id, loan.identifier_type, loan.identifier)
+            ]
             start = loan.start_date
             end = loan.end_date
             key = (loan.identifier_type, loan.identifier)
@@ -1241,8 +1550,15 @@ class CirculationAPI(object):
                     local_loan.start = start
                 if end:
                     local_loan.end = end
+            elif pool in new_loans:
+                # The remote mentioned this loan twice.
+                local_loan = new_loans[pool]
             else:
-                local_loan, new = pool.loan_to(patron, start, end)
+                local_loan = Loan(
+                    patron=patron, license_pool=pool, start=start or now,
+                    end=end
+                )
+                new_loans[pool] = local_loan
 
             if loan.locked_to:
                 # The loan source is letting us know that the loan is
@@ -1262,7 +1578,9 @@ class CirculationAPI(object):
         for hold in remote_holds:
             # This is a remote hold. Find or create the corresponding
             # local hold.
-            pool = hold.license_pool(self._db)
+            pool = pools[
+                (hold.collection_id, hold.identifier_type, hold.identifier)
+            ]
             start = hold.start_date
             end = hold.end_date
             position = hold.hold_position
@@ -1275,14 +1593,24 @@ class CirculationAPI(object):
                 # But maybe the remote's opinions as to the hold's
                 # start or end date have changed.
                 local_hold.update(start, end, position)
+            elif pool in new_holds:
+                # The remote mentioned this hold twice.
+                local_hold = new_holds[pool]
             else:
-                local_hold, new = pool.on_hold_to(patron, start, end, position)
+                if not patron.library.allow_holds:
+                    raise PolicyException(
+                        "Holds are disabled for this library."
+                    )
+                local_hold = Hold(patron=patron, license_pool=pool)
+                local_hold.update(start or now, end, position)
+                new_holds[pool] = local_hold
             active_holds.append(local_hold)
 
             # Check the local hold off the list we're keeping so that
             # we don't delete it later.
             if key in local_holds_by_identifier:
                 del local_holds_by_identifier[key]
+        self._db.add_all(new_loans.values() + new_holds.values())
 
         # We only want to delete local loans and holds if we were able to
         # successfully sync with all the providers. If there was an error,
@@ -1368,6 +1696,11 @@ class BaseCirculationAPI(object):
     BORROW_STEP = 'borrow'
     FULFILL_STEP = 'fulfill'
 
+    # CirculationAPI.patron_activity will wait this many seconds for
+    # this API's patron_activity to finish before giving up and
+    # treating the patron's bookshelf as incomplete.
+    PATRON_ACTIVITY_TIMEOUT = 20
+
     # In 3M only, when a book is in the 'reserved' state the patron
     # cannot revoke their hold on the book.
     CAN_REVOKE_HOLD_WHEN_RESERVED = True
@@ -2,6 +2,7 @@ import json
 import re
 import contextlib
 from copy import deepcopy
+from datetime import datetime
 
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_OAEP
@@ -127,6 +128,12 @@ class Configuration(CoreConfiguration):
     # The library-wide logo setting.
     LOGO = "logo"
 
+    # When the library's lanes were last changed through the admin
+    # interface. Lanes don't keep track of their own modification
+    # times, so scripts that keep lane feeds cached check this.
+    LANES_UPDATED = u"lanes_updated"
+    LANES_UPDATED_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
     # Settings for geographic areas associated with the library.
     LIBRARY_FOCUS_AREA = "focus_area"
     LIBRARY_SERVICE_AREA = "service_area"
@@ -553,6 +560,30 @@ class Configuration(CoreConfiguration):
             return None
         return MoneyUtility.parse(max_fines.value)
 
+    @classmethod
+    def lanes_updated(cls, library):
+        """When were the library's lanes last changed?
+
+        :return: A datetime, or None if we don't know.
+        """
+        value = ConfigurationSetting.for_library(
+            cls.LANES_UPDATED, library
+        ).value
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, cls.LANES_UPDATED_FORMAT)
+        except ValueError:
+            return None
+
+    @classmethod
+    def set_lanes_updated(cls, library, when=None):
+        """Record that the library's lanes were just changed."""
+        when = when or datetime.utcnow()
+        ConfigurationSetting.for_library(
+            cls.LANES_UPDATED, library
+        ).value = when.strftime(cls.LANES_UPDATED_FORMAT)
+
     @classmethod
     def load(cls, _db=None):
         CoreConfiguration.load(_db)
@@ -1,10 +1,12 @@
 import base64
+import copy
 import datetime
 import email
 import json
 import logging
 import os
 import sys
+import time
 import urllib
 import urlparse
 from collections import defaultdict
@@ -20,6 +22,10 @@ from flask import (
 )
 from flask_babel import lazy_gettext as _
 from lxml import etree
+from sqlalchemy import (
+    inspect,
+    select,
+)
 from sqlalchemy.orm import eagerload
 
 from adobe_vendor_id import (
@@ -39,6 +45,7 @@ from api.saml.controller import SAMLController
 from authenticator import (
     Authenticator,
     CirculationPatronProfileStorage,
+    LibraryAuthenticator,
     OAuthController,
 )
 from base_controller import BaseCirculationManagerController
@@ -69,6 +76,7 @@ from core.lane import (
     FeaturedFacets,
     Pagination,
     Lane,
+    LaneGenre,
     SearchFacets,
     WorkList,
 )
@@ -99,6 +107,7 @@ from core.model import (
     Representation,
     Session,
 )
+from core.model.configuration import ExternalIntegrationLink
 from core.opds import (
     AcquisitionFeed,
     NavigationFacets,
@@ -214,10 +223,233 @@ class CirculationManager(object):
         """
         last_update = Configuration.site_configuration_last_update(self._db)
         if last_update > self.site_configuration_last_update:
-            self.load_settings()
+            self.reload_settings()
             self.site_configuration_last_update = last_update
 
-    def load_settings(self):
+    def reload_settings(self):
+        """Reload the parts of the configuration that have changed
+        since the last time settings were loaded.
+
+        Most changes made in the administrative interface affect only
+        one library, so only that library's lanes, CirculationAPI and
+        authenticator need to be rebuilt. Anything else triggers a
+        full reload.
+        """
+        sitewide, by_library = self.configuration_fingerprints()
+        if (sitewide != self.sitewide_configuration_fingerprint
+            or set(by_library) != set(self.library_configuration_fingerprints)):
+            # A sitewide setting has changed, or a library has been
+            # added or removed.
+            return self.load_settings(fingerprints=(sitewide, by_library))
+
+        changed = [
+            library_id for library_id, fingerprint in by_library.items()
+            if fingerprint != self.library_configuration_fingerprints[library_id]
+        ]
+        if changed:
+            libraries = self._db.query(Library).filter(Library.id.in_(changed))
+            self.load_library_settings(libraries)
+        self.library_configuration_fingerprints = by_library
+
+    # Columns that change in the course of normal operation, rather
+    # than because someone changed the configuration. Leaving them out
+    # of the configuration fingerprints keeps them from triggering
+    # reloads.
+    NON_CONFIGURATION_COLUMNS = {
+        'Lane': set(['size', 'size_by_entrypoint']),
+    }
+
+    def configuration_fingerprints(self):
+        """Summarize the configuration that load_settings depends on.
+
+        :return: A 2-tuple (sitewide, by_library). `by_library` maps
+            each Library's ID to a fingerprint of the configuration
+            that affects only that library: its own settings, its
+            lanes, and the collections and integrations it uses,
+            including the links between those integrations.
+            `sitewide` is a fingerprint of everything else. A
+            fingerprint is a set of strings, one for each relevant
+            database row.
+        """
+        _db = self._db
+        sitewide = set()
+        by_library = defaultdict(set)
+
+        def row(item):
+            mapper = inspect(item).mapper
+            name = mapper.class_.__name__
+            ignored = self.NON_CONFIGURATION_COLUMNS.get(name, ())
+            return repr(
+                (name,) +
+                tuple(getattr(item, attr.key) for attr in mapper.column_attrs
+                      if attr.key not in ignored)
+            )
+
+        def associations(relationship, column=Library.__table__.c.id):
+            """Map the rows on the other side of a many-to-many
+            relationship to the IDs of the rows in `column`.
+            """
+            table = relationship.property.secondary
+            [ours] = [c for c in table.columns if c.references(column)]
+            [theirs] = [
+                c for c in table.columns if c.foreign_keys and c is not ours
+            ]
+            result = defaultdict(set)
+            for link in _db.execute(select([ours, theirs])):
+                result[link[1]].add(link[0])
+            return table.name, result
+
+        def add(item, library_ids):
+            if library_ids:
+                for library_id in library_ids:
+                    by_library[library_id].add(item)
+            else:
+                sitewide.add(item)
+
+        for library in _db.query(Library):
+            by_library[library.id].add(row(library))
+
+        # Work out which libraries use each collection and integration.
+        # Analytics integrations feed the sitewide Analytics object,
+        # so they're treated as sitewide no matter which libraries
+        # use them.
+        collections = _db.query(Collection).all()
+        name, libraries_for_collection = associations(Collection.libraries)
+        for collection in collections:
+            library_ids = libraries_for_collection[collection.id]
+            add(row(collection), library_ids)
+            for library_id in library_ids:
+                by_library[library_id].add(
+                    repr((name, collection.id, library_id))
+                )
+
+        name, libraries_for_integration = associations(
+            ExternalIntegration.libraries
+        )
+        sitewide_integrations = set()
+        for collection in collections:
+            libraries_for_integration[collection.external_integration_id] |= (
+                libraries_for_collection[collection.id]
+            )
+        for integration in _db.query(ExternalIntegration):
+            library_ids = libraries_for_integration[integration.id]
+            if integration.goal == ExternalIntegration.ANALYTICS_GOAL:
+                sitewide_integrations.add(integration.id)
+                library_ids = None
+            add(row(integration), library_ids)
+            add(repr((name, integration.id, sorted(library_ids or []))),
+                library_ids)
+
+        for setting in _db.query(ConfigurationSetting):
+            integration_id = setting.external_integration_id
+            if integration_id in sitewide_integrations:
+                library_ids = None
+            elif setting.library_id:
+                library_ids = [setting.library_id]
+            elif integration_id:
+                library_ids = libraries_for_integration[integration_id]
+            else:
+                library_ids = None
+            add(row(setting), library_ids)
+
+        # A link from a collection's integration to another integration
+        # (e.g. where to mirror its books) matters to every library
+        # that uses the collection.
+        for link in _db.query(ExternalIntegrationLink):
+            if link.library_id:
+                library_ids = [link.library_id]
+            else:
+                library_ids = libraries_for_integration[
+                    link.external_integration_id
+                ]
+            add(row(link), library_ids)
+
+        library_for_lane = {}
+        for lane in _db.query(Lane):
+            library_for_lane[lane.id] = lane.library_id
+            add(row(lane), [lane.library_id])
+        for lane_genre in _db.query(LaneGenre):
+            add(row(lane_genre), [library_for_lane[lane_genre.lane_id]])
+        name, lanes_for_customlist = associations(
+            Lane.customlists, Lane.__table__.c.id
+        )
+        for customlist_id, lane_ids in lanes_for_customlist.items():
+            for lane_id in lane_ids:
+                add(repr((name, lane_id, customlist_id)),
+                    [library_for_lane[lane_id]])
+
+        return sitewide, dict(by_library)
+
+    def load_library_settings(self, libraries):
+        """Rebuild the objects that depend on the configuration of
+        specific libraries, leaving the other libraries alone.
+
+        The new objects are swapped in all at once, so a request being
+        handled in the meantime sees either the old configuration or
+        the new one.
+        """
+        top_level_lanes = dict(self.top_level_lanes)
+        circulation_apis = dict(self.circulation_apis)
+        custom_index_views = dict(self.custom_index_views)
+        libraries_with_authdata = set(self.libraries_with_authdata)
+        auth = copy.copy(self.auth)
+        auth.library_authenticators = dict(self.auth.library_authenticators)
+        stale_authentication_documents = set()
+
+        for library in libraries:
+            self.log.info("Reloading configuration for %s", library.short_name)
+            top_level_lanes[library.id] = load_lanes(self._db, library)
+            custom_index_views[library.id] = CustomIndexView.for_library(
+                library
+            )
+            circulation_apis[library.id] = self.setup_circulation(
+                library, self.analytics
+            )
+
+            # The library's short name may have changed.
+            for short_name, authenticator in auth.library_authenticators.items():
+                if authenticator.library_id == library.id:
+                    del auth.library_authenticators[short_name]
+                    stale_authentication_documents.add(short_name)
+            stale_authentication_documents.add(library.short_name)
+            auth.library_authenticators[library.short_name] = (
+                LibraryAuthenticator.from_config(
+                    self._db, library, self.analytics
+                )
+            )
+
+            # The Adobe Vendor ID controller looks up patrons through
+            # the Authenticator, so it must get the new one.
+            libraries_with_authdata.discard(library.id)
+            if self.setup_adobe_vendor_id(self._db, library, auth):
+                libraries_with_authdata.add(library.id)
+
+        adobe_device_management = self.adobe_device_management
+        if not libraries_with_authdata:
+            adobe_device_management = None
+        elif not adobe_device_management:
+            adobe_device_management = DeviceManagementProtocolController(self)
+
+        self.top_level_lanes = top_level_lanes
+        self.circulation_apis = circulation_apis
+        self.custom_index_views = custom_index_views
+        self.libraries_with_authdata = libraries_with_authdata
+        self.adobe_device_management = adobe_device_management
+        self.auth = auth
+
+        # The shared collection API covers every collection, and any of
+        # these libraries' collections may have changed.
+        self.shared_collection_api = self.setup_shared_collection()
+
+        # Authentication documents for these libraries were built from
+        # the old configuration.
+        for short_name in stale_authentication_documents:
+            self.authentication_for_opds_documents.pop(short_name, None)
+
+        self.patron_web_domains = self.load_patron_web_domains()
+        self.setup_configuration_dependent_controllers()
+
+    def load_settings(self, fingerprints=None):
         """Load all necessary configuration settings and external
         integrations from the database.
 
@@ -225,12 +457,30 @@ class CirculationManager(object):
         initialized.  It may also be called later to reload the site
         configuration after changes are made in the administrative
         interface.
+
+        :param fingerprints: The output of configuration_fingerprints(),
+            if it has already been calculated.
         """
+        # Take the fingerprints before loading anything, so that a
+        # change made while we're loading is picked up next time.
+        (self.sitewide_configuration_fingerprint,
+         self.library_configuration_fingerprints) = (
+             fingerprints or self.configuration_fingerprints()
+        )
+
+        start = time.time()
         LogConfiguration.initialize(self._db)
         self.analytics = Analytics(self._db)
         self.auth = Authenticator(self._db, self.analytics)
+        self.log.info(
+            "Set up authenticators in %.2fsec", time.time() - start
+        )
 
+        phase_start = time.time()
         self.setup_external_search()
+        self.log.info(
+            "Set up search in %.2fsec", time.time() - phase_start
+        )
 
         # Track the Lane configuration for each library by mapping its
         # short name to the top-level lane.
@@ -245,7 +495,11 @@ class CirculationManager(object):
         self.sitewide_key_pair
 
         new_adobe_device_management = None
+        libraries_with_authdata = set()
+        library_ids = set()
         for library in self._db.query(Library):
+            library_ids.add(library.id)
+            phase_start = time.time()
             lanes = load_lanes(self._db, library)
 
             new_top_level_lanes[library.id] = lanes
@@ -259,19 +513,47 @@ class CirculationManager(object):
             )
 
             authdata = self.setup_adobe_vendor_id(self._db, library)
+            if authdata:
+                libraries_with_authdata.add(library.id)
             if authdata and not new_adobe_device_management:
                 # There's at least one library on this system that
                 # wants Vendor IDs. This means we need to advertise support
                 # for the Device Management Protocol.
                 new_adobe_device_management = DeviceManagementProtocolController(self)
+            self.log.info(
+                "Set up lanes and CirculationAPI for %s in %.2fsec",
+                library.short_name, time.time() - phase_start
+            )
+        adobe_library_id = self._adobe_vendor_id_library_id()
+        if adobe_library_id is not None and adobe_library_id not in library_ids:
+            # The library that provided the Adobe Vendor ID is gone.
+            self.adobe_vendor_id = None
         self.adobe_device_management = new_adobe_device_management
+        self.libraries_with_authdata = libraries_with_authdata
         self.top_level_lanes = new_top_level_lanes
         self.circulation_apis = new_circulation_apis
         self.custom_index_views = new_custom_index_views
         self.shared_collection_api = self.setup_shared_collection()
 
-        # Assemble the list of patron web client domains from individual
-        # library registration settings as well as a sitewide setting.
+        self.patron_web_domains = self.load_patron_web_domains()
+        self.setup_configuration_dependent_controllers()
+        authentication_document_cache_time = int(
+            ConfigurationSetting.sitewide(
+                self._db, Configuration.AUTHENTICATION_DOCUMENT_CACHE_TIME
+            ).value_or_default(0)
+        )
+        self.authentication_for_opds_documents = ExpiringDict(
+            max_len=1000, max_age_seconds=authentication_document_cache_time
+        )
+        self.wsgi_debug = ConfigurationSetting.sitewide(
+            self._db, Configuration.WSGI_DEBUG_KEY
+        ).bool_value or False
+        self.log.info("Loaded settings in %.2fsec", time.time() - start)
+
+    def load_patron_web_domains(self):
+        """Assemble the list of patron web client domains from individual
+        library registration settings as well as a sitewide setting.
+        """
         patron_web_domains = set()
 
         def get_domain(url):
@@ -299,19 +581,7 @@ class CirculationManager(object):
             if setting.value:
                 patron_web_domains.add(get_domain(setting.value))
 
-        self.patron_web_domains = patron_web_domains
-        self.setup_configuration_dependent_controllers()
-        authentication_document_cache_time = int(
-            ConfigurationSetting.sitewide(
-                self._db, Configuration.AUTHENTICATION_DOCUMENT_CACHE_TIME
-            ).value_or_default(0)
-        )
-        self.authentication_for_opds_documents = ExpiringDict(
-            max_len=1000, max_age_seconds=authentication_document_cache_time
-        )
-        self.wsgi_debug = ConfigurationSetting.sitewide(
-            self._db, Configuration.WSGI_DEBUG_KEY
-        ).bool_value or False
+        return patron_web_domains
 
     @property
     def external_search(self):
@@ -441,10 +711,30 @@ class CirculationManager(object):
         self.oauth_controller = OAuthController(self.auth)
         self.saml_controller = SAMLController(self, self.auth)
 
-    def setup_adobe_vendor_id(self, _db, library):
+    def _adobe_vendor_id_library_id(self):
+        """Find the ID of the library whose Adobe Vendor ID integration
+        the current AdobeVendorIDController was built from.
+
+        :return: A library ID, or None if there's no such controller.
+        """
+        library = getattr(
+            getattr(self, 'adobe_vendor_id', None), 'library', None
+        )
+        if library is None:
+            return None
+        # Don't go to the database; the library may have been deleted.
+        identity = inspect(library).identity
+        if not identity:
+            return None
+        return identity[0]
+
+    def setup_adobe_vendor_id(self, _db, library, auth=None):
         """If this Library has an Adobe Vendor ID integration,
         configure the controller for it.
 
+        :param auth: The Authenticator the controller should use to
+            look up patrons. Defaults to `self.auth`.
+
         :return: An Authdata object for `library`, if one could be created.
         """
         short_client_token_initialization_exceptions = dict()
@@ -473,12 +763,16 @@ class CirculationManager(object):
                     library,
                     vendor_id,
                     node_value,
-                    self.auth
+                    auth or self.auth
                 )
             else:
                 self.log.warn("Adobe Vendor ID controller is disabled due to missing or incomplete configuration. This is probably nothing to worry about.")
         if new_adobe_vendor_id:
             self.adobe_vendor_id = new_adobe_vendor_id
+        elif self._adobe_vendor_id_library_id() == library.id:
+            # This library used to provide the Adobe Vendor ID, but
+            # it doesn't anymore.
+            self.adobe_vendor_id = None
 
         # But almost all libraries will have a Short Client Token
         # setup. We're not setting anything up here, but this is useful
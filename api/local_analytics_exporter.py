@@ -27,24 +27,62 @@ from core.model import (
 class LocalAnalyticsExporter(object):
     """Export large numbers of analytics events in CSV format."""
 
+    # The number of rows to fetch from the database and write out as
+    # a single chunk of CSV.
+    CHUNK_SIZE = 1000
+
+    HEADER = [
+        "time", "event", "identifier", "identifier_type", "title", "author",
+        "fiction", "audience", "publisher", "imprint", "language",
+        "target_age", "genres", "location"
+    ]
+
     def export(self, _db, start, end, locations=None, library=None):
+        """Export analytics events as a single CSV document.
 
-        # Get the results from the database.
-        query = self.analytics_query(start, end, locations, library)
-        results = _db.execute(query)
+        This holds the entire document in memory; use export_chunks()
+        for large date ranges.
+        """
+        return b"".join(
+            self.export_chunks(_db, start, end, locations, library)
+        )
+
+    def export_chunks(self, _db, start, end, locations=None, library=None,
+                      chunk_size=None):
+        """Export analytics events in CSV format, one chunk at a time.
+
+        The rows are read through a server-side cursor, so memory use
+        stays the same no matter how many events are exported.
+
+        :yield: A sequence of bytestrings which together make up a CSV
+            document.
+        """
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        query = self.analytics_query(
+            start, end, locations, library
+        ).execution_options(stream_results=True)
 
-        # Write the CSV file to a BytesIO.
-        header = [
-            "time", "event", "identifier", "identifier_type", "title", "author",
-            "fiction", "audience", "publisher", "imprint", "language",
-            "target_age", "genres", "location"
-        ]
         output = BytesIO()
         writer = csv.writer(output, encoding="utf-8")
-        writer.writerow(header)
-        writer.writerows(results)
+        writer.writerow(self.HEADER)
 
-        return output.getvalue()
+        results = _db.execute(query)
+        try:
+            while True:
+                rows = results.fetchmany(chunk_size)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        finally:
+            results.close()
+
+        # If there were no events, we still need to send the header.
+        data = output.getvalue()
+        if data:
+            yield data
 
     def analytics_query(self, start, end,  locations=None, library=None):
         """Build a database query that fetches rows of analytics data.
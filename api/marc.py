@@ -1,13 +1,25 @@
-from pymarc import Field
+import datetime
+import logging
+import time
 import urllib
+from cStringIO import StringIO
+
+from pymarc import Field
 
 from core.config import Configuration
+from core.external_search import SortKeyPagination
+from core.lane import Lane
 from core.marc import (
     Annotator,
-    MARCExporter,
+    MARCExporter as CoreMARCExporter,
+    MARCExporterFacets,
 )
+from core.mirror import MirrorUploader
 from core.model import (
+    CachedMARCFile,
     ConfigurationSetting,
+    get_one_or_create,
+    Representation,
     Session,
 )
 
@@ -81,3 +93,178 @@ class LibraryAnnotator(Annotator):
                     indicators=["4", "0"],
                     subfields=["u", url],
                 ))
+
+
+class MARCFile(object):
+    """A MARC file being uploaded to a mirror, a batch of records at a time."""
+
+    def __init__(self, _db, mirror, library, lane, start_time, end_time,
+                 upload_batch_size):
+        """Constructor.
+
+        :param start_time: If this is provided, the file will only
+            contain works updated after this time.
+        """
+        self.library = library
+        self.lane = lane
+        self.start_time = start_time
+        self.end_time = end_time
+        self.upload_batch_size = upload_batch_size
+        self.url = mirror.marc_file_url(library, lane, end_time, start_time)
+        self.representation, ignore = get_one_or_create(
+            _db, Representation, url=self.url,
+            media_type=Representation.MARC_MEDIA_TYPE
+        )
+        self.upload = None
+        self.batch = StringIO()
+        self.batch_size = 0
+        self.records = 0
+
+    def includes(self, work):
+        """Does this file include records for the given work?"""
+        if not self.start_time:
+            return True
+        updated = work.last_update_time
+        return updated is not None and updated >= self.start_time
+
+    def write(self, record):
+        """Add a MARC record to the file, uploading the current batch if
+        it's big enough.
+        """
+        self.batch.write(record)
+        self.batch_size += 1
+        self.records += 1
+        if self.batch_size >= self.upload_batch_size:
+            self.upload_batch()
+
+    def upload_batch(self):
+        """Upload the current batch of records as one part of the
+        multi-part upload.
+        """
+        content = self.batch.getvalue()
+        if content:
+            self.upload.upload_part(content)
+        self.batch.close()
+        self.batch = StringIO()
+        self.batch_size = 0
+
+    def finish(self, _db):
+        """Record the fact that the file has been uploaded."""
+        self.representation.fetched_at = self.end_time
+        if self.representation.mirror_exception:
+            return
+        cached, is_new = get_one_or_create(
+            _db, CachedMARCFile, library=self.library,
+            lane=(self.lane if isinstance(self.lane, Lane) else None),
+            start_time=self.start_time,
+            create_method_kwargs=dict(representation=self.representation)
+        )
+        if not is_new:
+            cached.representation = self.representation
+        cached.end_time = self.end_time
+
+
+class MARCExporter(CoreMARCExporter):
+    """A MARCExporter that can create a lane's full MARC file and its file
+    of recent changes with a single pass through the lane.
+    """
+
+    log = logging.getLogger("MARC exporter")
+
+    def full_and_delta_records(
+        self, lane, annotator, mirror_integration, delta_start_time=None,
+        force_refresh=False, mirror=None, search_engine=None,
+        query_batch_size=500, upload_batch_size=7500,
+    ):
+        """Create and upload a MARC file containing every book in a lane
+        and, optionally, a second file containing only the books updated
+        since `delta_start_time`.
+
+        Every book in the lane is visited once, and each record is
+        written to every file that needs it. Records are uploaded in
+        batches of `upload_batch_size`, so no file is ever held in
+        memory all at once.
+
+        :return: The number of records in the full file.
+        """
+        _db = Session.object_session(self.library)
+        if not mirror:
+            storage_protocol = mirror_integration.protocol
+            mirror = MirrorUploader.implementation(mirror_integration)
+            if mirror.NAME != storage_protocol:
+                raise Exception(
+                    "Mirror integration does not match configured storage protocol"
+                )
+
+        # End time is before we start the query, because if any
+        # records are changed during the processing we may not catch
+        # them, and they should be handled again on the next run.
+        end_time = datetime.datetime.utcnow()
+
+        full = MARCFile(
+            _db, mirror, self.library, lane, None, end_time,
+            upload_batch_size
+        )
+        delta = None
+        if delta_start_time:
+            delta = MARCFile(
+                _db, mirror, self.library, lane, delta_start_time, end_time,
+                upload_batch_size
+            )
+
+        begin = time.time()
+        with mirror.multipart_upload(full.representation, full.url) as full.upload:
+            if delta:
+                with mirror.multipart_upload(
+                    delta.representation, delta.url
+                ) as delta.upload:
+                    self._write_records(
+                        _db, lane, annotator, [full, delta], force_refresh,
+                        search_engine, query_batch_size
+                    )
+            else:
+                self._write_records(
+                    _db, lane, annotator, [full], force_refresh,
+                    search_engine, query_batch_size
+                )
+        elapsed = time.time() - begin
+
+        for marc_file in (full, delta):
+            if marc_file:
+                marc_file.finish(_db)
+
+        self.log.info(
+            "Exported %d records (%d changed) in %.2f sec (%.2f records/sec).",
+            full.records, delta.records if delta else 0, elapsed,
+            full.records / elapsed if elapsed else 0
+        )
+        return full.records
+
+    def _write_records(self, _db, lane, annotator, marc_files, force_refresh,
+                       search_engine, query_batch_size):
+        """Create a MARC record for every book in the lane and write it to
+        every MARC file that should include it.
+        """
+        facets = MARCExporterFacets(start_time=None)
+        pagination = SortKeyPagination(size=query_batch_size)
+        while pagination is not None:
+            # Retrieve one 'page' of works from the search index.
+            works = lane.works(
+                _db, pagination=pagination, facets=facets,
+                search_engine=search_engine
+            )
+            for work in works:
+                record = self.create_record(
+                    work, annotator, force_refresh, self.integration
+                )
+                if not record:
+                    continue
+                data = record.as_marc()
+                for marc_file in marc_files:
+                    if marc_file.includes(work):
+                        marc_file.write(data)
+            pagination = pagination.next_page
+
+        # Upload whatever is left over.
+        for marc_file in marc_files:
+            marc_file.upload_batch()
@@ -1,5 +1,7 @@
+import itertools
 import json
 import logging
+import time
 import urllib
 from collections import Counter
 from flask_babel import lazy_gettext as _
@@ -45,7 +47,10 @@ from sqlalchemy.sql import (
     or_,
 )
 from sqlalchemy.orm import aliased
-from core.util.http import HTTP
+from core.util.http import (
+    HTTP,
+    RemoteIntegrationException,
+)
 
 class NoveListAPI(object):
 
@@ -87,6 +92,18 @@ class NoveListAPI(object):
 
     currentQueryIdentifier = None
 
+    # Rows are read from the database this many at a time.
+    QUERY_BATCH_SIZE = 1000
+
+    # Items are encoded and written to the upload this many at a time.
+    UPLOAD_BATCH_SIZE = 1000
+
+    # An upload that fails because of a network or server problem is
+    # started over this many times, waiting UPLOAD_RETRY_DELAY
+    # seconds longer each time.
+    UPLOAD_RETRIES = 3
+    UPLOAD_RETRY_DELAY = 30
+
     medium_to_book_format_type_values = {
         Edition.BOOK_MEDIUM : u"EBook",
         Edition.AUDIO_MEDIUM : u"Audiobook",
@@ -462,12 +479,24 @@ class NoveListAPI(object):
     def get_items_from_query(self, library):
         """Gets identifiers and its related title, medium, and authors from the
         database.
+
+        :return: a list of Novelist objects to send
+        """
+        return list(self.items_from_query(library))
+
+    def items_from_query(self, library):
+        """Gets identifiers and its related title, medium, and authors from the
+        database, one item at a time.
+
+        The rows are read through a server-side cursor, so only
+        QUERY_BATCH_SIZE of them are held in memory at once.
+
         Keeps track of the current 'ISBN' identifier and current item object that
         is being processed. If the next ISBN being processed is new, the existing one
-        gets added to the list of items. If the ISBN is the same, then we append
+        gets yielded. If the ISBN is the same, then we append
         the Author property since there are multiple contributors.
 
-        :return: a list of Novelist objects to send
+        :yield: Novelist objects to send
         """
         collectionList = []
         for c in library.collections:
@@ -503,9 +532,10 @@ class NoveListAPI(object):
             )
         ).order_by(i1.identifier, i2.identifier)
 
-        result = self._db.execute(isbnQuery)
+        result = self._db.execute(
+            isbnQuery.execution_options(stream_results=True)
+        )
 
-        items = []
         newItem = None
         existingItem = None
         currentIdentifier = None
@@ -514,24 +544,31 @@ class NoveListAPI(object):
         # previously processed object and the currently processed object because
         # the identifier could be the same. If it is, we update the data
         # object to send to Novelist.
-        for item in result:
-            if newItem:
-                existingItem = newItem
-            (currentIdentifier, existingItem, newItem, addItem) = (
-                self.create_item_object(item, currentIdentifier, existingItem)
-            )
-
-            if addItem and existingItem:
-                # The Role property isn't needed in the actual request.
-                del existingItem['role']
-                items.append(existingItem)
+        #
+        # The cursor is closed even if the caller stops iterating early.
+        try:
+            while True:
+                rows = result.fetchmany(self.QUERY_BATCH_SIZE)
+                if not rows:
+                    break
+                for item in rows:
+                    if newItem:
+                        existingItem = newItem
+                    (currentIdentifier, existingItem, newItem, addItem) = (
+                        self.create_item_object(item, currentIdentifier, existingItem)
+                    )
+
+                    if addItem and existingItem:
+                        # The Role property isn't needed in the actual request.
+                        del existingItem['role']
+                        yield existingItem
+        finally:
+            result.close()
 
         # For the case when there's only one item in `result`
         if newItem:
             del newItem['role']
-            items.append(newItem)
-
-        return items
+            yield newItem
 
     def create_item_object(self, object, currentIdentifier, existingItem):
         """Returns a new item if the current identifier that was processed
@@ -617,32 +654,95 @@ class NoveListAPI(object):
             return (isbn, existingItem, newItem, addItem)
 
     def put_items_novelist(self, library):
-        items = self.get_items_from_query(library)
-
-        content = None
-        if items:
-            data=json.dumps(self.make_novelist_data_object(items))
-            response = self.put(
-                self.COLLECTION_DATA_API,
-                {
-                    "AuthorizedIdentifier": self.AUTHORIZED_IDENTIFIER,
-                    "Content-Type": "application/json; charset=utf-8"
-                },
-                data=data
-            )
+        """Send information about every book in the library's
+        collections to NoveList.
+
+        Everything goes in a single request, since sending a second
+        request for the same customer may replace what the first one
+        sent. The request body is encoded as items are read from the
+        database, so neither the list of items nor the body is ever
+        held in memory.
+
+        :return: The parsed response from NoveList, or None if there
+            was nothing to send or the upload failed.
+        """
+        headers = {
+            "AuthorizedIdentifier": self.AUTHORIZED_IDENTIFIER,
+            "Content-Type": "application/json; charset=utf-8"
+        }
+        for attempt in range(self.UPLOAD_RETRIES + 1):
+            if attempt:
+                time.sleep(self.UPLOAD_RETRY_DELAY * attempt)
+
+            # A streamed body can only be read once, so each attempt
+            # reads the items from the database again.
+            items = self.items_from_query(library)
+            try:
+                first = next(items, None)
+                if first is None:
+                    return None
+                response = self.put(
+                    self.COLLECTION_DATA_API, headers,
+                    data=self.novelist_data_stream(
+                        itertools.chain([first], items)
+                    )
+                )
+            except RemoteIntegrationException, e:
+                self.log.warn(
+                    "Attempt %d to send items to NoveList failed: %s",
+                    attempt + 1, e
+                )
+                continue
+            finally:
+                items.close()
+
             if (response.status_code == 200):
-                content = json.loads(response.content)
-                logging.info(
+                self.log.info(
                     "Success from NoveList: %r", response.content
                 )
-            else:
-                logging.error("Data sent was: %r", data)
-                logging.error(
-                    "Error %s from NoveList: %r", response.status_code,
-                    response.content
-                )
+                return json.loads(response.content)
+            # NoveList rejected the data; sending it again won't help.
+            self.log.error(
+                "Error %s from NoveList: %r", response.status_code,
+                response.content
+            )
+            return None
+
+        self.log.error("Giving up on sending items to NoveList.")
+        return None
 
-        return content
+    def novelist_data_stream(self, items):
+        """Encode the same JSON document as make_novelist_data_object,
+        a piece at a time.
+
+        :param items: An iterator over the items to send.
+        :yield: Strings which together make up the request body.
+        """
+        yield '{"customer": %s, "records": [' % json.dumps(
+            "%s:%s" % (self.profile, self.password)
+        )
+        items_sent = 0
+        start = time.time()
+        batch = []
+        for item in items:
+            batch.append(json.dumps(item))
+            if len(batch) >= self.UPLOAD_BATCH_SIZE:
+                yield (", " if items_sent else "") + ", ".join(batch)
+                items_sent += len(batch)
+                self._log_upload_progress(items_sent, start)
+                batch = []
+        if batch:
+            yield (", " if items_sent else "") + ", ".join(batch)
+            items_sent += len(batch)
+            self._log_upload_progress(items_sent, start)
+        yield ']}'
+
+    def _log_upload_progress(self, items_sent, start):
+        elapsed = time.time() - start
+        self.log.info(
+            "Items sent to NoveList: %d. Items per second: %.1f.",
+            items_sent, items_sent / elapsed if elapsed else 0
+        )
 
     def make_novelist_data_object(self, items):
         return {
@@ -6,6 +6,7 @@ import datetime
 from flask_babel import lazy_gettext as _
 import urlparse
 from collections import defaultdict
+from expiringdict import ExpiringDict
 import flask
 from flask import Response
 import feedparser
@@ -15,6 +16,7 @@ from StringIO import StringIO
 import re
 from uritemplate import URITemplate
 
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.sql.expression import or_
 
 from core.opds_import import (
@@ -159,6 +161,11 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
         EXPIRED_STATUS,
     ]
 
+    # A cached License Status Document this recent can be used to
+    # fulfill a loan without asking the distributor for it again, e.g.
+    # when a patron fulfills a loan right after borrowing it.
+    STATUS_DOCUMENT_MAX_AGE = datetime.timedelta(minutes=5)
+
     def __init__(self, _db, collection):
         if collection.protocol != self.NAME:
             raise ValueError(
@@ -174,6 +181,16 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
         self.password = collection.external_integration.password
         self.analytics = Analytics(_db)
 
+        # License Status Documents this ODLAPI has seen recently, keyed
+        # by the loan's status document URL. The cache only lives in
+        # this process, so it only helps when the same process handles
+        # the later request. Even a stale document is useful, since its
+        # ETag and Last-Modified date let us make a conditional request
+        # for the next one.
+        self.status_documents = ExpiringDict(
+            max_len=10000, max_age_seconds=3600*24
+        )
+
     def internal_format(self, delivery_mechanism):
         """Each consolidated copy is only available in one format, so we don't need
         a mapping to internal formats.
@@ -201,7 +218,7 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
         """
         return url_for(*args, **kwargs)
 
-    def get_license_status_document(self, loan):
+    def get_license_status_document(self, loan, max_age=None):
         """Get the License Status Document for a loan.
 
         For a new loan, create a local loan with no external identifier and
@@ -210,11 +227,17 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
         This will create the remote loan if one doesn't exist yet. The loan's
         internal database id will be used to receive notifications from the
         distributor when the loan's status changes.
+
+        :param max_age: If we have a cached copy of an existing loan's
+            document that's newer than this, it will be used instead
+            of asking the distributor.
         """
         _db = Session.object_session(loan)
 
         if loan.external_identifier:
-            url = loan.external_identifier
+            return self.fetch_license_status_document(
+                loan.external_identifier, max_age=max_age
+            )
         else:
             id = loan.license.identifier
             checkout_id = str(uuid.uuid1())
@@ -255,7 +278,9 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
                 notification_url=notification_url,
             )
         response = self._get(url)
+        return self._parse_license_status_document(url, response)
 
+    def _parse_license_status_document(self, url, response):
         try:
             status_doc = json.loads(response.content)
         except ValueError, e:
@@ -264,6 +289,48 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             raise BadResponseException(url, "License Status Document had an unknown status value.")
         return status_doc
 
+    def fetch_license_status_document(self, url, max_age=None):
+        """Get the License Status Document for an existing loan, and
+        cache it.
+
+        If we have a cached copy, the request is made conditional on
+        the document having changed since then.
+
+        :param url: The URL to the document, i.e. the loan's external
+            identifier.
+        :param max_age: If the cached copy is newer than this, it's
+            returned without contacting the distributor.
+        """
+        cached = self.status_documents.get(url)
+        if cached and max_age is not None and cached.is_fresh(max_age):
+            return cached.document
+
+        headers = {}
+        if cached:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        response = self._get(url, headers=headers or None)
+
+        if cached and response.status_code == 304:
+            # The document hasn't changed since we cached it.
+            status_doc = cached.document
+        else:
+            status_doc = self._parse_license_status_document(url, response)
+        self.cache_license_status_document(url, status_doc, response.headers)
+        return status_doc
+
+    def cache_license_status_document(self, url, status_doc, headers=None):
+        """Remember a License Status Document we've just received."""
+        if not url:
+            return
+        headers = headers or {}
+        self.status_documents[url] = CachedStatusDocument(
+            status_doc, etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+        )
+
     def checkin(self, patron, pin, licensepool):
         """Return a loan early."""
         _db = Session.object_session(patron)
@@ -349,10 +416,10 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             raise NoLicenses()
 
         # Make sure pool info is updated.
-        self.update_hold_queue(licensepool)
+        queue = self.update_hold_queue(licensepool)
 
         if hold:
-            self._update_hold_end_date(hold)
+            self._update_hold_end_date(hold, queue)
 
         # If there's a holds queue, the patron or client must have a non-expired hold
         # with position 0 to check out the book.
@@ -401,6 +468,10 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
         loan.end = expires
         loan.external_identifier = external_identifier
 
+        # The patron will probably fulfill the loan right away, so
+        # hold on to the document.
+        self.cache_license_status_document(external_identifier, doc)
+
         # We also need to update the remaining checkouts for the license.
         if loan.license.remaining_checkouts:
             loan.license.remaining_checkouts = loan.license.remaining_checkouts - 1
@@ -431,7 +502,9 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
 
     def _fulfill(self, loan):
         licensepool = loan.license_pool
-        doc = self.get_license_status_document(loan)
+        doc = self.get_license_status_document(
+            loan, max_age=self.STATUS_DOCUMENT_MAX_AGE
+        )
         status = doc.get("status")
 
         if status not in [self.READY_STATUS, self.ACTIVE_STATUS]:
@@ -471,76 +544,144 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             expires,
         )
 
-    def _count_holds_before(self, hold):
-        # Count holds on the license pool that started before this hold and
-        # aren't expired.
-        _db = Session.object_session(hold)
-        return _db.query(Hold).filter(
-            Hold.license_pool_id==hold.license_pool_id
+    def _hold_queue(self, licensepool):
+        """Find everything that determines the order of a LicensePool's
+        holds queue, in two queries.
+
+        The result can be passed into _update_hold_position,
+        _update_hold_end_date and _count_holds_before, so that
+        updating many holds for the same LicensePool doesn't mean
+        counting the same loans and holds over and over.
+
+        :return: A 2-tuple (loans, holds). `loans` is a list of the
+            pool's current Loans, and `holds` is a list of the Holds
+            that are waiting or reserved. Both are in order of start
+            date.
+        """
+        _db = Session.object_session(licensepool)
+        now = datetime.datetime.utcnow()
+        loans = _db.query(Loan).filter(
+            Loan.license_pool_id==licensepool.id
         ).filter(
-            Hold.start<hold.start
+            or_(
+                Loan.end==None,
+                Loan.end>now
+            )
+        ).order_by(Loan.start).all()
+        holds = _db.query(Hold).filter(
+            Hold.license_pool_id==licensepool.id
         ).filter(
             or_(
                 Hold.end==None,
-                Hold.end>datetime.datetime.utcnow(),
+                Hold.end>now,
                 Hold.position>0,
             )
-        ).count()
+        ).order_by(Hold.start).all()
+        return loans, holds
 
-    def _update_hold_end_date(self, hold):
-        _db = Session.object_session(hold)
+    def _count_holds_before(self, hold, queue=None):
+        # Count holds on the license pool that started before this hold and
+        # aren't expired.
+        if queue is None:
+            queue = self._hold_queue(hold.license_pool)
+        loans, holds = queue
+        if hold.start is None:
+            return 0
+        return len([
+            x for x in holds if x.start is not None and x.start < hold.start
+        ])
+
+    def _counts_of_holds_before(self, holds):
+        """Count the holds that started before each hold in a queue,
+        sorting the queue once instead of rescanning it for each hold.
+
+        :return: A dictionary mapping each Hold to the number that
+            _count_holds_before would give for it.
+        """
+        counts = dict((hold, 0) for hold in holds)
+        started = sorted(
+            [x for x in holds if x.start is not None], key=lambda x: x.start
+        )
+        count = 0
+        previous_start = None
+        for index, hold in enumerate(started):
+            # Holds that started at the same moment aren't ahead of
+            # each other.
+            if hold.start != previous_start:
+                count = index
+                previous_start = hold.start
+            counts[hold] = count
+        return counts
+
+    def _hold_periods(self, _db):
+        """Look up the collection's default loan and reservation periods,
+        so they can be used for a whole holds queue.
+
+        :return: A 2-tuple (loan_period, reservation_period).
+            `loan_period` is a function that takes a Library or
+            IntegrationClient and returns its default loan period in
+            days; each one is only looked up once.
+        """
+        collection = self.collection(_db)
+        loan_periods = {}
+        def loan_period(library_or_client):
+            if library_or_client not in loan_periods:
+                loan_periods[library_or_client] = collection.default_loan_period(
+                    library_or_client
+                )
+            return loan_periods[library_or_client]
+        return loan_period, collection.default_reservation_period
+
+    def _update_hold_end_date(self, hold, queue=None, periods=None):
         pool = hold.license_pool
+        if queue is None:
+            queue = self._hold_queue(pool)
+        if periods is None:
+            periods = self._hold_periods(Session.object_session(hold))
 
-        # First make sure the hold position is up-to-date, since we'll
+        # First find the hold's up-to-date position, since we'll
         # need it to calculate the end date.
-        original_position = hold.position
-        self._update_hold_position(hold)
+        position = self._hold_position(hold, queue)
+        hold.end = self._hold_end_date(hold, position, queue, periods)
+        hold.position = position
 
-        default_loan_period = self.collection(_db).default_loan_period(
-            hold.library or hold.integration_client
-        )
-        default_reservation_period = self.collection(_db).default_reservation_period
+    def _hold_end_date(self, hold, position, queue, periods, ends=None):
+        """Estimate when a hold will end, without changing it.
 
+        :param position: The hold's up-to-date position.
+        :param periods: The result of _hold_periods().
+        :param ends: A dictionary of end dates that have been
+            calculated for other holds in the queue but not stored yet.
+        """
         # If the hold was already to check out and already has an end date,
         # it doesn't need an update.
-        if hold.position == 0 and original_position == 0 and hold.end:
-            return
+        if position == 0 and hold.position == 0 and hold.end:
+            return hold.end
+
+        pool = hold.license_pool
+        loan_period, default_reservation_period = periods
+        default_loan_period = loan_period(hold.library or hold.integration_client)
+        ends = ends or {}
 
         # If the patron is in the queue, we need to estimate when the book
         # will be available for check out. We can do slightly better than the
         # default calculation since we know when all current loans will expire,
         # but we're still calculating the worst case.
-        elif hold.position > 0:
+        if position > 0:
             # Find the current loans and reserved holds for the licenses.
-            current_loans = _db.query(Loan).filter(
-                Loan.license_pool_id==pool.id
-            ).filter(
-                or_(
-                    Loan.end==None,
-                    Loan.end>datetime.datetime.utcnow()
-                )
-            ).order_by(Loan.start).all()
-            current_holds = _db.query(Hold).filter(
-                Hold.license_pool_id==pool.id
-            ).filter(
-                or_(
-                    Hold.end==None,
-                    Hold.end>datetime.datetime.utcnow(),
-                    Hold.position>0,
-                )
-            ).order_by(Hold.start).all()
+            current_loans, current_holds = queue
             licenses_reserved = min(pool.licenses_owned - len(current_loans), len(current_holds))
             current_reservations = current_holds[:licenses_reserved]
 
             # The licenses will have to go through some number of cycles
             # before one of them gets to this hold. This leavs out the first cycle -
             # it's already started so we'll handle it separately.
-            cycles = (hold.position - licenses_reserved - 1) / pool.licenses_owned
+            cycles = (position - licenses_reserved - 1) / pool.licenses_owned
 
             # Each of the owned licenses is currently either on loan or reserved.
             # Figure out which license this hold will eventually get if every
             # patron keeps their loans and holds for the maximum time.
-            copy_index = (hold.position - licenses_reserved - 1)  % pool.licenses_owned
+            copy_index = (position - licenses_reserved - 1)  % pool.licenses_owned
 
             # In the worse case, the first cycle ends when a current loan expires, or
             # after a current reservation is checked out and then expires.
@@ -548,74 +689,64 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
                 next_cycle_start = current_loans[copy_index].end
             else:
                 reservation = current_reservations[copy_index - len(current_loans)]
-                next_cycle_start = reservation.end + datetime.timedelta(days=default_loan_period)
+                reservation_end = ends.get(reservation, reservation.end)
+                next_cycle_start = reservation_end and (
+                    reservation_end + datetime.timedelta(days=default_loan_period)
+                )
+
+            if next_cycle_start is None:
+                # The loan or reservation ahead of this hold has no end
+                # date, so there's no way to estimate this one.
+                return None
 
             # Assume all cycles after the first cycle take the maximum time.
             cycle_period = default_loan_period + default_reservation_period
-            hold.end = next_cycle_start + datetime.timedelta(days=(cycle_period * cycles))
+            return next_cycle_start + datetime.timedelta(days=(cycle_period * cycles))
 
         # If the end date isn't set yet or the position just became 0, the
         # hold just became available. The patron's reservation period starts now.
-        else:
-            hold.end = datetime.datetime.utcnow() + datetime.timedelta(days=default_reservation_period)
+        return datetime.datetime.utcnow() + datetime.timedelta(days=default_reservation_period)
 
-    def _update_hold_position(self, hold):
-        _db = Session.object_session(hold)
+    def _update_hold_position(self, hold, queue=None):
+        if queue is None:
+            queue = self._hold_queue(hold.license_pool)
+        hold.position = self._hold_position(hold, queue)
+
+    def _hold_position(self, hold, queue, holds_count=None):
+        """Find a hold's up-to-date position, without changing it.
+
+        :param holds_count: The number of holds ahead of this one, if
+            it's already known.
+        """
         pool = hold.license_pool
-        loans_count = _db.query(Loan).filter(
-            Loan.license_pool_id==pool.id,
-        ).filter(
-            or_(
-                Loan.end==None,
-                Loan.end > datetime.datetime.utcnow()
-            )
-        ).count()
-        holds_count = self._count_holds_before(hold)
+        loans, holds = queue
+        if holds_count is None:
+            holds_count = self._count_holds_before(hold, queue)
 
-        remaining_licenses = pool.licenses_owned - loans_count
+        remaining_licenses = pool.licenses_owned - len(loans)
 
         if remaining_licenses > holds_count:
             # The hold is ready to check out.
-            hold.position = 0
-
-        else:
-            # Add 1 since position 0 indicates the hold is ready.
-            hold.position = holds_count + 1
+            return 0
 
-    def update_hold_queue(self, licensepool):
-        # Update the pool and the next holds in the queue when a license is reserved.
-        _db = Session.object_session(licensepool)
-
-        loans_count = _db.query(Loan).filter(
-            Loan.license_pool_id==licensepool.id
-        ).filter(
-            or_(
-                Loan.end==None,
-                Loan.end>datetime.datetime.utcnow()
-            )
-        ).count()
-        remaining_licenses = licensepool.licenses_owned - loans_count
+        # Add 1 since position 0 indicates the hold is ready.
+        return holds_count + 1
 
-        holds = _db.query(Hold).filter(
-            Hold.license_pool_id==licensepool.id
-        ).filter(
-            or_(
-                Hold.end==None,
-                Hold.end>datetime.datetime.utcnow(),
-                Hold.position>0,
-            )
-        ).order_by(
-            Hold.start
-        ).all()
+    def _update_availability(self, licensepool, loan_count, hold_count):
+        """Update a LicensePool's availability, given the number of
+        current loans and the number of holds that are waiting or
+        reserved.
+        """
+        remaining_licenses = licensepool.licenses_owned - loan_count
 
-        if len(holds) > remaining_licenses:
+        if hold_count > remaining_licenses:
             new_licenses_available = 0
             new_licenses_reserved = remaining_licenses
-            new_patrons_in_hold_queue = len(holds)
+            new_patrons_in_hold_queue = hold_count
         else:
-            new_licenses_available = remaining_licenses - len(holds)
-            new_licenses_reserved = len(holds)
-            new_patrons_in_hold_queue = len(holds)
+            new_licenses_available = remaining_licenses - hold_count
+            new_licenses_reserved = hold_count
+            new_patrons_in_hold_queue = hold_count
         licensepool.update_availability(
             licensepool.licenses_owned,
             new_licenses_available,
@@ -625,10 +756,124 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             as_of=datetime.datetime.utcnow(),
         )
 
-        for hold in holds[:licensepool.licenses_reserved]:
-            if hold.position != 0:
-                # This hold just got a reserved license.
-                self._update_hold_end_date(hold)
+    def update_hold_queue(self, licensepool):
+        """Update the pool and every hold in its queue.
+
+        :return: The result of _hold_queue(), which is still accurate
+            after this update.
+        """
+        queue = self._hold_queue(licensepool)
+        self._update_queue(licensepool, queue)
+        return queue
+
+    def _update_queue(self, licensepool, queue, periods=None):
+        """Bring a LicensePool's availability and the positions and end
+        dates of all its holds up to date, given the result of
+        _hold_queue().
+
+        Keeping every hold up to date here means patron_activity can
+        report holds as they're stored, without recalculating them.
+        """
+        loans, holds = queue
+        self._update_availability(licensepool, len(loans), len(holds))
+        if periods is None:
+            periods = self._hold_periods(Session.object_session(licensepool))
+
+        for hold, position, end in self._hold_queue_changes(
+            licensepool, queue, periods
+        ):
+            hold.position = position
+            hold.end = end
+
+    def _hold_queue_changes(self, licensepool, queue, periods):
+        """Work out the new position and end date of every hold in a
+        LicensePool's queue, without changing anything.
+
+        The pool's availability must already be up to date.
+
+        :return: A list of (Hold, position, end) 3-tuples, one for each
+            hold whose position or end date needs to change.
+        """
+        loans, holds = queue
+        reserved = licensepool.licenses_reserved
+        ends = {}
+        changes = []
+        holds_before = self._counts_of_holds_before(holds)
+        for index, hold in enumerate(holds):
+            if index < reserved and hold.position == 0:
+                # This hold already has its reserved license.
+                continue
+            position = self._hold_position(hold, queue, holds_before[hold])
+            if licensepool.licenses_owned > 0 or position == 0:
+                end = self._hold_end_date(hold, position, queue, periods, ends)
+            else:
+                # There's no way to estimate when this hold will
+                # become available.
+                end = hold.end
+            ends[hold] = end
+            if position != hold.position or end != hold.end:
+                changes.append((hold, position, end))
+        return changes
+
+    def delete_expired_reservations(self, _db, pool_ids, now):
+        """Delete every expired reservation in the given LicensePools
+        with one statement.
+
+        The pools' holds queues need to be updated afterwards, with
+        update_hold_queues.
+
+        :return: The number of holds deleted.
+        """
+        return _db.query(Hold).filter(
+            Hold.license_pool_id.in_(pool_ids)
+        ).filter(
+            Hold.end<now
+        ).filter(
+            Hold.position==0
+        ).delete(synchronize_session='fetch')
+
+    def update_hold_queues(self, _db, pool_ids, now=None):
+        """Update the availability and holds queues of many LicensePools
+        together, with a handful of queries and one batched write.
+        """
+        now = now or datetime.datetime.utcnow()
+
+        # Load the current loans and holds for every affected pool,
+        # with one query each, and work out each pool's new queue
+        # from them.
+        loans = defaultdict(list)
+        for loan in _db.query(Loan).filter(
+            Loan.license_pool_id.in_(pool_ids)
+        ).filter(
+            or_(Loan.end==None, Loan.end>now)
+        ).order_by(Loan.start):
+            loans[loan.license_pool_id].append(loan)
+        holds = defaultdict(list)
+        for hold in _db.query(Hold).filter(
+            Hold.license_pool_id.in_(pool_ids)
+        ).filter(
+            or_(Hold.end==None, Hold.end>now, Hold.position>0)
+        ).order_by(Hold.start):
+            holds[hold.license_pool_id].append(hold)
+
+        periods = self._hold_periods(_db)
+        changes = []
+        pools = _db.query(LicensePool).filter(
+            LicensePool.id.in_(pool_ids)
+        )
+        for pool in pools:
+            queue = (loans[pool.id], holds[pool.id])
+            self._update_availability(pool, len(queue[0]), len(queue[1]))
+            changes.extend(self._hold_queue_changes(pool, queue, periods))
+
+        # Write all the new hold positions and end dates at once.
+        if changes:
+            _db.bulk_update_mappings(Hold, [
+                dict(id=hold.id, position=position, end=end)
+                for hold, position, end in changes
+            ])
+            for hold, ignore, ignore in changes:
+                _db.expire(hold, ['position', 'end'])
 
     def place_hold(self, patron, pin, licensepool, notification_email_address):
         """Create a new hold."""
@@ -697,23 +942,53 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             Loan.patron==patron
         ).filter(
             Loan.end>=datetime.datetime.utcnow()
+        ).options(
+            contains_eager(Loan.license_pool).joinedload(LicensePool.identifier)
         )
 
-        # Get the patron's holds. If there are any expired holds, delete them.
-        # Update the end date and position for the remaining holds.
+        # Get the patron's holds. Hold positions and end dates are kept
+        # up to date by update_hold_queue() and ODLHoldReaper, so they
+        # can usually be reported as-is.
+        now = datetime.datetime.utcnow()
         holds = _db.query(Hold).join(Hold.license_pool).filter(
             LicensePool.collection_id==self.collection_id
         ).filter(
             Hold.patron==patron
         )
-        remaining_holds = []
-        for hold in holds:
-            if hold.end and hold.end < datetime.datetime.utcnow():
-                _db.delete(hold)
-                self.update_hold_queue(hold.license_pool)
-            else:
-                self._update_hold_end_date(hold)
-                remaining_holds.append(hold)
+
+        # But if anyone's reservation has expired in a pool the patron
+        # is waiting for, the patron's position may have moved up, or
+        # the patron may be the one whose reservation expired. Don't
+        # wait for the reaper -- delete the expired reservations and
+        # update those queues now, with one batched write.
+        pool_ids = [
+            pool_id for [pool_id] in holds.with_entities(Hold.license_pool_id)
+        ]
+        if pool_ids:
+            expired_pool_ids = [
+                pool_id for [pool_id] in _db.query(
+                    Hold.license_pool_id
+                ).filter(
+                    Hold.license_pool_id.in_(pool_ids)
+                ).filter(
+                    Hold.end<now
+                ).filter(
+                    Hold.position==0
+                ).distinct()
+            ]
+            if expired_pool_ids:
+                self.delete_expired_reservations(_db, expired_pool_ids, now)
+                self.update_hold_queues(_db, expired_pool_ids, now)
+
+        holds = holds.filter(
+            or_(
+                Hold.end==None,
+                Hold.end>=now,
+                Hold.position>0,
+            )
+        ).options(
+            contains_eager(Hold.license_pool).joinedload(LicensePool.identifier)
+        )
 
         return [
             LoanInfo(
@@ -734,7 +1009,7 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
                 start_date=hold.start,
                 end_date=hold.end,
                 hold_position=hold.position,
-            ) for hold in remaining_holds
+            ) for hold in holds
         ]
 
     def update_loan(self, loan, status_doc=None):
@@ -745,6 +1020,12 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
 
         if not status_doc:
             status_doc = self.get_license_status_document(loan)
+        else:
+            # The document came from a notification, so it's the
+            # most recent one there is.
+            self.cache_license_status_document(
+                loan.external_identifier, status_doc
+            )
 
         status = status_doc.get("status")
         # We already check that the status is valid in get_license_status_document,
@@ -757,6 +1038,8 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             # and delete the loan.
 
             # If there are holds, the license is reserved for the next patron.
+            if loan.external_identifier:
+                self.status_documents.pop(loan.external_identifier, None)
             _db.delete(loan)
             self.update_hold_queue(loan.license_pool)
 
@@ -776,6 +1059,21 @@ class ODLAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
         return self._release_hold(hold)
 
 
+class CachedStatusDocument(object):
+    """A License Status Document, along with what we need to know to
+    decide whether it's still good.
+    """
+
+    def __init__(self, document, etag=None, last_modified=None, fetched=None):
+        self.document = document
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched or datetime.datetime.utcnow()
+
+    def is_fresh(self, max_age):
+        return datetime.datetime.utcnow() - self.fetched < max_age
+
+
 class ODLXMLParser(OPDSXMLParser):
     NAMESPACES = dict(OPDSXMLParser.NAMESPACES,
                       odl="http://opds-spec.org/odl")
@@ -922,38 +1220,81 @@ class ODLHoldReaper(CollectionMonitor):
     SERVICE_NAME = "ODL Hold Reaper"
     PROTOCOL = ODLAPI.NAME
 
-    def __init__(self, _db, collection=None, api=None, **kwargs):
+    def __init__(self, _db, collection=None, api=None, bulk=True, **kwargs):
+        """Constructor.
+
+        :param bulk: If this is True, expired holds are deleted and
+            hold queues are recalculated for all affected pools at
+            once, with a handful of queries. Otherwise each expired
+            hold is deleted and each pool's queue is updated
+            separately.
+        """
         super(ODLHoldReaper, self).__init__(_db, collection, **kwargs)
         self.api = api or ODLAPI(_db, collection)
+        self.bulk = bulk
 
-    def run_once(self, progress):
-        # Find holds that have expired.
-        expired_holds = self._db.query(Hold).join(
+    def expired_holds(self, now):
+        """Find holds in this collection whose reservations have expired."""
+        return self._db.query(Hold).join(
             Hold.license_pool
         ).filter(
             LicensePool.collection_id==self.api.collection_id
         ).filter(
-            Hold.end<datetime.datetime.utcnow()
+            Hold.end<now
         ).filter(
             Hold.position==0
         )
 
+    def run_once(self, progress):
+        now = datetime.datetime.utcnow()
+        if self.bulk:
+            total_deleted_holds, total_changed_pools = self.reap_in_bulk(now)
+        else:
+            total_deleted_holds, total_changed_pools = self.reap(now)
+
+        message = "Holds deleted: %d. License pools updated: %d" % (
+            total_deleted_holds,
+            total_changed_pools
+        )
+        progress = TimestampData(achievements=message)
+        return progress
+
+    def reap(self, now):
+        """Delete expired holds one at a time, then update the holds
+        queue for each affected LicensePool.
+
+        :return: A 2-tuple (holds deleted, pools updated).
+        """
         changed_pools = set()
         total_deleted_holds = 0
-        for hold in expired_holds:
+        for hold in self.expired_holds(now):
             changed_pools.add(hold.license_pool)
             self._db.delete(hold)
             total_deleted_holds += 1
 
         for pool in changed_pools:
             self.api.update_hold_queue(pool)
+        return total_deleted_holds, len(changed_pools)
 
-        message = "Holds deleted: %d. License pools updated: %d" % (
-            total_deleted_holds,
-            len(changed_pools)
+    def reap_in_bulk(self, now):
+        """Delete all expired holds with one statement, then update
+        the holds queues of all affected LicensePools together.
+
+        :return: A 2-tuple (holds deleted, pools updated).
+        """
+        pool_ids = [
+            pool_id for [pool_id] in self.expired_holds(now).with_entities(
+                Hold.license_pool_id
+            ).distinct()
+        ]
+        if not pool_ids:
+            return 0, 0
+
+        total_deleted_holds = self.api.delete_expired_reservations(
+            self._db, pool_ids, now
         )
-        progress = TimestampData(achievements=message)
-        return progress
+        self.api.update_hold_queues(self._db, pool_ids, now)
+        return total_deleted_holds, len(pool_ids)
 
 class MockODLAPI(ODLAPI):
     """Mock API for tests that overrides _get and _url_for and tracks requests."""
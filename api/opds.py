@@ -2,12 +2,17 @@ import datetime
 import urllib
 import copy
 import logging
+import flask
 from flask import url_for
+from expiringdict import ExpiringDict
 from lxml import etree
 from collections import defaultdict
 import uuid
 
-from sqlalchemy.orm import lazyload
+from sqlalchemy.orm import (
+    joinedload,
+    lazyload,
+)
 
 from core.cdn import cdnify
 from core.classifier import Classifier
@@ -37,6 +42,7 @@ from core.model import (
     LicensePoolDeliveryMechanism,
     Loan,
     Patron,
+    Resource,
     Session,
     Work,
     Edition,
@@ -500,6 +506,20 @@ class LibraryAnnotator(CirculationManagerAnnotator):
         Configuration.HELP_URI,
     ]
 
+    AUTHOR_TAG = '{%s}author' % OPDSFeed.ATOM_NS
+    AUTHOR_NAME_TAG = '{%s}name' % OPDSFeed.ATOM_NS
+
+    # Targets for the links generated by _work_entry_links.
+    ENTRY = 'entry'
+    AUTHOR = 'author'
+    SERIES = 'series'
+
+    # The patron-independent links for each work's entry, shared by
+    # every LibraryAnnotator in this process. The key changes
+    # whenever the work's presentation or active license pool
+    # changes, so old values simply age out.
+    WORK_ENTRY_LINKS = ExpiringDict(max_len=20000, max_age_seconds=3600)
+
     def __init__(self, circulation, lane, library, patron=None,
                  active_loans_by_work={}, active_holds_by_work={},
                  active_fulfillments_by_work={},
@@ -668,91 +688,151 @@ class LibraryAnnotator(CirculationManagerAnnotator):
         return url
 
     def annotate_work_entry(self, work, active_license_pool, edition, identifier, feed, entry):
+        # Most of the links we add to a work's entry depend only on
+        # the work and the library, not on the patron, so they're
+        # generated once and cached.
+        issues_link, links = self.work_entry_links(work, identifier, entry)
+
         # Add a link for reporting problems.
-        feed.add_link_to_entry(
-            entry,
-            rel='issues',
-            href=self.url_for(
-                'report',
-                identifier_type=identifier.type,
-                identifier=identifier.identifier,
-                library_short_name=self.library.short_name,
-                _external=True
-            )
-        )
+        feed.add_link_to_entry(entry, **issues_link)
 
+        # The acquisition links depend on the patron's loans and holds,
+        # so they're generated fresh every time.
         super(LibraryAnnotator, self).annotate_work_entry(
             work, active_license_pool, edition, identifier, feed, entry
         )
 
-        # Add a link to each author tag.
-        self.add_author_links(work, feed, entry)
+        # Add a link to each author tag, a link to the series, and
+        # any links to related resources.
+        self.add_work_entry_links(links, feed, entry)
+
+    def work_entry_links_key(self, work, identifier, entry):
+        """Build a key into WORK_ENTRY_LINKS that changes whenever
+        any of the patron-independent links for this work's entry
+        would change.
+        """
+        if flask.has_request_context():
+            # url_for generates absolute URLs based on the incoming
+            # request.
+            url_root = flask.request.url_root
+        else:
+            url_root = None
+        return (
+            self.library.id, work.id, identifier.id, work.last_update_time,
+            tuple(self._author_names(entry)), self.identifies_patrons,
+            NoveListAPI.is_configured(self.library),
+            Analytics.is_configured(self.library),
+            self.test_mode, url_root
+        )
+
+    def work_entry_links(self, work, identifier, entry):
+        """Find the patron-independent links for this work's entry,
+        generating them if necessary.
+
+        :return: A 2-tuple (issues_link, links). `issues_link` is a
+            dictionary of arguments to OPDSFeed.add_link_to_entry.
+            `links` is a list of (target, arguments) 2-tuples, suitable
+            for passing into add_work_entry_links.
+        """
+        key = self.work_entry_links_key(work, identifier, entry)
+        links = self.WORK_ENTRY_LINKS.get(key)
+        if links is None:
+            links = self._work_entry_links(work, identifier, entry)
+            self.WORK_ENTRY_LINKS[key] = links
+        return links
+
+    def _work_entry_links(self, work, identifier, entry):
+        """Generate the patron-independent links for this work's entry."""
+        def url(route, **kwargs):
+            return self.url_for(
+                route, identifier_type=identifier.type,
+                identifier=identifier.identifier,
+                library_short_name=self.library.short_name,
+                _external=True, **kwargs
+            )
+
+        issues_link = dict(rel='issues', href=url('report'))
+
+        links = []
+        for contributor_name in self._author_names(entry):
+            links.append(
+                ((self.AUTHOR, contributor_name),
+                 self.author_link(work, contributor_name))
+            )
 
-        # And a series, if there is one.
         if work.series:
-            self.add_series_link(work, feed, entry)
+            links.append(((self.SERIES, None), self.series_link(work)))
 
         if NoveListAPI.is_configured(self.library):
             # If NoveList Select is configured, there might be
             # recommendations, too.
-            feed.add_link_to_entry(
-                entry,
+            links.append(((self.ENTRY, None), dict(
                 rel='recommendations',
                 type=OPDSFeed.ACQUISITION_FEED_TYPE,
                 title='Recommended Works',
-                href=self.url_for(
-                    'recommendations',
-                    identifier_type=identifier.type,
-                    identifier=identifier.identifier,
-                    library_short_name=self.library.short_name,
-                    _external=True
-                )
-            )
+                href=url('recommendations')
+            )))
 
         # Add a link for related books if available.
         if self.related_books_available(work, self.library):
-            feed.add_link_to_entry(
-                entry,
+            links.append(((self.ENTRY, None), dict(
                 rel='related',
                 type=OPDSFeed.ACQUISITION_FEED_TYPE,
                 title='Recommended Works',
-                href=self.url_for(
-                    'related_books',
-                    identifier_type=identifier.type,
-                    identifier=identifier.identifier,
-                    library_short_name=self.library.short_name,
-                    _external=True
-                )
-            )
+                href=url('related_books')
+            )))
 
         # Add a link to get a patron's annotations for this book.
         if self.identifies_patrons:
-            feed.add_link_to_entry(
-                entry,
+            links.append(((self.ENTRY, None), dict(
                 rel="http://www.w3.org/ns/oa#annotationService",
                 type=AnnotationWriter.CONTENT_TYPE,
-                href=self.url_for(
-                    'annotations_for_work',
-                    identifier_type=identifier.type,
-                    identifier=identifier.identifier,
-                    library_short_name=self.library.short_name,
-                    _external=True
-                )
-            )
+                href=url('annotations_for_work')
+            )))
 
         if Analytics.is_configured(self.library):
-            feed.add_link_to_entry(
-                entry,
+            links.append(((self.ENTRY, None), dict(
                 rel="http://librarysimplified.org/terms/rel/analytics/open-book",
-                href=self.url_for(
+                href=url(
                     'track_analytics_event',
-                    identifier_type=identifier.type,
-                    identifier=identifier.identifier,
-                    event_type=CirculationEvent.OPEN_BOOK,
-                    library_short_name=self.library.short_name,
-                    _external=True
+                    event_type=CirculationEvent.OPEN_BOOK
                 )
-            )
+            )))
+        return issues_link, links
+
+    def add_work_entry_links(self, links, feed, entry):
+        """Add links generated by _work_entry_links to an entry.
+
+        :param links: A list of (target, arguments) 2-tuples. `target`
+            says which tag the link goes into: the entry itself, the
+            <schema:Series> tag, or the <author> tag for a given
+            contributor.
+        """
+        author_entries = defaultdict(list)
+        for author_entry in entry.findall(self.AUTHOR_TAG):
+            name = author_entry.find(self.AUTHOR_NAME_TAG)
+            if name is not None and name.text:
+                author_entries[name.text].append(author_entry)
+
+        for (target, name), kwargs in links:
+            if target == self.AUTHOR:
+                parents = author_entries.get(name, [])
+            elif target == self.SERIES:
+                series_entry = entry.find(OPDSFeed.schema_('Series'))
+                if series_entry is None:
+                    # There is no <series> tag, and thus nothing to
+                    # annotate. This probably indicates an out-of-date
+                    # OPDS entry.
+                    self.log.error(
+                        'Series link generated for an entry with no <schema:Series> tag: %s',
+                        kwargs['title']
+                    )
+                parents = [series_entry]
+            else:
+                parents = [entry]
+            for parent in parents:
+                if parent is not None:
+                    feed.add_link_to_entry(parent, **kwargs)
 
     @classmethod
     def related_books_available(cls, work, library):
@@ -789,64 +869,64 @@ class LibraryAnnotator(CirculationManagerAnnotator):
 
         return language_key, audience_key
 
-    def add_author_links(self, work, feed, entry):
-        """Find all the <author> tags and add a link
-        to each one that points to the author's other works.
-        """
-        author_tag = '{%s}author' % OPDSFeed.ATOM_NS
-        author_entries = entry.findall(author_tag)
-
-        languages, audiences = self.language_and_audience_key_from_work(work)
-        for author_entry in author_entries:
-            name_tag = '{%s}name' % OPDSFeed.ATOM_NS
+    def _author_names(self, entry):
+        """Find the names of the authors listed in an entry, in order.
 
-            # A database ID would be better than a name, but the
-            # <author> tag was created as part of the work's cached
-            # OPDS entry, and as a rule we don't put database IDs into
-            # the cached OPDS entry.
-            #
-            # So we take the content of the <author> tag, use it in
-            # the link, and -- only if the user decides to fetch this feed
-            # -- we do a little extra work to turn this name back into
-            # one or more contributors.
-            #
-            # TODO: If we reliably had VIAF IDs for our contributors,
-            # we could stick them in the <author> tags and get the
-            # best of both worlds.
-            contributor_name = author_entry.find(name_tag).text
-            if not contributor_name:
-                continue
+        A database ID would be better than a name, but the <author>
+        tag was created as part of the work's cached OPDS entry, and
+        as a rule we don't put database IDs into the cached OPDS
+        entry.
 
-            feed.add_link_to_entry(
-                author_entry,
-                rel='contributor',
-                type=OPDSFeed.ACQUISITION_FEED_TYPE,
-                title=contributor_name,
-                href=self.url_for(
-                    'contributor',
-                    contributor_name=contributor_name,
-                    languages=languages,
-                    audiences=audiences,
-                    library_short_name=self.library.short_name,
-                    _external=True
-                )
-            )
+        So we take the content of the <author> tag, use it in the
+        link, and -- only if the user decides to fetch this feed --
+        we do a little extra work to turn this name back into one or
+        more contributors.
 
-    def add_series_link(self, work, feed, entry):
-        series_tag = OPDSFeed.schema_('Series')
-        series_entry = entry.find(series_tag)
+        TODO: If we reliably had VIAF IDs for our contributors, we
+        could stick them in the <author> tags and get the best of
+        both worlds.
+        """
+        names = []
+        for author_entry in entry.findall(self.AUTHOR_TAG):
+            name = author_entry.find(self.AUTHOR_NAME_TAG)
+            if name is None or not name.text or name.text in names:
+                continue
+            names.append(name.text)
+        return names
 
-        if series_entry is None:
-            # There is no <series> tag, and thus nothing to annotate.
-            # This probably indicates an out-of-date OPDS entry.
-            work_id = work.id
-            work_title = work.title
-            self.log.error(
-                'add_series_link() called on work %s ("%s"), which has no <schema:Series> tag in its OPDS entry.',
-                work_id, work_title
+    def author_link(self, work, contributor_name):
+        """Arguments to OPDSFeed.add_link_to_entry for a link to an
+        author's other works.
+        """
+        languages, audiences = self.language_and_audience_key_from_work(work)
+        return dict(
+            rel='contributor',
+            type=OPDSFeed.ACQUISITION_FEED_TYPE,
+            title=contributor_name,
+            href=self.url_for(
+                'contributor',
+                contributor_name=contributor_name,
+                languages=languages,
+                audiences=audiences,
+                library_short_name=self.library.short_name,
+                _external=True
             )
-            return
+        )
 
+    def add_author_links(self, work, feed, entry):
+        """Find all the <author> tags and add a link
+        to each one that points to the author's other works.
+        """
+        links = [
+            ((self.AUTHOR, name), self.author_link(work, name))
+            for name in self._author_names(entry)
+        ]
+        self.add_work_entry_links(links, feed, entry)
+
+    def series_link(self, work):
+        """Arguments to OPDSFeed.add_link_to_entry for a link to the
+        other works in a work's series.
+        """
         series_name = work.series
         languages, audiences = self.language_and_audience_key_from_work(work)
         href = self.url_for(
@@ -857,14 +937,30 @@ class LibraryAnnotator(CirculationManagerAnnotator):
             library_short_name=self.library.short_name,
             _external=True,
         )
-        feed.add_link_to_entry(
-            series_entry,
+        return dict(
             rel='series',
             type=OPDSFeed.ACQUISITION_FEED_TYPE,
             title=series_name,
             href=href
         )
 
+    def add_series_link(self, work, feed, entry):
+        series_tag = OPDSFeed.schema_('Series')
+        series_entry = entry.find(series_tag)
+
+        if series_entry is None:
+            # There is no <series> tag, and thus nothing to annotate.
+            # This probably indicates an out-of-date OPDS entry.
+            work_id = work.id
+            work_title = work.title
+            self.log.error(
+                'add_series_link() called on work %s ("%s"), which has no <schema:Series> tag in its OPDS entry.',
+                work_id, work_title
+            )
+            return
+
+        feed.add_link_to_entry(series_entry, **self.series_link(work))
+
     def annotate_feed(self, feed, lane):
         if self.patron:
             # A patron is authenticated.
@@ -1418,23 +1514,16 @@ class LibraryLoanAndHoldAnnotator(LibraryAnnotator):
             cls, circulation, patron, test_mode=False, **response_kwargs
     ):
         db = Session.object_session(patron)
-        active_loans_by_work = {}
-        for loan in patron.loans:
-            work = loan.work
-            if work:
-                active_loans_by_work[work] = loan
-        active_holds_by_work = {}
-        for hold in patron.holds:
-            work = hold.work
-            if work:
-                active_holds_by_work[work] = hold
+        active_loans_by_work, active_holds_by_work = cls.preload_loans_and_holds(
+            patron
+        )
 
         annotator = cls(
             circulation, None, patron.library, patron, active_loans_by_work, active_holds_by_work,
             test_mode=test_mode
         )
         url = annotator.url_for('active_loans', library_short_name=patron.library.short_name, _external=True)
-        works = patron.works_on_loan_or_on_hold()
+        works = set(active_loans_by_work.keys()) | set(active_holds_by_work.keys())
 
         feed_obj = AcquisitionFeed(db, "Active loans and holds", url, works, annotator)
         annotator.annotate_feed(feed_obj, None)
@@ -1444,6 +1533,58 @@ class LibraryLoanAndHoldAnnotator(LibraryAnnotator):
             response.last_modified = last_modified
         return response
 
+    @classmethod
+    def preload_loans_and_holds(cls, patron):
+        """Load everything needed to render a patron's loans feed.
+
+        Rendering an entry for a loan or hold touches its license pool,
+        work, identifier and delivery mechanisms, and the loan's
+        fulfillment. Loading these one loan at a time means a large
+        bookshelf takes a large number of queries, so they're loaded
+        up front in a fixed number of queries.
+
+        :return: A 2-tuple (active_loans_by_work, active_holds_by_work).
+        """
+        db = Session.object_session(patron)
+
+        def options(model):
+            pool = joinedload(model.license_pool)
+            mechanisms = pool.subqueryload(LicensePool.delivery_mechanisms)
+            return [
+                pool.joinedload(LicensePool.work).joinedload(
+                    Work.presentation_edition
+                ),
+                pool.joinedload(LicensePool.identifier),
+                mechanisms.joinedload(
+                    LicensePoolDeliveryMechanism.delivery_mechanism
+                ),
+                mechanisms.joinedload(
+                    LicensePoolDeliveryMechanism.resource
+                ).joinedload(Resource.representation),
+            ]
+
+        loans = db.query(Loan).filter(Loan.patron_id==patron.id).options(
+            joinedload(Loan.fulfillment).joinedload(
+                LicensePoolDeliveryMechanism.delivery_mechanism
+            ),
+            *options(Loan)
+        )
+        active_loans_by_work = {}
+        for loan in loans:
+            work = loan.work
+            if work:
+                active_loans_by_work[work] = loan
+
+        holds = db.query(Hold).filter(Hold.patron_id==patron.id).options(
+            *options(Hold)
+        )
+        active_holds_by_work = {}
+        for hold in holds:
+            work = hold.work
+            if work:
+                active_holds_by_work[work] = hold
+        return active_loans_by_work, active_holds_by_work
+
     @classmethod
     def single_item_feed(cls, circulation, item, fulfillment=None, test_mode=False,
                          feed_class=AcquisitionFeed, **response_kwargs):
@@ -4,9 +4,13 @@ import json
 import pytz
 import re
 import requests
+import time
 import flask
 import urlparse
+from expiringdict import ExpiringDict
 from flask_babel import lazy_gettext as _
+from multiprocessing.dummy import Pool as ThreadPool
+from threading import Thread
 
 from sqlalchemy.orm import contains_eager
 
@@ -57,6 +61,22 @@ from core.scripts import Script
 from circulation_exceptions import *
 from core.analytics import Analytics
 
+
+class OverdrivePatronToken(object):
+    """A patron's Overdrive OAuth token, as kept in memory by
+    OverdriveAPI.
+
+    This has the same `credential` and `expires` attributes as the
+    Credential it was copied from, so it can be used in place of the
+    Credential.
+    """
+
+    def __init__(self, credential, expires):
+        self.credential = credential
+        self.expires = expires
+        self.refreshing = False
+
+
 class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
 
     NAME = ExternalIntegration.OVERDRIVE
@@ -159,6 +179,15 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
         "PatronHasExceededCheckoutLimit_ForCPC": PatronLoanLimitReached,
     }
 
+    # Patron OAuth tokens are kept in memory, shared by every
+    # OverdriveAPI in this process, so that most requests made on
+    # behalf of a patron don't need to look up a Credential.
+    PATRON_TOKENS = ExpiringDict(max_len=10000, max_age_seconds=3600*24)
+
+    # A cached token that will expire within this time is refreshed
+    # in the background, while it's still usable.
+    PATRON_TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
     def __init__(self, _db, collection):
         super(OverdriveAPI, self).__init__(_db, collection)
         self.overdrive_bibliographic_coverage_provider = (
@@ -241,6 +270,12 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
                 # Refresh the token and try again.
                 self.refresh_patron_access_token(
                     patron_credential, patron, pin)
+                self.PATRON_TOKENS[self.patron_token_key(patron)] = (
+                    OverdrivePatronToken(
+                        patron_credential.credential,
+                        patron_credential.expires
+                    )
+                )
                 return self.patron_request(
                     patron, pin, url, extra_headers, data, True)
         else:
@@ -251,14 +286,74 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
             return response
 
     def get_patron_credential(self, patron, pin):
-        """Create an OAuth token for the given patron."""
+        """Create an OAuth token for the given patron.
+
+        If the token is in PATRON_TOKENS, it's used without touching
+        the database. If it's about to expire, a new one is requested
+        in the background.
+
+        :return: A Credential or an OverdrivePatronToken.
+        """
+        key = self.patron_token_key(patron)
+        token = self.PATRON_TOKENS.get(key)
+        now = datetime.datetime.utcnow()
+        if token and token.expires > now:
+            if token.expires - now < self.PATRON_TOKEN_REFRESH_MARGIN:
+                self.refresh_patron_token_in_background(token, patron, pin)
+            return token
+
         def refresh(credential):
             return self.refresh_patron_access_token(
                 credential, patron, pin)
-        return Credential.lookup(
+        credential = Credential.lookup(
             self._db, DataSource.OVERDRIVE, "OAuth Token", patron, refresh,
             collection=self.collection
         )
+        if credential.credential and credential.expires:
+            self.PATRON_TOKENS[key] = OverdrivePatronToken(
+                credential.credential, credential.expires
+            )
+        return credential
+
+    def patron_token_key(self, patron):
+        return (self.collection.id, patron.id)
+
+    def refresh_patron_token_in_background(self, token, patron, pin):
+        """Start a thread that gets a new OAuth token for a patron and
+        puts it into an OverdrivePatronToken.
+
+        Anything that needs the database is done here, before the
+        thread starts.
+        """
+        if token.refreshing:
+            return
+        token.refreshing = True
+        payload = self.patron_access_token_payload(patron, pin)
+        thread = Thread(
+            target=self._refresh_patron_token, args=(token, payload),
+            name="OverdrivePatronTokenRefresh"
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _refresh_patron_token(self, token, payload):
+        try:
+            response = self.token_post(self.PATRON_TOKEN_ENDPOINT, payload)
+            if response.status_code == 200:
+                self._update_credential(token, response.json())
+            else:
+                # The old token will be used until it expires, and
+                # then a new one will be requested the normal way.
+                self.log.warn(
+                    "Could not refresh patron access token: status code %s",
+                    response.status_code
+                )
+        except Exception, e:
+            self.log.error(
+                "Error refreshing patron access token: %s", e, exc_info=e
+            )
+        finally:
+            token.refreshing = False
 
     def scope_string(self, library):
         """Create the Overdrive scope string for the given library.
@@ -277,20 +372,7 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
 
         Documentation: https://developer.overdrive.com/apis/patron-auth
         """
-        payload = dict(
-            grant_type="password",
-            username=patron.authorization_identifier,
-            scope=self.scope_string(patron.library)
-        )
-        if pin:
-            # A PIN was provided.
-            payload['password'] = pin
-        else:
-            # No PIN was provided. Depending on the library,
-            # this might be fine. If it's not fine, Overdrive will
-            # refuse to issue a token.
-            payload['password_required'] = 'false'
-            payload['password'] = '[ignore]'
+        payload = self.patron_access_token_payload(patron, pin)
         response = self.token_post(self.PATRON_TOKEN_ENDPOINT, payload)
         if response.status_code == 200:
             self._update_credential(credential, response.json())
@@ -307,6 +389,26 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
             raise PatronAuthorizationFailedException(message, debug)
         return credential
 
+    def patron_access_token_payload(self, patron, pin):
+        """Build the form data that asks Overdrive for an OAuth token
+        on behalf of a patron.
+        """
+        payload = dict(
+            grant_type="password",
+            username=patron.authorization_identifier,
+            scope=self.scope_string(patron.library)
+        )
+        if pin:
+            # A PIN was provided.
+            payload['password'] = pin
+        else:
+            # No PIN was provided. Depending on the library,
+            # this might be fine. If it's not fine, Overdrive will
+            # refuse to issue a token.
+            payload['password_required'] = 'false'
+            payload['password'] = '[ignore]'
+        return payload
+
     def checkout(self, patron, pin, licensepool, internal_format):
         """Check out a book on behalf of a patron.
 
@@ -1015,7 +1117,7 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
         replace = ReplacementPolicy.from_license_source(self._db)
         metadata.apply(edition, self.collection, replace=replace)
 
-    def update_licensepool(self, book_id):
+    def update_licensepool(self, book_id, lookup=None):
         """Update availability information for a single book.
 
         If the book has never been seen before, a new LicensePool
@@ -1025,12 +1127,19 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
         circulation information. Bibliographic coverage will be
         ensured for the Overdrive Identifier, and a Work will be
         created for the LicensePool and set as presentation-ready.
+
+        :param lookup: The result of calling circulation_lookup()
+            on `book_id`, if it has already been called (or the
+            exception it raised). If this is not provided,
+            circulation_lookup() will be called now.
         """
         # Retrieve current circulation information about this book
         try:
-            book, (status_code, headers, content) = self.circulation_lookup(
-                book_id
-            )
+            if lookup is None:
+                lookup = self.circulation_lookup(book_id)
+            if isinstance(lookup, Exception):
+                raise lookup
+            book, (status_code, headers, content) = lookup
         except Exception, e:
             status_code = None
             self.log.error(
@@ -1256,6 +1365,12 @@ class OverdriveCirculationMonitor(CollectionMonitor, TimelineMonitor):
     PROTOCOL = ExternalIntegration.OVERDRIVE
     OVERLAP = datetime.timedelta(minutes=1)
 
+    # Availability is looked up for this many books at once...
+    BATCH_SIZE = 50
+
+    # ...using this many threads.
+    WORKERS = 10
+
     def __init__(self, _db, collection, api_class=OverdriveAPI, analytics_class=Analytics):
         """Constructor."""
         super(OverdriveCirculationMonitor, self).__init__(_db, collection)
@@ -1268,6 +1383,10 @@ class OverdriveCirculationMonitor(CollectionMonitor, TimelineMonitor):
     def catch_up_from(self, start, cutoff, progress):
         """Find Overdrive books that changed recently.
 
+        Availability information is fetched for BATCH_SIZE books at a
+        time, using WORKERS threads, and the database is updated (and
+        committed) one batch at a time.
+
         :progress: A TimestampData representing the time previously
             covered by this Monitor.
         """
@@ -1277,26 +1396,104 @@ class OverdriveCirculationMonitor(CollectionMonitor, TimelineMonitor):
 
         # Ask for changes between the last time covered by the Monitor
         # and the current time.
+        started_at = time.time()
         total_books = 0
-        for book in self.recently_changed_ids(start, cutoff):
-            total_books += 1
-            if not total_books % 100:
-                self.log.info("%s books processed", total_books)
+        pool = None
+        if self.WORKERS > 1:
+            pool = ThreadPool(self.WORKERS)
+        try:
+            for batch, ignored in self.batches(
+                self.recently_changed_ids(start, cutoff)
+            ):
+                total_books += ignored
+                stop = False
+                for book, lookup in self.lookups(batch, pool):
+                    total_books += 1
+                    if not total_books % 100:
+                        self.log.info("%s books processed", total_books)
+                    license_pool, is_new, is_changed = self.api.update_licensepool(
+                        book, lookup=lookup
+                    )
+                    # Log a circulation event for this work.
+                    if is_new:
+                        for library in self.collection.libraries:
+                            self.analytics.collect_event(
+                                library, license_pool, CirculationEvent.DISTRIBUTOR_TITLE_ADD, license_pool.last_checked
+                            )
+
+                    if self.should_stop(start, book, is_changed):
+                        stop = True
+                        break
+                self._db.commit()
+                if stop:
+                    break
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        elapsed = time.time() - started_at
+        progress.achievements = "Books processed: %d. Books per second: %.1f." % (
+            total_books, total_books / max(elapsed, 0.001)
+        )
+
+    def batches(self, books):
+        """Split a sequence of books into batches of BATCH_SIZE.
+
+        :yield: A sequence of 2-tuples (batch, ignored); `ignored` is
+            the number of empty entries from `books` that were left
+            out of the batch.
+        """
+        batch = []
+        ignored = 0
+        for book in books:
             if not book:
+                ignored += 1
                 continue
-            license_pool, is_new, is_changed = self.api.update_licensepool(book)
-            # Log a circulation event for this work.
-            if is_new:
-                for library in self.collection.libraries:
-                    self.analytics.collect_event(
-                        library, license_pool, CirculationEvent.DISTRIBUTOR_TITLE_ADD, license_pool.last_checked
-                    )
+            batch.append(book)
+            if len(batch) >= self.BATCH_SIZE:
+                yield batch, ignored
+                batch = []
+                ignored = 0
+        if batch or ignored:
+            yield batch, ignored
+
+    def lookups(self, batch, pool=None):
+        """Fetch availability information for a batch of books.
+
+        :param pool: A ThreadPool to use for making the HTTP requests
+            concurrently. If this is not provided, no lookups are done
+            ahead of time and update_licensepool() will do them one at
+            a time.
+
+        :yield: A sequence of 2-tuples (book, lookup), in the same
+            order as `batch`, suitable for passing into
+            update_licensepool().
+        """
+        if not pool or len(batch) < 2:
+            for book in batch:
+                yield book, None
+            return
 
-            self._db.commit()
-            if self.should_stop(start, book, is_changed):
-                break
+        # Getting the OAuth token or the collection token may touch
+        # the database, which isn't safe from a worker thread. Make
+        # sure we already have them before starting the workers.
+        self.api.token
+        self.api.collection_token
 
-        progress.achievements = "Books processed: %d." % total_books
+        for book, lookup in zip(batch, pool.imap(self._lookup, batch)):
+            yield book, lookup
+
+    def _lookup(self, book):
+        """Call circulation_lookup() from a worker thread.
+
+        :return: Whatever circulation_lookup() returns, or the exception
+            it raised, to be handled by update_licensepool().
+        """
+        try:
+            return self.api.circulation_lookup(book)
+        except Exception, e:
+            return e
 
 
 class NewTitlesOverdriveCollectionMonitor(OverdriveCirculationMonitor):
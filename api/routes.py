@@ -12,7 +12,11 @@ from flask import (
 from flask_cors.core import get_cors_options, set_cors_headers
 from werkzeug.exceptions import HTTPException
 
-from app import app, babel
+from app import (
+    app,
+    babel,
+    initializer,
+)
 
 # We use URIs as identifiers throughout the application, meaning that
 # we never want werkzeug's merge_slashes feature.
@@ -30,7 +34,7 @@ from controller import CirculationManager
 from problem_details import REMOTE_INTEGRATION_FAILED
 from flask_babel import lazy_gettext as _
 
-@app.before_first_request
+@initializer
 def initialize_circulation_manager():
     if os.environ.get('AUTOINITIALIZE') == "False":
         # It's the responsibility of the importing code to set app.manager
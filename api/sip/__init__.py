@@ -4,7 +4,10 @@ from api.authenticator import (
     BasicAuthenticationProvider,
     PatronData,
 )
-from api.sip.client import SIPClient
+from api.sip.client import (
+    SIPClient,
+    SIPConnectionPool,
+)
 from core.util.http import RemoteIntegrationException
 from core.util import MoneyUtility
 from core.model import ExternalIntegration
@@ -148,24 +151,53 @@ class SIP2AuthenticationProvider(BasicAuthenticationProvider):
         else:
             self.fields_that_deny_borrowing = []
 
+    def make_client(self):
+        """Create a SIPClient for this integration's server."""
+        return SIPClient(
+            target_server=self.server, target_port=self.port,
+            login_user_id=self.login_user_id, login_password=self.login_password,
+            location_code=self.location_code, institution_id=self.institution_id, separator=self.field_separator,
+            use_ssl=self.use_ssl, ssl_cert=self.ssl_cert, ssl_key=self.ssl_key,
+            dialect=self.dialect
+        )
+
+    @property
+    def connection_pool(self):
+        """The pool of logged-in connections to this integration's
+        server.
+
+        The pool is shared with any other provider that uses the same
+        server and credentials, so it survives reloads of the site
+        configuration.
+        """
+        key = (
+            self.server, self.port, self.login_user_id,
+            self.login_password, self.location_code, self.institution_id,
+            self.field_separator, self.use_ssl, self.ssl_cert, self.ssl_key,
+            self.dialect
+        )
+        return SIPConnectionPool.for_key(key, self.make_client)
+
     def patron_information(self, username, password):
         try:
             if self.client:
+                # A client was provided for testing purposes. Run the
+                # whole session on it.
                 sip = self.client
-            else:
-                sip = SIPClient(
-                    target_server=self.server, target_port=self.port,
-                    login_user_id=self.login_user_id, login_password=self.login_password,
-                    location_code=self.location_code, institution_id=self.institution_id, separator=self.field_separator,
-                    use_ssl=self.use_ssl, ssl_cert=self.ssl_cert, ssl_key=self.ssl_key,
-                    dialect=self.dialect
-                )
-            sip.connect()
-            sip.login()
-            info = sip.patron_information(username, password)
-            sip.end_session(username, password)
-            sip.disconnect()
-            return info
+                sip.connect()
+                sip.login()
+                info = sip.patron_information(username, password)
+                sip.end_session(username, password)
+                sip.disconnect()
+                return info
+
+            # Use a connection that's already logged in, and leave it
+            # open for the next request. There's no need to end the
+            # session, since a patron information request doesn't
+            # start a patron session on the server.
+            return self.connection_pool.run(
+                lambda sip: sip.patron_information(username, password)
+            )
 
         except IOError, e:
             raise RemoteIntegrationException(
@@ -200,13 +232,7 @@ class SIP2AuthenticationProvider(BasicAuthenticationProvider):
         if self.client:
             sip = self.client
         else:
-            sip = SIPClient(
-                target_server=self.server, target_port=self.port,
-                login_user_id=self.login_user_id, login_password=self.login_password,
-                location_code=self.location_code, institution_id=self.institution_id, separator=self.field_separator,
-                use_ssl=self.use_ssl, ssl_cert=self.ssl_cert, ssl_key=self.ssl_key,
-                dialect=self.dialect
-            )
+            sip = self.make_client()
 
         connection = self.run_test(
             ("Test Connection"),
@@ -29,9 +29,12 @@ import datetime
 import logging
 import os
 import re
+import select
 import socket
 import ssl
 import tempfile
+import time
+from threading import Lock
 from api.sip.dialect import GenericILS
 
 # SIP2 defines a large number of fields which are used in request and
@@ -187,6 +190,9 @@ class SIPClient(Constants):
     # Maximum retries of a SIP message before failing.
     MAXIMUM_RETRIES = 5
 
+    # The characters that can end a SIP2 message (\r and \n).
+    MESSAGE_TERMINATORS = (13, 10)
+
     # These are the subfield names associated with the 'patron status'
     # field as specified in the SIP2 spec.
     CHARGE_PRIVILEGES_DENIED = 'charge privileges denied'
@@ -273,6 +279,7 @@ class SIPClient(Constants):
 
         self.sequence_number = 0
         self.connection = None
+        self.read_buffer = bytearray()
         self.login_user_id = login_user_id
         if login_user_id:
             if not login_password:
@@ -379,14 +386,74 @@ class SIPClient(Constants):
 
     def reset_connection_state(self):
         """Reset connection-specific state.
-        Specifically, the sequence number.
+        Specifically, the sequence number and any data that was
+        read but not yet used.
         """
         self.sequence_number = 0
+        self.read_buffer = bytearray()
 
     def disconnect(self):
         """Close the connection to the SIP server."""
         self.connection.close()
         self.connection = None
+        self.read_buffer = bytearray()
+
+    def is_connected(self):
+        """Does this client have a connection that still looks usable?
+
+        This doesn't send anything to the server. An idle SIP2
+        connection should never have anything to read, except maybe
+        the \n some servers send after the \r at the end of the last
+        response. If there's anything else, the server has either
+        closed the connection or sent something we weren't expecting,
+        and either way the connection shouldn't be reused.
+        """
+        if not self.connection:
+            return False
+        self._discard_terminators()
+        if self.read_buffer:
+            return False
+        while True:
+            try:
+                readable, ignore, ignore = select.select(
+                    [self.connection], [], [], 0
+                )
+            except (select.error, socket.error, ValueError), e:
+                return False
+            if not readable:
+                return True
+
+            # Something's waiting to be read. Find out whether it's
+            # just a leftover \n.
+            timeout = self.connection.gettimeout()
+            try:
+                self.connection.settimeout(0)
+                data = self.connection.recv(4096)
+            except (socket.error, ValueError), e:
+                return False
+            finally:
+                try:
+                    self.connection.settimeout(timeout)
+                except socket.error, e:
+                    pass
+            if not data:
+                # The server closed the connection.
+                return False
+            self.read_buffer.extend(data)
+            self._discard_terminators()
+            if self.read_buffer:
+                return False
+
+    def _discard_terminators(self):
+        """Remove the end of the previous message from the start of the
+        read buffer.
+        """
+        buffer = self.read_buffer
+        start = 0
+        while start < len(buffer) and buffer[start] in self.MESSAGE_TERMINATORS:
+            start += 1
+        if start:
+            del buffer[:start]
 
     def make_request(self, message_creator, parser, *args, **kwargs):
         """Send a request to a SIP server and parse the response.
@@ -775,20 +842,36 @@ class SIPClient(Constants):
     def read_message(self, max_size=1024*1024):
         """Read a SIP2 message from the socket connection.
 
-        A SIP2 message ends with a \\r character.
+        A SIP2 message ends with a \\r character, which some servers
+        follow with \\n. Anything received after the end of the message
+        is kept in the read buffer for the next call.
         """
-        done = False
-        data = ""
-        while not done:
-            tmp = self.connection.recv(4096)
-            data = data + tmp
-            if not tmp:
-                raise IOError("No data read from socket.")
-            if ord(data[-1]) == 13 or ord(data[-1]) == 10:
-                done = True
-            if len(data) > max_size:
+        buffer = self.read_buffer
+        while True:
+            # Skip the end of the previous message.
+            self._discard_terminators()
+
+            ends = [
+                buffer.find(chr(x)) for x in self.MESSAGE_TERMINATORS
+            ]
+            ends = [x for x in ends if x != -1]
+            if ends:
+                end = min(ends) + 1
+                message = str(buffer[:end])
+                del buffer[:end]
+                # If the rest of the terminator came along with the
+                # message, get rid of it now, so it doesn't look like
+                # unexpected data.
+                self._discard_terminators()
+                return message
+
+            if len(buffer) > max_size:
+                del buffer[:]
                 raise IOError("SIP2 response too large.")
-        return data
+            data = self.connection.recv(4096)
+            if not data:
+                raise IOError("No data read from socket.")
+            buffer.extend(data)
 
     def append_checksum(self, text, include_sequence_number=True):
         """Calculates checksum for passed-in message, and returns the message
@@ -832,6 +915,196 @@ class SIPClient(Constants):
         return text
 
 
+class SIPConnectionPool(object):
+    """A pool of SIPClients that are connected and logged in to a SIP2
+    server, ready to be reused.
+
+    Connecting and logging in takes several round trips (and an SSL
+    handshake, for servers that require it), so reusing a connection
+    makes a patron lookup much cheaper.
+    """
+
+    log = logging.getLogger("SIPConnectionPool")
+
+    # Keep at most this many idle connections to any one server.
+    MAX_IDLE = 5
+
+    # Close a connection that hasn't been used in this many seconds.
+    # SIP2 servers tend to drop idle connections on their own, so
+    # there's little point in keeping them around any longer.
+    IDLE_TIMEOUT = 60
+
+    # Pools are shared by everything in this process that talks to a
+    # given server with given credentials. A pool with no idle
+    # connections that isn't being used is forgotten, so a server or
+    # set of credentials that's no longer in use doesn't keep
+    # connections open for the life of the process.
+    _pools = {}
+    _pools_lock = Lock()
+
+    @classmethod
+    def for_key(cls, key, client_factory, **kwargs):
+        """Find or create the pool for the given key.
+
+        :param key: A hashable object that identifies the server and
+            credentials.
+        :param client_factory: A function that creates a SIPClient
+            (but doesn't connect it) for this server.
+        """
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls(client_factory, **kwargs)
+                cls._pools[key] = pool
+            return pool
+
+    @classmethod
+    def reap_all(cls):
+        """Close every pool's connections that have been idle too long,
+        and forget about pools that have nothing left in them.
+        """
+        stale = []
+        with cls._pools_lock:
+            for key, pool in cls._pools.items():
+                with pool.lock:
+                    stale.extend((pool, x) for x in pool._remove_stale())
+                    if not pool.idle and not pool.in_use:
+                        pool.dropped = True
+                        del cls._pools[key]
+        for pool, sip in stale:
+            pool.discard(sip)
+
+    def __init__(self, client_factory, max_idle=MAX_IDLE,
+                 idle_timeout=IDLE_TIMEOUT):
+        self.client_factory = client_factory
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+
+        # A list of (SIPClient, time last used) 2-tuples.
+        self.idle = []
+        self.lock = Lock()
+
+        # How many calls to run() are going on right now.
+        self.in_use = 0
+
+        # Set once reap_all() has forgotten about this pool. Nothing
+        # is returned to a dropped pool, since nothing would ever
+        # reap it.
+        self.dropped = False
+
+    def run(self, function):
+        """Call `function` with a connected, logged-in SIPClient.
+
+        If a reused connection turns out to be broken, the call is
+        retried once on a brand new connection.
+
+        :return: Whatever `function` returns.
+        """
+        with self.lock:
+            self.in_use += 1
+        try:
+            return self._run(function)
+        finally:
+            with self.lock:
+                self.in_use -= 1
+
+    def _run(self, function):
+        sip = self.checkout()
+        reused = sip is not None
+        if not reused:
+            sip = self.new_client()
+        try:
+            result = function(sip)
+        except IOError, e:
+            self.discard(sip)
+            if not reused:
+                raise
+            self.log.info(
+                "Reused SIP2 connection failed (%s), reconnecting.", e
+            )
+            sip = self.new_client()
+            try:
+                result = function(sip)
+            except Exception, e:
+                self.discard(sip)
+                raise
+        except Exception, e:
+            self.discard(sip)
+            raise
+        self.checkin(sip)
+        return result
+
+    def new_client(self):
+        """Connect and log in a new SIPClient."""
+        sip = self.client_factory()
+        try:
+            sip.connect()
+            sip.login()
+        except Exception, e:
+            self.discard(sip)
+            raise
+        return sip
+
+    def checkout(self):
+        """Take a healthy idle SIPClient out of the pool.
+
+        :return: A SIPClient, or None if there are no usable idle
+            connections.
+        """
+        # This is a good time to clean up after every pool, including
+        # pools nobody is checking connections out of anymore.
+        self.reap_all()
+        cutoff = time.time() - self.idle_timeout
+        stale = []
+        sip = None
+        with self.lock:
+            while self.idle:
+                candidate, last_used = self.idle.pop()
+                if last_used >= cutoff and candidate.is_connected():
+                    sip = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            self.discard(candidate)
+        return sip
+
+    def checkin(self, sip):
+        """Return a SIPClient to the pool once it's done with a request."""
+        with self.lock:
+            if not self.dropped and len(self.idle) < self.max_idle:
+                self.idle.append((sip, time.time()))
+                return
+        self.discard(sip)
+
+    def _remove_stale(self):
+        """Take the connections that have been idle too long out of
+        the pool. The caller must hold `self.lock`.
+
+        :return: A list of SIPClients to be discarded.
+        """
+        cutoff = time.time() - self.idle_timeout
+        stale = [sip for sip, last_used in self.idle if last_used < cutoff]
+        self.idle = [x for x in self.idle if x[1] >= cutoff]
+        return stale
+
+    def discard(self, sip):
+        """Close a SIPClient's connection without returning it to the
+        pool.
+        """
+        try:
+            sip.disconnect()
+        except Exception, e:
+            pass
+
+    def clear(self):
+        """Close all idle connections."""
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for sip, ignore in idle:
+            self.discard(sip)
+
+
 class MockSIPClient(SIPClient):
     """A SIP client that relies on canned responses rather than a socket
     connection.
@@ -849,6 +1122,7 @@ class MockSIPClient(SIPClient):
         self.requests = []
         self.responses = []
         self.status = []
+        self.connected = False
 
     def queue_response(self, response):
         self.responses.append(response)
@@ -858,8 +1132,12 @@ class MockSIPClient(SIPClient):
         # connection-specific variables.
         self.status.append("Creating new socket connection.")
         self.reset_connection_state()
+        self.connected = True
         return None
 
+    def is_connected(self):
+        return self.connected
+
     def do_send(self, data):
         self.write_count += 1
         self.requests.append(data)
@@ -872,4 +1150,4 @@ class MockSIPClient(SIPClient):
         return response
 
     def disconnect(self):
-        pass
+        self.connected = False
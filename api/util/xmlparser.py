@@ -0,0 +1,85 @@
+from io import BytesIO
+
+from lxml import etree
+
+from core.util.xmlparser import XMLParser
+
+
+class StreamingXMLParser(XMLParser):
+    """An XMLParser that can also process a document incrementally.
+
+    process_all() parses the entire document into memory before
+    handling any of it. process_stream() handles each matching element
+    as soon as its end tag is seen and then throws it away, so memory
+    use doesn't grow with the size of the document.
+    """
+
+    @classmethod
+    def response_stream(cls, response):
+        """Find a file-like object that reads the body of an HTTP response.
+
+        If the response was made with stream=True and its body hasn't
+        been read yet, this reads directly from the network. Otherwise
+        it reads from the body that's already in memory.
+        """
+        raw = getattr(response, 'raw', None)
+        if (raw is None or not hasattr(raw, 'read')
+            or getattr(response, '_content_consumed', False)):
+            return BytesIO(response.content)
+        # Have urllib3 undo any gzip or deflate Content-Encoding.
+        raw.decode_content = True
+        return raw
+
+    @classmethod
+    def qualified_tag(cls, tag, namespaces=None):
+        """Turn a tag name like "axis:title" into the "{namespace}title"
+        form lxml uses.
+        """
+        if ':' not in tag:
+            return tag
+        prefix, name = tag.split(':', 1)
+        namespace = (namespaces or {}).get(prefix)
+        if namespace is None:
+            return tag
+        return "{%s}%s" % (namespace, name)
+
+    def process_stream(self, source, tag, namespaces=None, handler=None):
+        """Process every element with the given tag, as it's parsed.
+
+        :param source: A file-like object, a requests Response, or a
+            string containing an XML document.
+        :param tag: The name of the elements to process, e.g. "Item"
+            or "axis:title". Unlike process_all(), this is a tag name,
+            not an XPath expression.
+        :param handler: Called on each element; defaults to process_one.
+
+        :yield: Whatever the handler returns for each element, unless
+            it returns None.
+        """
+        namespaces = namespaces or {}
+        handler = handler or self.process_one
+        if isinstance(source, unicode):
+            source = source.encode("utf8")
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+        elif not hasattr(source, 'read'):
+            source = self.response_stream(source)
+
+        elements = etree.iterparse(
+            source, events=("end",), recover=True,
+            tag=self.qualified_tag(tag, namespaces)
+        )
+        for ignore, element in elements:
+            data = handler(element, namespaces)
+
+            # We're done with this element. Clear it out, along with
+            # any earlier siblings, so the tree being built up by
+            # iterparse() doesn't grow.
+            element.clear()
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+            if data is not None:
+                yield data
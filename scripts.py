@@ -2,7 +2,9 @@
 import argparse
 import csv
 import logging
+import multiprocessing
 import os
+import re
 import sys
 import time
 from cStringIO import StringIO
@@ -29,7 +31,10 @@ from api.config import (
 from api.controller import CirculationManager
 from api.lanes import create_default_lanes
 from api.local_analytics_exporter import LocalAnalyticsExporter
-from api.marc import LibraryAnnotator as MARCLibraryAnnotator
+from api.marc import (
+    LibraryAnnotator as MARCLibraryAnnotator,
+    MARCExporter,
+)
 from api.novelist import (
     NoveListAPI
 )
@@ -57,8 +62,8 @@ from core.lane import (
     Pagination,
     Facets,
     FeaturedFacets,
+    WorkList,
 )
-from core.marc import MARCExporter
 from core.metadata_layer import (
     CirculationData,
     FormatData,
@@ -68,17 +73,20 @@ from core.metadata_layer import (
 from core.metadata_layer import MARCExtractor
 from core.mirror import MirrorUploader
 from core.model import (
+    CachedFeed,
     CachedMARCFile,
     CirculationEvent,
     Collection,
     ConfigurationSetting,
     Contribution,
     CustomList,
+    CustomListEntry,
     DataSource,
     DeliveryMechanism,
     Edition,
     ExternalIntegration,
     get_one,
+    get_one_or_create,
     Hold,
     Hyperlink,
     Identifier,
@@ -296,7 +304,117 @@ class UpdateStaffPicksScript(Script):
         return StringIO(representation.content)
 
 
-class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
+# In a worker process started by
+# ParallelLaneSweeper.process_lanes_in_parallel, this is the script
+# object that does the work.
+_lane_worker_script = None
+
+def _initialize_lane_worker(script_class, kwargs):
+    """Set up a worker process for a ParallelLaneSweeper.
+
+    Each worker creates its own script object -- and so its own
+    database session -- and keeps it for as long as it lives.
+    """
+    global _lane_worker_script
+    script = script_class(**kwargs)
+    script.initialize_lane_worker()
+    _lane_worker_script = script
+
+def _process_lane_in_worker(lane_id):
+    return _lane_worker_script.process_lane_by_id(lane_id)
+
+
+class ParallelLaneSweeper(object):
+    """A mixin for LaneSweeperScripts that can divide a library's lanes
+    among a number of worker processes.
+
+    The script must set `self.workers` and `self.cmd_args`.
+    """
+
+    def worker_kwargs(self):
+        """The keyword arguments used to create the script object in
+        each worker process.
+        """
+        return dict(cmd_args=self.cmd_args)
+
+    def initialize_lane_worker(self):
+        """Called once in each worker process, after the script object
+        is created.
+        """
+        pass
+
+    def lanes_for_library(self, library):
+        """Yield every WorkList in the library's lane hierarchy that
+        this script should process, in the same order
+        LaneSweeperScript would process them.
+        """
+        queue = [WorkList.top_level_for_library(self._db, library)]
+        while queue:
+            new_queue = []
+            for l in queue:
+                if isinstance(l, Lane):
+                    l = self._db.merge(l)
+                if self.should_process_lane(l):
+                    yield l
+                new_queue.extend(l.children)
+            queue = new_queue
+
+    def process_lanes_in_parallel(self, library):
+        """Divide the library's lanes among `self.workers` worker processes.
+
+        Lanes are handed out one at a time, so a worker that gets a
+        cheap lane moves on to the next one instead of waiting for
+        the others.
+        """
+        lane_ids = []
+        for lane in self.lanes_for_library(library):
+            if isinstance(lane, Lane):
+                lane_ids.append(lane.id)
+            else:
+                # This WorkList only exists in memory, so it can't
+                # be handed to another process. It's usually the
+                # top-level WorkList, so just do it here.
+                self.process_lane(lane)
+                self._db.commit()
+        if not lane_ids:
+            return
+
+        pool = multiprocessing.Pool(
+            min(self.workers, len(lane_ids)), _initialize_lane_worker,
+            (self.__class__, self.worker_kwargs())
+        )
+        try:
+            for result in pool.imap_unordered(_process_lane_in_worker, lane_ids):
+                self.lane_processed_in_worker(result)
+            pool.close()
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def process_lane_by_id(self, lane_id):
+        """Process a single lane, identified by its database ID.
+
+        This is how a worker process is told which lane to work on.
+
+        :return: Whatever should be passed into
+            lane_processed_in_worker() in the parent process.
+        """
+        lane = get_one(self._db, Lane, id=lane_id)
+        self.process_lane(lane)
+        self._db.commit()
+
+    def lane_processed_in_worker(self, result):
+        """Called in the parent process whenever a worker finishes a lane.
+
+        :param result: The return value of process_lane_by_id().
+        """
+        pass
+
+
+class CacheRepresentationPerLane(ParallelLaneSweeper, TimestampScript,
+                                 LaneSweeperScript):
 
     name = "Cache one representation per lane"
 
@@ -320,6 +438,17 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
             type=int,
             default=1
         )
+        parser.add_argument(
+            '--workers',
+            help='Generate feeds for this many lanes at once, each in its own process.',
+            type=int,
+            default=1
+        )
+        parser.add_argument(
+            '--incremental',
+            help='Only regenerate feeds that might have changed since the last successful run.',
+            dest='incremental', action='store_true',
+        )
         return parser
 
     def __init__(self, _db=None, cmd_args=None, testing=False, manager=None,
@@ -339,6 +468,10 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
         """
 
         super(CacheRepresentationPerLane, self).__init__(_db, *args, **kwargs)
+        self.cmd_args = cmd_args
+        self.testing = testing
+        self.lane_reports = []
+        self._changed_works = self.UNKNOWN
         self.parse_args(cmd_args)
         if not manager:
             manager = CirculationManager(self._db, testing=testing)
@@ -360,6 +493,8 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
                     self.log.warn("Ignored unrecognized language code %s", alpha)
         self.max_depth = parsed.max_depth
         self.min_depth = parsed.min_depth
+        self.workers = parsed.workers
+        self.incremental = parsed.incremental
 
         # Return the parsed arguments in case a subclass needs to
         # process more args.
@@ -404,25 +539,303 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
 
     cache_url_method = None
 
+    # The type of CachedFeed this script generates. In incremental
+    # mode, CachedFeeds of this type are kept fresh without being
+    # regenerated if nothing in them could have changed.
+    CACHED_FEED_TYPE = None
+
+    # If more than this many works have changed since the last run,
+    # an incremental run won't save any time, so we treat every lane
+    # as changed.
+    MAX_CHANGED_WORKS = 10000
+
+    # Used to distinguish between "we haven't checked which works have
+    # changed" and "we can't tell which works have changed".
+    UNKNOWN = object()
+
+    # Pulls the <id> of each entry out of a cached OPDS feed.
+    ENTRY_ID = re.compile("<id>([^<]+)</id>")
+
+    # Pulls the time a cached OPDS feed was generated out of the
+    # feed. The feed's own <updated> comes before any entry's.
+    FEED_UPDATED = re.compile("<updated>([^<]+)</updated>")
+    FEED_UPDATED_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+    def previous_run_start(self):
+        """When did the last successful run of this script start?
+
+        :return: A datetime, or None if the script has never run
+            successfully.
+        """
+        timestamp = get_one(
+            self._db, Timestamp, service=self.script_name,
+            service_type=Timestamp.SCRIPT_TYPE, collection=None
+        )
+        if not timestamp or timestamp.exception:
+            return None
+        return timestamp.start
+
+    def changed_works(self):
+        """Find the works whose presentation or availability changed
+        since the last successful run of this script.
+
+        :return: A dictionary mapping the URN of each changed work's
+            Identifier to the work's ID, or None if we can't tell which
+            works have changed.
+        """
+        if self._changed_works is not self.UNKNOWN:
+            return self._changed_works
+
+        since = self.previous_run_start()
+        if not since:
+            self.log.info("No previous run, treating every lane as changed.")
+            self._changed_works = None
+            return self._changed_works
+
+        qu = self._db.query(Work.id, Identifier).join(
+            Work.license_pools
+        ).join(
+            LicensePool.identifier
+        ).filter(
+            or_(Work.last_update_time > since, LicensePool.last_checked > since)
+        ).limit(self.MAX_CHANGED_WORKS+1)
+        changed = dict((identifier.urn, work_id) for work_id, identifier in qu)
+        if len(changed) > self.MAX_CHANGED_WORKS:
+            self.log.info(
+                "More than %d works changed since %s, treating every lane as changed.",
+                self.MAX_CHANGED_WORKS, since
+            )
+            changed = None
+        else:
+            self.log.info("%d works changed since %s.", len(changed), since)
+        self._changed_works = changed
+        return self._changed_works
+
+    def _cached_feeds(self, lane, facets=None):
+        """Find the CachedFeeds this script has generated for a lane.
+
+        :param facets: If this is provided, only CachedFeeds generated
+            for these Facets will be found.
+        """
+        qu = self._db.query(CachedFeed).filter(CachedFeed.lane_id==lane.id)
+        if self.CACHED_FEED_TYPE:
+            qu = qu.filter(CachedFeed.type==self.CACHED_FEED_TYPE)
+        if facets:
+            qu = qu.filter(CachedFeed.facets==unicode(facets.query_string))
+        return qu
+
+    def feed_generated(self, feed):
+        """When was this CachedFeed's content actually generated?
+
+        CachedFeed.timestamp can't tell us, since keep_cached_feeds()
+        moves it forward.
+
+        :return: A datetime, or None if we can't tell.
+        """
+        match = self.FEED_UPDATED.search(feed.content or "")
+        if not match:
+            return None
+        try:
+            return datetime.strptime(match.group(1), self.FEED_UPDATED_FORMAT)
+        except ValueError:
+            return None
+
+    def lanes_changed(self, library):
+        """Have any of this library's lanes been changed through the
+        admin interface since the last run?
+        """
+        since = self.previous_run_start()
+        if not since:
+            # changed_works() already treats every lane as changed.
+            return False
+        updated = Configuration.lanes_updated(library)
+        return updated is not None and updated > since
+
+    def customlists_changed(self, lane):
+        """Have any of the custom lists this lane draws its works from
+        changed since the last run?
+        """
+        since = self.previous_run_start()
+        if not since:
+            return False
+
+        list_ids = set()
+        data_source_ids = set()
+        while lane:
+            list_ids.update(x.id for x in lane.customlists)
+            if lane.list_datasource:
+                data_source_ids.add(lane.list_datasource.id)
+            if not lane.inherit_parent_restrictions:
+                break
+            lane = lane.parent
+        clauses = []
+        if list_ids:
+            clauses.append(CustomList.id.in_(list_ids))
+        if data_source_ids:
+            clauses.append(CustomList.data_source_id.in_(data_source_ids))
+        if not clauses:
+            return False
+
+        lists = self._db.query(CustomList.id).filter(or_(*clauses))
+        if lists.filter(CustomList.updated > since).first():
+            return True
+        entries = self._db.query(CustomListEntry.id).filter(
+            CustomListEntry.list_id.in_(lists.subquery())
+        ).filter(
+            or_(CustomListEntry.first_appearance > since,
+                CustomListEntry.most_recent_appearance > since)
+        )
+        return entries.first() is not None
+
+    def lane_has_changes(self, lane, facets=None):
+        """Could any of this lane's feeds have changed since the last run?
+
+        A feed could have changed if the lane itself, or one of the
+        custom lists it's based on, was changed. It could also have
+        changed if a changed work is currently in the lane (it may have
+        been added, or its position may have moved) or if a changed
+        work is mentioned in the cached feed (it may have left the lane).
+
+        A cached feed generated longer ago than the lane's
+        MAX_CACHE_AGE counts as changed, so feeds aren't carried
+        forward indefinitely.
+
+        :param facets: If this is provided, only consider the feeds
+            generated with these Facets.
+        """
+        changed = self.changed_works()
+        if changed is None:
+            return True
+        if not isinstance(lane, Lane):
+            # We can't look up the cached feeds for a WorkList that only
+            # exists in memory, so assume the worst if anything changed.
+            return bool(changed)
+        if self.lanes_changed(lane.library) or self.customlists_changed(lane):
+            return True
+
+        cutoff = datetime.utcnow() - timedelta(seconds=lane.MAX_CACHE_AGE)
+        for feed in self._cached_feeds(lane, facets):
+            generated = self.feed_generated(feed)
+            if not generated or generated < cutoff:
+                return True
+            if any(x in changed for x in self.ENTRY_ID.findall(feed.content or "")):
+                return True
+
+        if not changed:
+            return False
+        qu = lane.works_from_database(self._db, facets).filter(
+            Work.id.in_(changed.values())
+        )
+        return qu.first() is not None
+
+    def keep_cached_feeds(self, lane, facets=None):
+        """Mark a lane's cached feeds as up to date without regenerating
+        them, so they don't expire and get generated during a patron's
+        request instead.
+        """
+        if not isinstance(lane, Lane):
+            return
+        self._cached_feeds(lane, facets).update(
+            {CachedFeed.timestamp : datetime.utcnow()},
+            synchronize_session=False
+        )
+
     def process_library(self, library):
         begin = time.time()
-        client = self.app.test_client()
+        self.lane_reports = []
         ctx = self.app.test_request_context(base_url=self.base_url)
         ctx.push()
-        super(CacheRepresentationPerLane, self).process_library(library)
+        if self.workers > 1:
+            self.process_lanes_in_parallel(library)
+        else:
+            super(CacheRepresentationPerLane, self).process_library(library)
         ctx.pop()
         end = time.time()
         self.log.info(
             "Processed library %s in %.2fsec", library.short_name, end-begin
         )
+        self.report(self.lane_reports, end-begin)
+
+    def worker_kwargs(self):
+        kwargs = super(CacheRepresentationPerLane, self).worker_kwargs()
+        kwargs['testing'] = self.testing
+        return kwargs
+
+    def initialize_lane_worker(self):
+        # Each worker has its own CirculationManager, and generates
+        # feeds within its own request context.
+        ctx = self.app.test_request_context(base_url=self.base_url)
+        ctx.push()
+
+    def process_lane_by_id(self, lane_id):
+        """Process a single lane in a worker process.
+
+        :return: A report on the lane, as created by process_lane().
+        """
+        super(CacheRepresentationPerLane, self).process_lane_by_id(lane_id)
+        return self.lane_reports[-1]
+
+    def lane_processed_in_worker(self, report):
+        self.lane_reports.append(report)
+
+    def report(self, lane_reports, elapsed):
+        """Log a summary of the feeds generated for a number of lanes.
+
+        :param lane_reports: A list of (lane identifier, seconds,
+            bytes, feeds) 4-tuples, as created by process_lane().
+        :param elapsed: How many seconds it actually took to process
+            all of those lanes. With more than one worker, this is
+            less than the total time spent on the individual lanes.
+        """
+        if not lane_reports:
+            return
+        lane_time = sum(x[1] for x in lane_reports)
+        total_size = sum(x[2] for x in lane_reports)
+        total_feeds = sum(x[3] for x in lane_reports)
+        self.log.info(
+            "Generated %d feeds (%d bytes) for %d lanes in %.2f sec "
+            "(%.2f sec spent on lanes, %d worker(s)).",
+            total_feeds, total_size, len(lane_reports), elapsed,
+            lane_time, self.workers
+        )
+        # Slowest lanes first.
+        for identifier, elapsed, size, feeds in sorted(
+            lane_reports, key=lambda x: x[1], reverse=True
+        ):
+            self.log.info(
+                "%s: %d feeds, %d bytes, %.2f sec.", identifier, feeds,
+                size, elapsed
+            )
 
     def process_lane(self, lane):
         """Generate a number of feeds for this lane.
         One feed will be generated for each combination of Facets and
         Pagination objects returned by facets() and pagination().
+
+        A (lane identifier, seconds, bytes, feeds) report on the work
+        done is added to `self.lane_reports`.
         """
+        begin = time.time()
         cached_feeds = []
-        for facets in self.facets(lane):
+        if self.incremental and not self.lane_has_changes(lane):
+            self.log.info(
+                "Nothing has changed in %s, keeping its cached feeds.",
+                lane.full_identifier
+            )
+            self.keep_cached_feeds(lane)
+            facets_to_process = []
+        else:
+            facets_to_process = self.facets(lane)
+
+        for facets in facets_to_process:
+            if (facets and self.incremental
+                and not self.lane_has_changes(lane, facets)):
+                self.log.info(
+                    "Nothing has changed in %s for facets %s, keeping its cached feeds.",
+                    lane.full_identifier, facets.query_string
+                )
+                self.keep_cached_feeds(lane, facets)
+                continue
             for pagination in self.pagination(lane):
                 extra_description = ""
                 if facets:
@@ -443,6 +856,10 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
                         len(feed.data)
                     )
         total_size = sum(len(x.data) for x in cached_feeds)
+        end = time.time()
+        self.lane_reports.append(
+            (lane.full_identifier, end-begin, total_size, len(cached_feeds))
+        )
         return cached_feeds
 
     def facets(self, lane):
@@ -469,6 +886,8 @@ class CacheFacetListsPerLane(CacheRepresentationPerLane):
 
     name = "Cache paginated OPDS feed for each lane"
 
+    CACHED_FEED_TYPE = CachedFeed.PAGE_TYPE
+
     @classmethod
     def arg_parser(cls, _db):
         parser = CacheRepresentationPerLane.arg_parser(_db)
@@ -636,6 +1055,8 @@ class CacheOPDSGroupFeedPerLane(CacheRepresentationPerLane):
 
     name = "Cache OPDS grouped feed for each lane"
 
+    CACHED_FEED_TYPE = CachedFeed.GROUPS_TYPE
+
     def should_process_lane(self, lane):
         # OPDS grouped feeds are only generated for lanes that have sublanes.
         if not lane.children:
@@ -644,6 +1065,37 @@ class CacheOPDSGroupFeedPerLane(CacheRepresentationPerLane):
             return False
         return True
 
+    def lane_has_changes(self, lane, facets=None):
+        """A grouped feed features works from each of the lane's sublanes,
+        so it could have changed if any of them has changed.
+        """
+        if super(CacheOPDSGroupFeedPerLane, self).lane_has_changes(
+            lane, facets
+        ):
+            return True
+        if isinstance(lane, Lane):
+            for sublane in lane.sublanes:
+                if self.sublane_has_changes(sublane, facets):
+                    return True
+        return False
+
+    def sublane_has_changes(self, lane, facets):
+        """Check a sublane, and all of its sublanes, for changed works
+        and custom lists.
+        """
+        if self.customlists_changed(lane):
+            return True
+        changed = self.changed_works()
+        if changed:
+            qu = lane.works_from_database(self._db, facets).filter(
+                Work.id.in_(changed.values())
+            )
+            if qu.first() is not None:
+                return True
+        return any(
+            self.sublane_has_changes(x, facets) for x in lane.sublanes
+        )
+
     def do_generate(self, lane, facets, pagination, feed_class=None):
         title = lane.display_name
         annotator = self.app.manager.annotator(lane, facets=facets)
@@ -689,11 +1141,16 @@ class CacheOPDSGroupFeedPerLane(CacheRepresentationPerLane):
             )
             yield facets
 
-class CacheMARCFiles(LaneSweeperScript):
+class CacheMARCFiles(ParallelLaneSweeper, LaneSweeperScript):
     """Generate and cache MARC files for each input library."""
 
     name = "Cache MARC files"
 
+    # A Timestamp for this service records when the current run
+    # started. If the run is interrupted, the next run picks up where
+    # it left off instead of regenerating every file.
+    CHECKPOINT_SERVICE = "Cache MARC files checkpoint"
+
     @classmethod
     def arg_parser(cls, _db):
         parser = LaneSweeperScript.arg_parser(_db)
@@ -708,10 +1165,17 @@ class CacheMARCFiles(LaneSweeperScript):
             help="Generate new MARC files even if MARC files have already been generated recently enough",
             dest='force', action='store_true',
         )
+        parser.add_argument(
+            '--workers',
+            help='Generate MARC files for this many lanes at once, each in its own process.',
+            type=int,
+            default=1
+        )
         return parser
 
     def __init__(self, _db=None, cmd_args=None, *args, **kwargs):
         super(CacheMARCFiles, self).__init__(_db, *args, **kwargs)
+        self.cmd_args = cmd_args
         self.parse_args(cmd_args)
 
     def parse_args(self, cmd_args=None):
@@ -719,8 +1183,69 @@ class CacheMARCFiles(LaneSweeperScript):
         parsed = parser.parse_args(cmd_args)
         self.max_depth = parsed.max_depth
         self.force = parsed.force
+        self.workers = parsed.workers
         return parsed
 
+    def do_run(self, *args, **kwargs):
+        self.start_checkpoint()
+        super(CacheMARCFiles, self).do_run(*args, **kwargs)
+        self.finish_checkpoint()
+
+    def start_checkpoint(self):
+        """Record the start of a run, unless the previous run was
+        interrupted, in which case we'll resume it.
+        """
+        checkpoint, ignore = get_one_or_create(
+            self._db, Timestamp, service=self.CHECKPOINT_SERVICE,
+            service_type=Timestamp.SCRIPT_TYPE, collection=None
+        )
+        if checkpoint.start and not checkpoint.finish:
+            self.log.info(
+                "Resuming the run that started at %s.", checkpoint.start
+            )
+        else:
+            checkpoint.start = datetime.utcnow()
+            checkpoint.finish = None
+        self._db.commit()
+
+    def finish_checkpoint(self):
+        """Record the successful end of a run."""
+        checkpoint = get_one(
+            self._db, Timestamp, service=self.CHECKPOINT_SERVICE,
+            service_type=Timestamp.SCRIPT_TYPE, collection=None
+        )
+        checkpoint.finish = datetime.utcnow()
+        self._db.commit()
+
+    def current_run_start(self):
+        """When did the run currently in progress start?
+
+        :return: A datetime, or None if no run is in progress.
+        """
+        checkpoint = get_one(
+            self._db, Timestamp, service=self.CHECKPOINT_SERVICE,
+            service_type=Timestamp.SCRIPT_TYPE, collection=None
+        )
+        if not checkpoint or checkpoint.finish:
+            return None
+        return checkpoint.start
+
+    def done_in_current_run(self, library, lane):
+        """Has the current run already generated this lane's MARC file?"""
+        start = self.current_run_start()
+        if not start:
+            return False
+        qu = self._db.query(CachedMARCFile).filter(
+            CachedMARCFile.library==library
+        ).filter(
+            CachedMARCFile.lane==(lane if isinstance(lane, Lane) else None)
+        ).filter(
+            CachedMARCFile.start_time==None
+        ).filter(
+            CachedMARCFile.end_time >= start
+        )
+        return qu.count() > 0
+
     def should_process_library(self, library):
         integration = ExternalIntegration.lookup(
             self._db, ExternalIntegration.MARC_EXPORT,
@@ -729,7 +1254,10 @@ class CacheMARCFiles(LaneSweeperScript):
 
     def process_library(self, library):
         if self.should_process_library(library):
-            super(CacheMARCFiles, self).process_library(library)
+            if self.workers > 1:
+                self.process_lanes_in_parallel(library)
+            else:
+                super(CacheMARCFiles, self).process_library(library)
             self.log.info("Processed library %s" % library.name)
 
     def should_process_lane(self, lane):
@@ -747,6 +1275,12 @@ class CacheMARCFiles(LaneSweeperScript):
         else:
             library = lane.get_library(self._db)
 
+        if self.done_in_current_run(library, lane):
+            self.log.info(
+                "Skipping lane %s because it was done before this run was interrupted." % lane.display_name
+            )
+            return
+
         annotator = MARCLibraryAnnotator(library)
         exporter = exporter or MARCExporter.from_config(library)
 
@@ -786,20 +1320,16 @@ class CacheMARCFiles(LaneSweeperScript):
             self.log.info("No storage External Integration was found.")
             return
 
-        # First update the file with ALL the records.
-        records = exporter.records(
-            lane, annotator, storage_integration
-        )
-
-        # Then create a new file with changes since the last update.
+        # Update the file with ALL the records and, in the same pass,
+        # create a new file with changes since the last update.
         start_time = None
         if last_update:
             # Allow one day of overlap to ensure we don't miss anything due to script timing.
             start_time = last_update - timedelta(days=1)
 
-            records = exporter.records(
-                lane, annotator, storage_integration, start_time=start_time
-            )
+        exporter.full_and_delta_records(
+            lane, annotator, storage_integration, delta_start_time=start_time
+        )
 
 
 class AdobeAccountIDResetScript(PatronInputScript):
@@ -1878,4 +2408,5 @@ class LocalAnalyticsExportScript(Script):
         end = parsed.end
 
         exporter = exporter or LocalAnalyticsExporter()
-        output.write(exporter.export(self._db, start, end))
+        for chunk in exporter.export_chunks(self._db, start, end):
+            output.write(chunk)
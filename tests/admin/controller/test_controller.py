@@ -1534,6 +1534,10 @@ class TestLanesController(AdminControllerTest):
             assert None == lane.media
             assert 2 == lane.size
 
+            # The library's lanes were marked as changed, so scripts
+            # that keep lane feeds cached know to regenerate them.
+            assert None != Configuration.lanes_updated(self._default_library)
+
     def test_lane_delete_success(self):
         library = self._library()
         self.admin.add_role(AdminRole.LIBRARY_MANAGER, library)
@@ -1622,9 +1626,11 @@ class TestLanesController(AdminControllerTest):
         lane = self._lane("lane")
         lane.visible = True
         with self.request_context_with_library_and_admin("/"):
+            assert None == Configuration.lanes_updated(self._default_library)
             response = self.manager.admin_lanes_controller.hide_lane(lane.id)
             assert 200 == response.status_code
             assert False == lane.visible
+            assert None != Configuration.lanes_updated(self._default_library)
 
     def test_hide_lane_errors(self):
         with self.request_context_with_library_and_admin("/"):
@@ -1684,6 +1690,7 @@ class TestLanesController(AdminControllerTest):
             assert 1 == parent1.priority
             assert 0 == child2.priority
             assert 1 == child1.priority
+            assert None != Configuration.lanes_updated(library)
 
 class TestDashboardController(AdminControllerTest):
 
@@ -1691,6 +1698,13 @@ class TestDashboardController(AdminControllerTest):
     # automatically created as part of setup.
     BOOKS = CirculationControllerTest.BOOKS
 
+    def setup_method(self):
+        super(TestDashboardController, self).setup_method()
+        # Most of these tests change the database between calls to
+        # stats(), so don't serve a cached snapshot unless a test
+        # asks for one.
+        self.manager.admin_dashboard_controller.STATS_MAX_AGE = timedelta(0)
+
     def test_circulation_events(self):
         [lp] = self.english_1.license_pools
         types = [
@@ -1743,6 +1757,7 @@ class TestDashboardController(AdminControllerTest):
         # the current day.
         with self.app.test_request_context("/"):
             response, requested_date, date_end, library_short_name = self.manager.admin_dashboard_controller.bulk_circulation_events()
+        response = "".join(response)
         reader = csv.reader(
             [row for row in response.split("\r\n") if row],
             dialect=csv.excel
@@ -1759,17 +1774,17 @@ class TestDashboardController(AdminControllerTest):
         # Now verify that this works by passing incoming query
         # parameters into a LocalAnalyticsExporter object.
         class MockLocalAnalyticsExporter(object):
-            def export(self, _db, date_start, date_end, locations, library):
+            def export_chunks(self, _db, date_start, date_end, locations, library):
                 self.called_with = (
                     _db, date_start, date_end, locations, library
                 )
-                return "A CSV file"
+                return iter(["A CSV ", "file"])
 
         exporter = MockLocalAnalyticsExporter()
         with self.request_context_with_library("/?date=2018-01-01&dateEnd=2018-01-04&locations=loc1,loc2"):
             response, requested_date, date_end, library_short_name = self.manager.admin_dashboard_controller.bulk_circulation_events(analytics_exporter=exporter)
 
-            # export() was called with the arguments we expect.
+            # export_chunks() was called with the arguments we expect.
             #
             args = list(exporter.called_with)
             assert self._db == args.pop(0)
@@ -1782,15 +1797,15 @@ class TestDashboardController(AdminControllerTest):
             assert self._default_library == args.pop(0)
             assert [] == args
 
-            # The data returned is whatever export() returned.
-            assert "A CSV file" == response
+            # The data returned is whatever export_chunks() returned.
+            assert "A CSV file" == "".join(response)
 
             # The other data is necessary to build a filename for the
             # "CSV file".
             assert "2018-01-01" == requested_date
 
             # Note that the date_end is the date we requested --
-            # 2018-01-04 -- not the cutoff time passed in to export(),
+            # 2018-01-04 -- not the cutoff time passed in to export_chunks(),
             # which is the start of the subsequent day.
             assert "2018-01-04" == date_end
             assert self._default_library.short_name == library_short_name
@@ -2054,6 +2069,37 @@ class TestDashboardController(AdminControllerTest):
                 assert 0 == c3_data.get('licenses')
                 assert 0 == c3_data.get('available_licenses')
 
+    def test_stats_snapshot(self):
+        controller = self.manager.admin_dashboard_controller
+        controller.STATS_MAX_AGE = timedelta(minutes=5)
+        with self.request_context_with_admin("/"):
+            self.admin.add_role(AdminRole.SYSTEM_ADMIN)
+
+            response = controller.stats()
+            generated = response["total"]["generated"]
+            assert generated == response[self._default_library.short_name]["generated"]
+            assert 1 == response["total"]["patrons"]["total"]
+
+            # A new patron doesn't show up until the snapshot expires.
+            self._patron()
+            response = controller.stats()
+            assert generated == response["total"]["generated"]
+            assert 1 == response["total"]["patrons"]["total"]
+
+            snapshot = controller._stats_snapshot
+            snapshot["generated"] -= timedelta(minutes=10)
+            response = controller.stats()
+            assert 2 == response["total"]["patrons"]["total"]
+            assert controller._stats_snapshot != snapshot
+
+            # The snapshot covers every library and collection, but
+            # the response is still limited to what the admin can see.
+            self.admin.remove_role(AdminRole.SYSTEM_ADMIN)
+            response = controller.stats()
+            assert ["total"] == response.keys()
+            assert 0 == response["total"]["patrons"]["total"]
+            assert {} == response["total"]["collections"]
+
 
 class SettingsControllerTest(AdminControllerTest):
     """Test some part of the settings controller."""
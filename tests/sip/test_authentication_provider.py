@@ -216,6 +216,40 @@ class TestSIP2AuthenticationProvider(DatabaseTest):
         assert 'user2' in request
         assert 'some password' not in request
 
+    def test_remote_authenticate_reuses_connection(self):
+        # When no client is provided, the provider takes logged-in
+        # SIPClients from a connection pool shared by every provider
+        # that uses the same server.
+        integration = self._external_integration(self._str)
+        integration.url = 'server.local'
+        integration.username = 'user_id'
+        client = MockSIPClient(login_user_id='user_id')
+        class Mock(SIP2AuthenticationProvider):
+            def make_client(self):
+                return client
+
+        auth = Mock(self._default_library, integration)
+        pool = auth.connection_pool
+        assert pool == Mock(self._default_library, integration).connection_pool
+
+        client.queue_response('941')
+        client.queue_response(self.evergreen_active_user)
+        patrondata = auth.remote_authenticate("user", "pass")
+        assert "12345" == patrondata.authorization_identifier
+
+        # The client logged in and asked about the patron, but didn't
+        # end the session or disconnect.
+        assert 2 == len(client.requests)
+        assert client.connected
+
+        # The next request reuses the connection, so it takes a single
+        # round trip.
+        client.queue_response(self.evergreen_active_user)
+        patrondata = auth.remote_authenticate("user", "pass")
+        assert "12345" == patrondata.authorization_identifier
+        assert 3 == len(client.requests)
+        pool.clear()
+
     def test_ioerror_during_connect_becomes_remoteintegrationexception(self):
         """If the IP of the circulation manager has not been whitelisted,
         we generally can't even connect to the server.
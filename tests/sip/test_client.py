@@ -6,6 +6,7 @@ import ssl
 from api.sip.client import (
     MockSIPClient,
     SIPClient,
+    SIPConnectionPool,
 )
 from api.sip.dialect import (
     GenericILS,
@@ -111,6 +112,45 @@ class TestSIPClient(object):
             socket.socket = old_socket
             ssl.wrap_socket = old_wrap_socket
 
+    def test_read_message(self):
+        class MockConnection(object):
+            def __init__(self, *chunks):
+                self.chunks = list(chunks)
+            def recv(self, size):
+                if not self.chunks:
+                    return ''
+                return self.chunks.pop(0)
+
+        sip = SIPClient("server", 999)
+
+        # A message may arrive in several pieces.
+        sip.connection = MockConnection("941", "AY1AZ", "FDFC\r")
+        assert "941AY1AZFDFC\r" == sip.read_message()
+
+        # If more than one message arrives at once, the extra data is
+        # kept for the next call, and the \n some servers send after
+        # the \r is thrown away.
+        sip.connection = MockConnection("941\r\n", "942\r\n9", "43\r")
+        assert "941\r" == sip.read_message()
+        assert "942\r" == sip.read_message()
+        assert bytearray("9") == sip.read_buffer
+        assert "943\r" == sip.read_message()
+        assert bytearray() == sip.read_buffer
+
+        # A closed connection or an oversized response is an error.
+        sip.connection = MockConnection("941")
+        with pytest.raises(IOError) as excinfo:
+            sip.read_message()
+        assert "No data read from socket." in str(excinfo.value)
+
+        sip.reset_connection_state()
+        sip.connection = MockConnection("9" * 20)
+        with pytest.raises(IOError) as excinfo:
+            sip.read_message(max_size=10)
+        assert "SIP2 response too large." in str(excinfo.value)
+        assert bytearray() == sip.read_buffer
+
+
 class TestBasicProtocol(object):
 
     def test_login_message(self):
@@ -419,3 +459,179 @@ class TestClientDialects(object):
         self.sip.end_session('username', 'password')
         assert self.sip.read_count == 0
         assert self.sip.write_count == 0
+
+
+class TestSIPConnectionPool(object):
+
+    def test_run(self):
+        created = []
+        def factory():
+            client = MockSIPClient(login_user_id='user_id')
+            client.queue_response('941')
+            created.append(client)
+            return client
+        pool = SIPConnectionPool(factory)
+
+        # The first request creates a new client, which connects
+        # and logs in.
+        def request(sip):
+            sip.requests.append("request")
+            return sip
+        sip = pool.run(request)
+        assert [sip] == created
+        assert sip.connected
+        assert sip.requests[0].startswith("9300CNuser_id")
+
+        # Once the request is done, the client goes back into the pool
+        # and is reused for the next request, without logging in
+        # again.
+        assert [sip] == [x for x, last_used in pool.idle]
+        assert sip == pool.run(request)
+        assert 1 == len(created)
+        assert 3 == len(sip.requests)
+
+        # A client whose connection has gone bad is discarded.
+        sip.connected = False
+        new_sip = pool.run(request)
+        assert [sip, new_sip] == created
+
+        # So is a client that has been idle too long.
+        pool.idle = [(new_sip, 0)]
+        assert new_sip != pool.run(request)
+        assert 3 == len(created)
+        assert False == new_sip.connected
+
+    def test_run_retries_on_new_connection(self):
+        created = []
+        def factory():
+            client = MockSIPClient()
+            created.append(client)
+            return client
+        pool = SIPConnectionPool(factory)
+        pool.run(lambda sip: None)
+        [reused] = created
+
+        # If a reused connection fails, the request is tried again on
+        # a brand new connection.
+        def request(sip):
+            if sip == reused:
+                raise IOError("Connection reset")
+            return "result"
+        assert "result" == pool.run(request)
+        [reused, new] = created
+        assert False == reused.connected
+        assert [new] == [x for x, last_used in pool.idle]
+
+        # If a new connection fails, the error is raised.
+        def fails(sip):
+            raise IOError("Doom!")
+        pool.clear()
+        with pytest.raises(IOError) as excinfo:
+            pool.run(fails)
+        assert "Doom!" in str(excinfo.value)
+        assert [] == pool.idle
+
+    def test_reuses_connection_to_server_that_sends_crlf(self):
+        # This server ends each message with \r\n, and sometimes the
+        # \n arrives separately.
+        servers = []
+        class SocketPairSIPClient(SIPClient):
+            def connect(self):
+                self.connection, server = socket.socketpair()
+                servers.append(server)
+                self.reset_connection_state()
+        created = []
+        def factory():
+            client = SocketPairSIPClient("server", 999)
+            created.append(client)
+            return client
+        pool = SIPConnectionPool(factory)
+
+        def respond(*chunks):
+            def request(sip):
+                servers[-1].sendall(chunks[0])
+                message = sip.read_message()
+                for chunk in chunks[1:]:
+                    servers[-1].sendall(chunk)
+                return message
+            return request
+
+        try:
+            # The \r\n arrives along with the message.
+            assert "941\r" == pool.run(respond("941\r\n"))
+            [sip] = created
+            assert bytearray() == sip.read_buffer
+            assert True == sip.is_connected()
+
+            # The \n arrives after the message has been read.
+            assert "942\r" == pool.run(respond("942\r", "\n"))
+            assert [sip] == created
+
+            # Neither one stops the connection from being reused.
+            assert "943\r" == pool.run(respond("943\r\n"))
+            assert [sip] == created
+
+            # But anything else that shows up between requests means
+            # the connection can't be trusted.
+            assert "944\r" == pool.run(respond("944\r", "\n945\r"))
+            assert "946\r" == pool.run(respond("946\r\n"))
+            assert [sip, created[1]] == created
+            assert None == sip.connection
+        finally:
+            for server in servers:
+                server.close()
+            pool.clear()
+
+    def test_checkin_respects_max_idle(self):
+        pool = SIPConnectionPool(MockSIPClient, max_idle=1)
+        client1 = MockSIPClient()
+        client1.connect()
+        client2 = MockSIPClient()
+        client2.connect()
+        pool.checkin(client1)
+        pool.checkin(client2)
+        assert [client1] == [x for x, last_used in pool.idle]
+        assert False == client2.connected
+
+    def test_for_key(self):
+        pool = SIPConnectionPool.for_key("a key", MockSIPClient)
+        assert pool == SIPConnectionPool.for_key("a key", object)
+        assert pool != SIPConnectionPool.for_key("another key", MockSIPClient)
+
+    def test_reap_all(self):
+        # One pool has a connection that's been idle too long; another
+        # has a connection that was just used.
+        old_pool = SIPConnectionPool.for_key("old pool", MockSIPClient)
+        old = MockSIPClient()
+        old.connect()
+        old_pool.idle = [(old, 0)]
+        new_pool = SIPConnectionPool.for_key("new pool", MockSIPClient)
+        new = MockSIPClient()
+        new.connect()
+        new_pool.checkin(new)
+
+        # Checking a connection out of either pool closes the stale
+        # connection, and the pool it was in is forgotten, since it
+        # has nothing left in it.
+        assert new == new_pool.checkout()
+        assert False == old.connected
+        assert [] == old_pool.idle
+        assert True == old_pool.dropped
+        assert old_pool != SIPConnectionPool.for_key("old pool", MockSIPClient)
+
+        # A pool whose connection is in use isn't forgotten...
+        assert True == new.connected
+        new_pool.in_use = 1
+        SIPConnectionPool.reap_all()
+        assert new_pool == SIPConnectionPool.for_key("new pool", MockSIPClient)
+
+        # ...but once it's done with, it is.
+        new_pool.in_use = 0
+        SIPConnectionPool.reap_all()
+        assert True == new_pool.dropped
+
+        # A connection returned to a pool that's been forgotten is
+        # closed instead of kept.
+        new_pool.checkin(new)
+        assert [] == new_pool.idle
+        assert False == new.connected
@@ -2344,6 +2344,74 @@ class TestBasicAuthenticationProviderAuthenticate(AuthenticatorTest):
         assert (None ==
             provider.authenticate(self._db, self.credentials))
 
+    def test_authentication_cache(self):
+        patron = self._patron()
+        patrondata = PatronData(permanent_id=patron.external_identifier)
+
+        class Mock(MockBasic):
+            remote_calls = 0
+            def remote_authenticate(self, username, password):
+                self.remote_calls += 1
+                return self.patrondata
+
+        # By default, credentials are checked with the source of truth
+        # every time.
+        provider = self.mock_basic(patrondata=patrondata)
+        assert None == provider.authentication_cache
+
+        integration = self._external_integration(
+            self._str, ExternalIntegration.PATRON_AUTH_GOAL
+        )
+        integration.setting(
+            BasicAuthenticationProvider.AUTHENTICATION_CACHE_TIME
+        ).value = "300"
+        provider = Mock(
+            self._default_library, integration, patrondata=patrondata
+        )
+
+        # The first time a patron authenticates, the source of truth is
+        # consulted.
+        assert patron == provider.authenticate(self._db, self.credentials)
+        assert 1 == provider.remote_calls
+        assert 0 == provider.authentication_cache_hits
+        assert 1 == provider.authentication_cache_misses
+
+        # The credentials aren't stored in the cache as-is.
+        [(key, (password_hash, patron_id))] = provider.authentication_cache.items()
+        for value in (key, password_hash):
+            assert "user" not in value
+            assert "pass" not in value
+        assert patron.id == patron_id
+
+        # After that, the cache is used.
+        assert patron == provider.authenticate(self._db, self.credentials)
+        assert 1 == provider.remote_calls
+        assert 1 == provider.authentication_cache_hits
+        assert 0.5 == provider.authentication_cache_hit_rate
+
+        # A different password has to be checked with the source of
+        # truth.
+        provider.patrondata = None
+        wrong_password = dict(username="user", password="wrong")
+        assert None == provider.authenticate(self._db, wrong_password)
+        assert 2 == provider.remote_calls
+
+        # Since the source of truth rejected the password, the cached
+        # credentials have been forgotten, and the original password has
+        # to be checked again.
+        assert 0 == len(provider.authentication_cache)
+        provider.patrondata = patrondata
+        assert patron == provider.authenticate(self._db, self.credentials)
+        assert 3 == provider.remote_calls
+
+        # A patron who no longer exists can't be authenticated from
+        # the cache.
+        self._db.delete(patron)
+        self._db.commit()
+        provider.patrondata = None
+        assert None == provider.authenticate(self._db, self.credentials)
+        assert 4 == provider.remote_calls
+
     def test_server_side_validation_runs(self):
         patron = self._patron()
         patrondata = PatronData(permanent_id=patron.external_identifier)
@@ -257,6 +257,14 @@ class TestAxis360API(Axis360Test):
         kwargs = request[-1]
         assert None == kwargs['timeout']
 
+        # The response body is only streamed if that's requested.
+        assert 'stream' not in kwargs
+        self.api.queue_response(200)
+        self.api.availability(stream=True)
+        request = self.api.requests.pop()
+        kwargs = request[-1]
+        assert True == kwargs['stream']
+
     def test_availability_exception(self):
 
         self.api.queue_response(500)
@@ -737,8 +745,89 @@ class TestCirculationMonitor(Axis360Test):
         assert [(1,"a"),(2, "b")] == monitor.processed
 
         # The number of books processed was stored in
-        # TimestampData.achievements.
-        assert "Modified titles: 2." == progress.achievements
+        # TimestampData.achievements, along with the processing rate.
+        assert progress.achievements.startswith(
+            "Modified titles: 2. Titles per second: "
+        )
+
+    def test_catch_up_from_adds_coverage_in_bulk(self):
+        bibliographic = self.BIBLIOGRAPHIC_DATA
+        availability = self.AVAILABILITY_DATA
+
+        class MockAPI(MockAxis360API):
+            def recent_activity(self, since):
+                return [(bibliographic, availability)]
+
+        class MockMonitor(Axis360CirculationMonitor):
+            pending_when_processed = []
+            def process_book(self, bibliographic, circulation):
+                result = super(MockMonitor, self).process_book(
+                    bibliographic, circulation
+                )
+                self.pending_when_processed.append(list(self.pending_coverage))
+                return result
+
+        monitor = MockMonitor(self._db, self.collection, api_class=MockAPI)
+        monitor.catch_up_from("start", "cutoff", TimestampData())
+
+        # When the new book was processed, its CoverageRecord wasn't
+        # created right away -- the Identifier was set aside.
+        [[identifier]] = monitor.pending_when_processed
+        assert u'0003642860' == identifier.identifier
+
+        # Then the CoverageRecord was created along with the rest of
+        # the batch.
+        records = [x for x in identifier.coverage_records
+                   if x.data_source.name == DataSource.AXIS_360
+                   and x.operation is None]
+        assert 1 == len(records)
+        assert None == monitor.pending_coverage
+
+    def test_prefetch(self):
+        monitor = Axis360CirculationMonitor(
+            self._db, self.collection, api_class=MockAxis360API
+        )
+        monitor.PREFETCH_SIZE = 2
+
+        # Items come out in the order they went in, even if there are
+        # more of them than fit in the queue.
+        assert range(10) == list(monitor.prefetch(iter(range(10))))
+
+        # An exception raised while producing the items is raised in
+        # the consuming thread.
+        def items():
+            yield 1
+            raise ValueError("Bad document")
+        results = []
+        with pytest.raises(ValueError) as excinfo:
+            for item in monitor.prefetch(items()):
+                results.append(item)
+        assert "Bad document" in str(excinfo.value)
+        assert [1] == results
+
+    def test_recent_activity_uses_database_before_iteration(self):
+        # The Collection is looked up when recent_activity() is
+        # called, not when the producer thread starts iterating.
+        class Mock(MockAxis360API):
+            collection_lookups = 0
+
+            @property
+            def collection(self):
+                self.collection_lookups += 1
+                return super(Mock, self).collection
+
+        api = Mock(self._db, self.collection)
+        api.queue_response(200, content=self.sample_data("tiny_collection.xml"))
+        activity = api.recent_activity(datetime.datetime.utcnow())
+        assert 1 == api.collection_lookups
+        assert [] == api.requests
+
+        monitor = Axis360CirculationMonitor(
+            self._db, self.collection, api_class=MockAxis360API
+        )
+        results = list(monitor.prefetch(activity))
+        assert 2 == len(results)
+        assert 1 == api.collection_lookups
 
     def test_process_book(self):
         integration, ignore = create(
@@ -854,6 +943,18 @@ class TestReaper(Axis360Test):
 
 class TestParsers(Axis360Test):
 
+    def test_bibliographic_parser_process_stream(self):
+        # process_stream() finds the same books as process_all(),
+        # without parsing the whole document up front.
+        data = self.sample_data("tiny_collection.xml")
+        from_string = list(BibliographicParser().process_all(data))
+        from_stream = list(BibliographicParser().process_stream(data))
+        assert 2 == len(from_stream)
+        assert ([bib.title for bib, av in from_string] ==
+                [bib.title for bib, av in from_stream])
+        assert ([av.licenses_owned for bib, av in from_string] ==
+                [av.licenses_owned for bib, av in from_stream])
+
     def test_bibliographic_parser(self):
         """Make sure the bibliographic information gets properly
         collated in preparation for creating Edition objects.
@@ -1191,6 +1292,11 @@ class TestAvailabilityResponseParser(Axis360Test, BaseParserTest):
         data = self.sample_data("availability_with_loan_and_hold.xml")
         parser = AvailabilityResponseParser(self.api)
         activity = list(parser.process_all(data))
+
+        # Processing the document as a stream gives the same results.
+        streamed = list(parser.process_stream(data))
+        assert (sorted([x.identifier for x in activity]) ==
+                sorted([x.identifier for x in streamed]))
         hold, loan, reserved = sorted(activity, key=lambda x: x.identifier)
         assert self.api.collection.id == hold.collection_id
         assert Identifier.AXIS_360_ID == hold.identifier_type
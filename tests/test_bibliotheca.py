@@ -682,6 +682,11 @@ class TestEventParser(BibliothecaAPITest):
             list(EventParser().process_all(data, no_events_error))
         assert "No events returned from server. This may not be an error, but treating it as one to be safe." in str(excinfo.value)
 
+        # The same is true when the events are processed as a stream.
+        assert [] == list(EventParser().process_stream(data))
+        with pytest.raises(RemoteInitiatedServerError) as excinfo:
+            list(EventParser().process_stream(data, no_events_error))
+
     def test_parse_empty_end_date_event(self):
         data = self.sample_data("empty_end_date_event.xml")
         [event] = list(EventParser().process_all(data))
@@ -878,6 +883,10 @@ class TestBibliothecaEventParser(object):
         assert correct_start == start_time
         assert correct_end == end_time
 
+        # Processing the events as a stream gives the same results.
+        assert ([event1, event2] ==
+                list(EventParser().process_stream(self.TWO_EVENTS)))
+
 
 class TestErrorParser(object):
 
@@ -1204,6 +1213,50 @@ class TestBibliothecaEventMonitor(BibliothecaAPITest):
         # affect the counts.
         assert 4 == analytics.count
 
+    def test_handle_events(self):
+        api = MockBibliothecaAPI(self._db, self.collection)
+        api.queue_response(
+            200, content=self.sample_data("item_metadata_single.xml")
+        )
+        analytics = MockAnalyticsProvider()
+        monitor = BibliothecaEventMonitor(
+            self._db, self.collection, api_class=api,
+            analytics=analytics
+        )
+
+        # Nothing is known about this book yet.
+        now = datetime.utcnow()
+        events = [
+            ("ddf4gr9", "9781250015280", None, now, None,
+             CirculationEvent.DISTRIBUTOR_LICENSE_ADD),
+            ("ddf4gr9", "9781250015280", None, now, None,
+             CirculationEvent.DISTRIBUTOR_LICENSE_ADD),
+        ]
+        resolved = monitor.resolve_events(events)
+        assert {} == resolved['pools']
+        assert {} == resolved['editions']
+
+        # Handling the batch creates a single LicensePool, asks for
+        # its metadata once, and applies both events to it.
+        assert 2 == monitor.handle_events(events)
+        [pool] = self.collection.licensepools
+        assert "ddf4gr9" == pool.identifier.identifier
+        assert 1 == len(api.requests)
+        assert 2 == pool.licenses_owned
+        assert 2 == pool.licenses_available
+
+        # The ISBN was made equivalent to the Bibliotheca ID.
+        [isbn] = [x.output for x in pool.identifier.equivalencies
+                  if x.output.identifier == "9781250015280"]
+
+        # Now that the book is known, everything the events need is
+        # found by resolve_events().
+        resolved = monitor.resolve_events(events)
+        assert {"ddf4gr9": pool} == resolved['pools']
+        assert (pool.identifier ==
+            resolved['editions']["ddf4gr9"].primary_identifier)
+        assert isbn == resolved['isbns']["9781250015280"]
+
 
 class TestBibliothecaEventMonitorWhenMultipleCollections(BibliothecaAPITest):
 
@@ -1272,12 +1325,16 @@ class TestItemListParser(BibliothecaAPITest):
             f("Action &amp;amp; Adventure,Science Fiction, Fantasy, Magic,Renaissance,"))
 
     def test_item_list(cls):
-        data = cls.sample_data("item_metadata_list_mini.xml")
-        data = list(ItemListParser().parse(data))
+        raw = cls.sample_data("item_metadata_list_mini.xml")
+        data = list(ItemListParser().parse(raw))
 
         # There should be 2 items in the list.
         assert 2 == len(data)
 
+        # The same items are found when the list is parsed as a stream.
+        assert ([x.title for x in data] ==
+                [x.title for x in ItemListParser().parse_stream(raw)])
+
         cooked = data[0]
 
         assert "The Incense Game" == cooked.title
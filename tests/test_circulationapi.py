@@ -1,5 +1,6 @@
 """Test the CirculationAPI."""
 from datetime import datetime, timedelta
+from threading import Event
 
 import flask
 import pytest
@@ -17,6 +18,8 @@ from api.circulation import (
     FulfillmentInfo,
     HoldInfo,
     LoanInfo,
+    PatronActivityJob,
+    PatronActivityWorkerPool,
 )
 from api.circulation_exceptions import *
 from api.testing import MockCirculationAPI
@@ -34,6 +37,7 @@ from core.model import (
     Loan,
     Representation,
     RightsStatus,
+    Session,
 )
 
 from core.testing import DatabaseTest
@@ -1054,6 +1058,52 @@ class TestCirculationAPI(DatabaseTest):
         api.analytics = None
         api._collect_event(p1, None, 'event')
 
+    def test_license_pools_for(self):
+        # One of these CirculationInfo objects refers to a LicensePool
+        # we already know about; the other refers to a book we've
+        # never heard of.
+        existing = HoldInfo(
+            self.pool.collection, self.pool.data_source.name,
+            self.identifier.type, self.identifier.identifier,
+            None, None, None
+        )
+        unknown = LoanInfo(
+            self.pool.collection, self.pool.data_source.name,
+            Identifier.BIBLIOTHECA_ID, "new-book", None, None
+        )
+        pools = self.circulation.license_pools_for([existing, unknown])
+        assert 2 == len(pools)
+
+        key = (self.collection.id, self.identifier.type,
+               self.identifier.identifier)
+        assert self.pool == pools[key]
+
+        # A LicensePool was created for the unknown book.
+        new_pool = pools[(self.collection.id, Identifier.BIBLIOTHECA_ID,
+                          "new-book")]
+        assert "new-book" == new_pool.identifier.identifier
+        assert self.collection == new_pool.collection
+
+        assert {} == self.circulation.license_pools_for([])
+
+    def test_sync_bookshelf_creates_each_remote_loan_once(self):
+        # The remote mentions the same loan twice.
+        for i in range(2):
+            self.circulation.add_remote_loan(
+                self.pool.collection, self.pool.data_source,
+                self.identifier.type, self.identifier.identifier,
+                self.YESTERDAY, self.IN_TWO_WEEKS
+            )
+        loans, holds = self.circulation.sync_bookshelf(self.patron, "1234")
+        self._db.commit()
+
+        # Only one local loan was created.
+        [loan] = self.patron.loans
+        assert [loan, loan] == loans
+        assert self.pool == loan.license_pool
+        assert self.YESTERDAY == loan.start
+        assert self.IN_TWO_WEEKS == loan.end
+
     def test_sync_bookshelf_ignores_local_loan_with_no_identifier(self):
         loan, ignore = self.pool.loan_to(self.patron)
         loan.start = self.YESTERDAY
@@ -1305,6 +1355,171 @@ class TestCirculationAPI(DatabaseTest):
         assert 0 == len(holds)
         assert False == complete
 
+    def test_patron_activity_gives_up_on_slow_source(self):
+        # One vendor API answers immediately; the other doesn't answer
+        # until we tell it to.
+        pool = self._licensepool(None)
+        loan = LoanInfo(
+            pool.collection, pool.data_source.name,
+            pool.identifier.type, pool.identifier.identifier, None, None
+        )
+        unblock = Event()
+
+        class Fast(BaseCirculationAPI):
+            def patron_activity(self, patron, pin):
+                return [loan]
+
+        class Slow(BaseCirculationAPI):
+            PATRON_ACTIVITY_TIMEOUT = 0.1
+            def patron_activity(self, patron, pin):
+                unblock.wait(5)
+                return []
+
+        circulation = CirculationAPI(self._db, self._default_library)
+        circulation.api_for_collection = {1: Fast(), 2: Slow()}
+        assert 0.1 == circulation.patron_activity_timeout(Slow())
+        assert (BaseCirculationAPI.PATRON_ACTIVITY_TIMEOUT ==
+                circulation.patron_activity_timeout(object()))
+
+        # We get the fast source's loan without waiting for the slow
+        # source, but we know our picture is incomplete.
+        loans, holds, complete = circulation.patron_activity(self.patron, "1234")
+        unblock.set()
+        assert [loan] == loans
+        assert [] == holds
+        assert False == complete
+
+    def test_patron_activity_sees_uncommitted_patron(self):
+        # A patron who was just created in this session is visible
+        # to the vendor APIs, which use sessions of their own.
+        class Mock(BaseCirculationAPI):
+            def patron_activity(self, patron, pin):
+                self.patron_id = patron.id
+                return []
+
+        api = Mock()
+        circulation = CirculationAPI(self._db, self._default_library)
+        circulation.api_for_collection = {self.collection.id: api}
+        patron = self._patron()
+        loans, holds, complete = circulation.patron_activity(patron, "1234")
+        assert True == complete
+        assert patron.id == api.patron_id
+
+    def test_patron_activity_job_for_missing_patron(self):
+        # If the job can't find the patron, it doesn't call the API,
+        # and the patron's activity is incomplete.
+        class Mock(object):
+            called = False
+            def patron_activity(self, patron, pin):
+                self.called = True
+                return []
+
+        api = Mock()
+        circulation = CirculationAPI(self._db, self._default_library)
+        circulation.api_for_collection = {self.collection.id: api}
+        job = PatronActivityJob(
+            api, self.collection.id, -1, "pin",
+            circulation.patron_activity_session_factory()
+        )
+        job.run()
+        assert True == job.patron_missing
+        assert None == job.exception
+        assert None == job.activity
+        assert False == api.called
+
+    def test_patron_activity_pool(self):
+        # Every CirculationAPI shares the same worker pool.
+        circulation = CirculationAPI(self._db, self._default_library)
+        pool = circulation.patron_activity_pool
+        assert isinstance(pool, PatronActivityWorkerPool)
+        assert pool is PatronActivityWorkerPool.shared()
+        assert PatronActivityWorkerPool.DEFAULT_SIZE == len(pool.workers)
+
+        # A job submitted to the pool is run by one of the workers.
+        class Mock(object):
+            def patron_activity(self, patron, pin):
+                self.session = Session.object_session(patron)
+                return [patron.id, pin]
+        api = Mock()
+        job = PatronActivityJob(
+            api, self.collection.id, self.patron.id, "pin",
+            circulation.patron_activity_session_factory()
+        )
+        assert True == pool.submit(job)
+        assert True == job.wait(5)
+        assert [self.patron.id, "pin"] == job.activity
+        assert None == job.exception
+
+        # The job looked up the patron in a session of its own, and
+        # closed it when it was done.
+        assert api.session is not self._db
+        assert [] == list(api.session)
+
+    def test_patron_activity_pool_replaces_stuck_workers(self):
+        pool = PatronActivityWorkerPool(
+            size=1, max_stuck_jobs_per_collection=1
+        )
+        unblock = Event()
+
+        class Slow(object):
+            def patron_activity(self, patron, pin):
+                unblock.wait(5)
+                return []
+
+        class Fast(object):
+            def patron_activity(self, patron, pin):
+                return [pin]
+
+        session_factory = CirculationAPI(
+            self._db, self._default_library
+        ).patron_activity_session_factory()
+        def job(api, collection_id):
+            return PatronActivityJob(
+                api, collection_id, self.patron.id, "pin", session_factory
+            )
+
+        stuck = job(Slow(), 1)
+        assert True == pool.submit(stuck)
+        assert False == stuck.wait(0.1)
+
+        # Once we give up on the stuck job, another worker takes
+        # the place of the one running it, so other collections'
+        # jobs still get run.
+        pool.abandon(stuck)
+        assert 2 == len(pool.workers)
+        other = job(Fast(), 2)
+        assert True == pool.submit(other)
+        assert True == other.wait(5)
+        assert ["pin"] == other.activity
+
+        # But the stuck job's collection can't have any more jobs
+        # until it gets unstuck.
+        assert False == pool.submit(job(Fast(), 1))
+
+        # When the stuck job finally finishes, its worker goes away
+        # and the collection can take jobs again.
+        stuck_worker = pool.workers[0]
+        unblock.set()
+        stuck_worker.join(5)
+        assert False == stuck_worker.is_alive()
+        assert 1 == len(pool.workers)
+        again = job(Fast(), 1)
+        assert True == pool.submit(again)
+        assert True == again.wait(5)
+
+        # A job we give up on before it starts is never run.
+        unblock.clear()
+        blocker = job(Slow(), 3)
+        pool.submit(blocker)
+        never = job(Fast(), 4)
+        pool.submit(never)
+        pool.abandon(never)
+        unblock.set()
+        assert True == blocker.wait(5)
+        pool.queue.join()
+        assert False == never.started
+        assert None == never.activity
+
     def test_can_fulfill_without_loan(self):
         """Can a title can be fulfilled without an active loan?  It depends on
         the BaseCirculationAPI implementation for that title's colelction.
@@ -126,6 +126,7 @@ from core.model import (
     get_one_or_create,
     tuple_to_numericrange,
 )
+from core.model.configuration import ExternalIntegrationLink
 from core.opds import AcquisitionFeed, NavigationFacets, NavigationFeed
 from core.problem_details import *
 from core.testing import DummyHTTPClient, MockRequestsResponse
@@ -495,6 +496,140 @@ class TestCirculationManager(CirculationControllerTest):
         # Restore the CustomIndexView.for_library implementation
         CustomIndexView.for_library = old_for_library
 
+    def test_reload_settings(self):
+        library = self._library()
+        self.library_setup(library)
+
+        class Mock(CirculationManager):
+            def __init__(self, *args, **kwargs):
+                self.full_reloads = 0
+                self.reloaded_libraries = []
+                super(Mock, self).__init__(*args, **kwargs)
+
+            def load_settings(self, fingerprints=None):
+                self.full_reloads += 1
+                return super(Mock, self).load_settings(fingerprints)
+
+            def load_library_settings(self, libraries):
+                libraries = list(libraries)
+                self.reloaded_libraries.append(libraries)
+                return super(Mock, self).load_library_settings(libraries)
+
+        manager = Mock(self._db, testing=True)
+        assert 1 == manager.full_reloads
+        default_api = manager.circulation_apis[self._default_library.id]
+        default_authenticator = manager.auth.library_authenticators[
+            self._default_library.short_name
+        ]
+        other_api = manager.circulation_apis[library.id]
+        shared_collection_api = manager.shared_collection_api
+
+        # If nothing has changed, nothing is reloaded.
+        manager.reload_settings()
+        assert 1 == manager.full_reloads
+        assert [] == manager.reloaded_libraries
+
+        # Lane sizes change all the time, but they're not part of the
+        # configuration.
+        lane = self._lane(library=library)
+        manager.reload_settings()
+        assert 1 == len(manager.reloaded_libraries)
+        lane.size = 100
+        manager.reload_settings()
+        assert 1 == len(manager.reloaded_libraries)
+        manager.reloaded_libraries = []
+
+        # Changing one library's settings reloads only that library.
+        documents = {}
+        manager.authentication_for_opds_documents = documents
+        documents[library.short_name] = "old document"
+        documents[self._default_library.short_name] = "default document"
+        library.setting("some setting").value = "some value"
+        manager.reload_settings()
+        assert 1 == manager.full_reloads
+        assert [[library]] == manager.reloaded_libraries
+
+        # The library's cached authentication document is thrown
+        # away, and the shared collection API is rebuilt.
+        assert None == documents.get(library.short_name)
+        assert "default document" == documents[self._default_library.short_name]
+        assert shared_collection_api != manager.shared_collection_api
+        assert other_api != manager.circulation_apis[library.id]
+        assert default_api == manager.circulation_apis[
+            self._default_library.id
+        ]
+        assert default_authenticator == manager.auth.library_authenticators[
+            self._default_library.short_name
+        ]
+        assert isinstance(
+            manager.auth.library_authenticators[library.short_name],
+            LibraryAuthenticator
+        )
+
+        # Renaming a library replaces its authenticator.
+        old_short_name = library.short_name
+        library.short_name = "new_short_name"
+        manager.reload_settings()
+        assert 2 == len(manager.reloaded_libraries)
+        assert old_short_name not in manager.auth.library_authenticators
+        assert "new_short_name" in manager.auth.library_authenticators
+
+        # Changing a sitewide setting reloads everything.
+        ConfigurationSetting.sitewide(
+            self._db, Configuration.WSGI_DEBUG_KEY
+        ).value = "true"
+        manager.reload_settings()
+        assert 2 == manager.full_reloads
+        assert 2 == len(manager.reloaded_libraries)
+        assert True == manager.wsgi_debug
+
+        # So does adding a library.
+        self._library()
+        manager.reload_settings()
+        assert 3 == manager.full_reloads
+
+        # Giving a library an Adobe Vendor ID reloads only that
+        # library, and the new Adobe Vendor ID controller uses the
+        # new Authenticator.
+        adobe = self._external_integration(
+            protocol=ExternalIntegration.ADOBE_VENDOR_ID,
+            goal=ExternalIntegration.DRM_GOAL, libraries=[library],
+            username="vendor id", password="12345"
+        )
+        manager.reloaded_libraries = []
+        manager.reload_settings()
+        assert 3 == manager.full_reloads
+        assert [[library]] == manager.reloaded_libraries
+        assert library == manager.adobe_vendor_id.library
+        assert manager.auth == manager.adobe_vendor_id.model.authenticator
+
+        # Taking it away gets rid of the controller.
+        adobe.libraries = []
+        manager.reload_settings()
+        assert None == manager.adobe_vendor_id
+
+        # Linking one of a library's collections to another
+        # integration (e.g. a place to mirror its covers) reloads
+        # that library.
+        collection = self._collection()
+        collection.libraries.append(library)
+        storage = self._external_integration(
+            protocol=ExternalIntegration.S3,
+            goal=ExternalIntegration.STORAGE_GOAL
+        )
+        manager.reload_settings()
+        full_reloads = manager.full_reloads
+        manager.reloaded_libraries = []
+        create(
+            self._db, ExternalIntegrationLink,
+            external_integration_id=collection.external_integration.id,
+            other_integration_id=storage.id,
+            purpose=ExternalIntegrationLink.COVERS
+        )
+        manager.reload_settings()
+        assert full_reloads == manager.full_reloads
+        assert [[library]] == manager.reloaded_libraries
+
     def test_exception_during_external_search_initialization_is_stored(self):
 
         class BadSearch(CirculationManager):
@@ -232,3 +232,44 @@ class TestLocalAnalyticsExporter(DatabaseTest):
         for row in rows:
             assert 14 == len(row)
             assert constant == row[2:]
+
+    def test_export_chunks(self):
+        exporter = LocalAnalyticsExporter()
+        work = self._work(with_open_access_download=True)
+        [pool] = work.license_pools
+        time = datetime.now() - timedelta(minutes=5)
+        types = [
+            CirculationEvent.DISTRIBUTOR_CHECKIN,
+            CirculationEvent.DISTRIBUTOR_CHECKOUT,
+            CirculationEvent.DISTRIBUTOR_HOLD_PLACE,
+        ]
+        for type in types:
+            get_one_or_create(
+                self._db, CirculationEvent,
+                license_pool=pool, type=type, start=time, end=time
+            )
+            time += timedelta(minutes=1)
+
+        yesterday = date.today() - timedelta(days=1)
+        tomorrow = date.today() + timedelta(days=1)
+
+        # With a chunk size of 2, the three events come out in two
+        # chunks. The header is part of the first chunk.
+        chunks = list(exporter.export_chunks(
+            self._db, yesterday, tomorrow, chunk_size=2
+        ))
+        assert 2 == len(chunks)
+        rows = [row for row in chunks[0].split("\r\n") if row]
+        assert 3 == len(rows)
+        assert rows[0].startswith("time,event,identifier")
+        assert 1 == len([row for row in chunks[1].split("\r\n") if row])
+
+        # Put together, the chunks make the same document export()
+        # returns.
+        assert exporter.export(self._db, yesterday, tomorrow) == "".join(chunks)
+
+        # If there are no events, there's a single chunk containing
+        # only the header.
+        [chunk] = list(exporter.export_chunks(self._db, yesterday, yesterday))
+        assert chunk.startswith("time,event,identifier")
+        assert 1 == len([row for row in chunk.split("\r\n") if row])
@@ -1,15 +1,20 @@
 from pymarc import Record
+import contextlib
+import datetime
 import urllib
 
 from core.testing import DatabaseTest
 from core.config import Configuration
 from core.model import (
+    CachedMARCFile,
     ConfigurationSetting,
     ExternalIntegration,
 )
 
-from api.marc import LibraryAnnotator
-from core.marc import MARCExporter
+from api.marc import (
+    LibraryAnnotator,
+    MARCExporter,
+)
 from api.registry import Registration
 
 class TestLibraryAnnotator(DatabaseTest):
@@ -181,3 +186,90 @@ class TestLibraryAnnotator(DatabaseTest):
 
         assert ["4", "0"] == field2.indicators
         assert expected_client_url_1 == field2.get_subfields("u")[0]
+
+
+class TestMARCExporter(DatabaseTest):
+
+    def test_full_and_delta_records(self):
+        # We have two works; only one of them has changed recently.
+        now = datetime.datetime.utcnow()
+        last_week = now - datetime.timedelta(days=7)
+        old = self._work(title="old", with_license_pool=True)
+        old.last_update_time = now - datetime.timedelta(days=30)
+        new = self._work(title="new", with_license_pool=True)
+        new.last_update_time = now
+
+        class MockLane(object):
+            """Returns both works on the first page."""
+            calls = []
+            def works(self, _db, pagination, facets, search_engine):
+                self.calls.append((pagination, facets, search_engine))
+                assert None == facets.start_time
+                if len(self.calls) == 1:
+                    return [old, new]
+                return []
+
+        class MockRecord(object):
+            def __init__(self, work):
+                self.work = work
+            def as_marc(self):
+                return "record for %s|" % self.work.title
+
+        class MockExporter(MARCExporter):
+            def create_record(self, work, annotator, force_refresh, integration):
+                return MockRecord(work)
+
+        class MockUpload(object):
+            def __init__(self):
+                self.parts = []
+            def upload_part(self, content):
+                self.parts.append(content)
+
+        class MockMirror(object):
+            uploads = {}
+            def marc_file_url(self, library, lane, end_time, start_time=None):
+                return "http://marc/%s" % ("delta" if start_time else "full")
+
+            @contextlib.contextmanager
+            def multipart_upload(self, representation, url):
+                upload = MockUpload()
+                self.uploads[url] = upload
+                yield upload
+
+        integration = self._external_integration(
+            ExternalIntegration.MARC_EXPORT, ExternalIntegration.CATALOG_GOAL,
+            libraries=[self._default_library])
+        exporter = MockExporter(self._db, self._default_library, integration)
+        mirror = MockMirror()
+        mock_lane = MockLane()
+
+        # With a batch size of 1, every record is uploaded as soon
+        # as it's written.
+        count = exporter.full_and_delta_records(
+            mock_lane, object(), None, delta_start_time=last_week,
+            mirror=mirror, upload_batch_size=1
+        )
+        assert 2 == count
+
+        # We went through the lane once, to make both files.
+        assert 2 == len(mock_lane.calls)
+        full = mirror.uploads["http://marc/full"]
+        delta = mirror.uploads["http://marc/delta"]
+        assert ["record for old|", "record for new|"] == full.parts
+        assert ["record for new|"] == delta.parts
+
+        # A CachedMARCFile was created for each file.
+        files = self._db.query(CachedMARCFile).all()
+        assert (set(["http://marc/full", "http://marc/delta"]) ==
+                set(x.representation.url for x in files))
+        [delta_file] = [x for x in files if x.start_time]
+        assert last_week == delta_file.start_time
+
+        # Without a delta_start_time, only the full file is made, and
+        # records are batched up until the end.
+        MockLane.calls = []
+        mirror.uploads.clear()
+        exporter.full_and_delta_records(mock_lane, object(), None, mirror=mirror)
+        assert ["http://marc/full"] == mirror.uploads.keys()
+        assert (["record for old|record for new|"] ==
+                mirror.uploads["http://marc/full"].parts)
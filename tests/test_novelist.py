@@ -22,7 +22,8 @@ from api.novelist import (
     NoveListAPI,
 )
 from core.util.http import (
-    HTTP
+    HTTP,
+    RequestTimedOut,
 )
 from core.testing import MockRequestsResponse
 
@@ -587,6 +588,87 @@ class TestNoveListAPI(DatabaseTest):
 
         self.novelist.put = oldPut
 
+    def test_put_items_novelist_in_one_request(self):
+        editions = []
+        for i in range(3):
+            edition = self._edition(identifier_type=Identifier.ISBN)
+            self._licensepool(edition, collection=self._default_collection)
+            editions.append(edition)
+
+        sent = []
+        def mockHTTPPut(url, headers, **kwargs):
+            # The body is a generator, which is read as it's sent.
+            body = "".join(kwargs['data'])
+            sent.append(json.loads(body))
+            return MockRequestsResponse(
+                200, content=json.dumps({'RecordsReceived': 3})
+            )
+        self.novelist.put = mockHTTPPut
+
+        # Rows are read from the database one at a time, and items
+        # are encoded two at a time, but they all go to NoveList in
+        # a single request.
+        self.novelist.QUERY_BATCH_SIZE = 1
+        self.novelist.UPLOAD_BATCH_SIZE = 2
+        response = self.novelist.put_items_novelist(self._default_library)
+
+        [data] = sent
+        assert "library:yep" == data['customer']
+        isbns = sorted(e.primary_identifier.identifier for e in editions)
+        assert isbns == [record['isbn'] for record in data['records']]
+        assert {'RecordsReceived': 3} == response
+
+    def test_novelist_data_stream(self):
+        # The stream encodes the same document as
+        # make_novelist_data_object, however many items there are.
+        self.novelist.UPLOAD_BATCH_SIZE = 2
+        for count in range(5):
+            items = [dict(isbn=str(i), title="Title %d" % i)
+                     for i in range(count)]
+            body = "".join(self.novelist.novelist_data_stream(iter(items)))
+            assert (self.novelist.make_novelist_data_object(items)
+                    == json.loads(body))
+
+    def test_put_items_novelist_retries(self):
+        self.novelist.UPLOAD_RETRY_DELAY = 0
+        edition = self._edition(identifier_type=Identifier.ISBN)
+        self._licensepool(edition, collection=self._default_collection)
+
+        # An upload that runs into network problems is started over,
+        # with the items read from the database again.
+        responses = [
+            RequestTimedOut("http://url", "timed out"),
+            MockRequestsResponse(200, content=json.dumps({'RecordsReceived': 1})),
+        ]
+        calls = []
+        def mockHTTPPut(url, headers, **kwargs):
+            calls.append("".join(kwargs['data']))
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        self.novelist.put = mockHTTPPut
+
+        library = self._default_library
+        assert {'RecordsReceived': 1} == self.novelist.put_items_novelist(library)
+        assert 2 == len(calls)
+        assert calls[0] == calls[1]
+
+        # If NoveList rejects the data, it's not sent again.
+        calls = []
+        responses = [MockRequestsResponse(400, content="bad data")]
+        assert None == self.novelist.put_items_novelist(library)
+        assert 1 == len(calls)
+
+        # If the problem persists, we eventually give up.
+        calls = []
+        responses = [
+            RequestTimedOut("http://url", "timed out")
+            for i in range(self.novelist.UPLOAD_RETRIES + 1)
+        ]
+        assert None == self.novelist.put_items_novelist(library)
+        assert self.novelist.UPLOAD_RETRIES + 1 == len(calls)
+
     def test_make_novelist_data_object(self):
         bad_data = []
         result = self.novelist.make_novelist_data_object(bad_data)
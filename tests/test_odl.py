@@ -582,6 +582,81 @@ class TestODLAPI(DatabaseTest, BaseODLTest):
         assert 7 == self.pool.licenses_available
         assert 0 == self._db.query(Loan).count()
 
+    def test_fulfill_uses_cached_status_document(self):
+        loan, ignore = self.license.loan_to(self.patron)
+        loan.external_identifier = self._str
+        loan.end = datetime.datetime.utcnow() + datetime.timedelta(days=3)
+
+        lsd = json.dumps({
+            "status": "ready",
+            "potential_rights": {
+                "end": "2017-10-21T11:12:13Z"
+            },
+            "links": [{
+                "rel": "license",
+                "href": "http://acsm",
+                "type": DeliveryMechanism.ADOBE_DRM,
+            }],
+        })
+
+        # The first time the loan is fulfilled, the status document
+        # is fetched and cached, along with its ETag.
+        self.api.queue_response(200, headers={"ETag": '"v1"'}, content=lsd)
+        fulfillment = self.api.fulfill(self.patron, "pin", self.pool, Representation.EPUB_MEDIA_TYPE)
+        assert "http://acsm" == fulfillment.content_link
+        assert 1 == len(self.api.requests)
+        cached = self.api.status_documents[loan.external_identifier]
+        assert '"v1"' == cached.etag
+
+        # While the cached document is fresh, fulfilling the loan
+        # again doesn't require a request.
+        fulfillment = self.api.fulfill(self.patron, "pin", self.pool, Representation.EPUB_MEDIA_TYPE)
+        assert "http://acsm" == fulfillment.content_link
+        assert 1 == len(self.api.requests)
+
+        # Once it's stale, the request is conditional, and if the
+        # document hasn't changed the cached copy is used.
+        cached.fetched -= self.api.STATUS_DOCUMENT_MAX_AGE
+        self.api.queue_response(304, headers={"ETag": '"v1"'})
+        fulfillment = self.api.fulfill(self.patron, "pin", self.pool, Representation.EPUB_MEDIA_TYPE)
+        assert "http://acsm" == fulfillment.content_link
+        url, headers = self.api.requests[-1]
+        assert loan.external_identifier == url
+        assert {"If-None-Match": '"v1"'} == headers
+
+        # A status document that arrives in a notification replaces
+        # the cached copy. If the loan is over, it's removed from the
+        # cache along with the loan.
+        self.api.update_loan(loan, {"status": "revoked"})
+        assert None == self.api.status_documents.get(loan.external_identifier)
+        assert 0 == self._db.query(Loan).count()
+
+    def test_checkout_caches_status_document(self):
+        self.pool.licenses_owned = 1
+        self.pool.licenses_available = 1
+        self.license.concurrent_checkouts = 1
+
+        loan_url = self._str
+        lsd = json.dumps({
+            "status": "ready",
+            "potential_rights": {
+                "end": "3017-10-21T11:12:13Z"
+            },
+            "links": [{
+                "rel": "self",
+                "href": loan_url,
+            }],
+        })
+        self.api.queue_response(200, content=lsd)
+        self.api.checkout(self.patron, "pin", self.pool, Representation.EPUB_MEDIA_TYPE)
+
+        # The document that came back from the checkout is cached
+        # under the loan's own status document URL, so the patron can
+        # fulfill the loan right away without another request.
+        cached = self.api.status_documents[loan_url]
+        assert json.loads(lsd) == cached.document
+        assert cached.is_fresh(self.api.STATUS_DOCUMENT_MAX_AGE)
+
     def test_count_holds_before(self):
         now = datetime.datetime.utcnow()
         yesterday = now - datetime.timedelta(days=1)
@@ -613,6 +688,73 @@ class TestODLAPI(DatabaseTest, BaseODLTest):
             self.pool.on_hold_to(self._patron(), start=yesterday, end=tomorrow, position=1)
         assert 4 == self.api._count_holds_before(hold)
 
+    def test_counts_of_holds_before(self):
+        now = datetime.datetime.utcnow()
+        yesterday = now - datetime.timedelta(days=1)
+        last_week = now - datetime.timedelta(weeks=1)
+
+        holds = []
+        for start in [now, yesterday, last_week, yesterday, now]:
+            hold, ignore = self.pool.on_hold_to(self._patron(), start=start)
+            holds.append(hold)
+        holds[-1].start = None
+        queue = ([], holds)
+
+        # Holds that started at the same time aren't ahead of each
+        # other, and a hold with no start date isn't ahead of
+        # anything.
+        counts = self.api._counts_of_holds_before(holds)
+        assert [3, 1, 0, 1, 0] == [counts[hold] for hold in holds]
+
+        # That's what _count_holds_before finds for each hold, one
+        # at a time.
+        for hold in holds:
+            assert self.api._count_holds_before(hold, queue) == counts[hold]
+
+    def test_hold_queue(self):
+        now = datetime.datetime.utcnow()
+        yesterday = now - datetime.timedelta(days=1)
+        tomorrow = now + datetime.timedelta(days=1)
+        last_week = now - datetime.timedelta(weeks=1)
+
+        self.pool.licenses_owned = 3
+        self.license.concurrent_checkouts = 3
+
+        # Current loans are returned in order of start date. Expired
+        # loans are left out.
+        loan1, ignore = self.license.loan_to(self._patron(), start=yesterday)
+        loan2, ignore = self.license.loan_to(self._patron(), start=last_week)
+        self.license.loan_to(self._patron(), start=last_week, end=yesterday)
+
+        # Holds that are waiting or reserved are returned in order of
+        # start date. Expired reservations are left out.
+        hold1, ignore = self.pool.on_hold_to(self._patron(), start=now)
+        hold2, ignore = self.pool.on_hold_to(
+            self._patron(), start=yesterday, end=tomorrow, position=0
+        )
+        hold3, ignore = self.pool.on_hold_to(
+            self._patron(), start=last_week, end=yesterday, position=2
+        )
+        self.pool.on_hold_to(
+            self._patron(), start=last_week, end=yesterday, position=0
+        )
+
+        # Loans and holds on another pool are left out.
+        other_pool = self._licensepool(None)
+        other_pool.on_hold_to(self._patron(), start=yesterday)
+
+        loans, holds = self.api._hold_queue(self.pool)
+        assert [loan2, loan1] == loans
+        assert [hold3, hold2, hold1] == holds
+
+        # The queue can be passed in instead of being looked up again.
+        assert 2 == self.api._count_holds_before(hold1, (loans, holds))
+        assert 0 == self.api._count_holds_before(hold1, ([], []))
+        self.api._update_hold_position(hold1, (loans, holds))
+        assert 3 == hold1.position
+        self.api._update_hold_position(hold1, ([], []))
+        assert 0 == hold1.position
+
     def test_update_hold_end_date(self):
         now = datetime.datetime.utcnow()
         tomorrow = now + datetime.timedelta(days=1)
@@ -891,6 +1033,42 @@ class TestODLAPI(DatabaseTest, BaseODLTest):
             assert 0 == hold.position
             assert hold.end - datetime.datetime.utcnow() - datetime.timedelta(days=3) < datetime.timedelta(hours=1)
 
+    def test_update_hold_queue_looks_up_periods_once(self):
+        self.pool.licenses_owned = 1
+        self.license.loan_to(
+            self._patron(),
+            end=datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        )
+        now = datetime.datetime.utcnow()
+        holds = []
+        for i in range(5):
+            hold, ignore = self.pool.on_hold_to(
+                self._patron(), start=now - datetime.timedelta(days=5-i),
+                position=i+1
+            )
+            holds.append(hold)
+
+        # However long the queue is, the collection and its loan and
+        # reservation periods are only looked up once.
+        calls = []
+        original_collection = self.api.collection
+        def collection(_db):
+            calls.append(_db)
+            return original_collection(_db)
+        self.api.collection = collection
+
+        self.api.update_hold_queue(self.pool)
+        assert 1 == len(calls)
+        assert [1, 2, 3, 4, 5] == [hold.position for hold in holds]
+        ends = [hold.end for hold in holds]
+        assert ends == sorted(ends)
+
+        # If nothing has changed, the holds don't need to be changed.
+        assert [] == self.api._hold_queue_changes(
+            self.pool, self.api._hold_queue(self.pool),
+            self.api._hold_periods(self._db)
+        )
+
     def test_place_hold_success(self):
         tomorrow = datetime.datetime.utcnow() + datetime.timedelta(days=1)
         self.pool.licenses_owned = 1
@@ -1030,16 +1208,30 @@ class TestODLAPI(DatabaseTest, BaseODLTest):
         assert pool2.identifier.identifier == h1.identifier
         assert hold.start == h1.start_date
         assert hold.end == h1.end_date
-        # Hold position was updated.
+        # The hold position is reported as it was stored.
+        assert 3 == h1.hold_position
+        assert 3 == hold.position
+
+        # It's update_hold_queue that keeps hold positions and end
+        # dates up to date.
+        self.api.update_hold_queue(pool2)
+        activity = self.api.patron_activity(self.patron, "pin")
+        [h1, l1] = sorted(activity, key=lambda x: x.start_date)
         assert 1 == h1.hold_position
         assert 1 == hold.position
+        assert other_patron_loan.end == h1.end_date
 
-        # If the hold is expired, it's deleted right away and the license
-        # is made available again.
+        # A hold that's still waiting is reported even if its
+        # estimated end date has passed.
+        hold.end = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        activity = self.api.patron_activity(self.patron, "pin")
+        assert 2 == len(activity)
+
+        # If the hold's reservation is expired, it's deleted right away
+        # and the license is made available again.
         self._db.delete(other_patron_loan)
         pool2.licenses_available = 0
         pool2.licenses_reserved = 1
-        hold.end = datetime.datetime.utcnow() - datetime.timedelta(days=1)
         hold.position = 0
         activity = self.api.patron_activity(self.patron, "pin")
         assert 1 == len(activity)
@@ -1047,6 +1239,42 @@ class TestODLAPI(DatabaseTest, BaseODLTest):
         assert 1 == pool2.licenses_available
         assert 0 == pool2.licenses_reserved
 
+    def test_patron_activity_promotes_hold_after_expired_reservation(self):
+        # Another patron's reservation has expired, but the hold
+        # reaper hasn't run yet.
+        now = datetime.datetime.utcnow()
+        self.pool.licenses_owned = 1
+        self.pool.licenses_available = 0
+        self.pool.licenses_reserved = 1
+        self.pool.patrons_in_hold_queue = 2
+        expired, ignore = self.pool.on_hold_to(
+            self._patron(), start=now - datetime.timedelta(days=5),
+            end=now - datetime.timedelta(days=1), position=0
+        )
+        hold, ignore = self.pool.on_hold_to(
+            self.patron, start=now - datetime.timedelta(days=4),
+            position=2
+        )
+
+        # When our patron looks at their holds, the expired
+        # reservation is deleted and the license is reserved for them.
+        [info] = self.api.patron_activity(self.patron, "pin")
+        assert [hold] == self._db.query(Hold).all()
+        assert 0 == info.hold_position
+        assert 0 == hold.position
+        assert hold.end > now
+        assert info.end_date == hold.end
+        assert 0 == self.pool.licenses_available
+        assert 1 == self.pool.licenses_reserved
+        assert 1 == self.pool.patrons_in_hold_queue
+
+        # Once the queue is up to date, looking at the holds again
+        # doesn't change anything.
+        end = hold.end
+        [info] = self.api.patron_activity(self.patron, "pin")
+        assert 0 == info.hold_position
+        assert end == hold.end
+
     def test_update_loan_still_active(self):
         self.pool.licenses_available = 6
         self.license.concurrent_checkouts = 6
@@ -1451,7 +1679,8 @@ class TestODLImporter(DatabaseTest, BaseODLTest):
 
 class TestODLHoldReaper(DatabaseTest, BaseODLTest):
 
-    def test_run_once(self):
+    @pytest.mark.parametrize('bulk', [True, False])
+    def test_run_once(self, bulk):
         data_source = DataSource.lookup(self._db, "Feedbooks", autocreate=True)
         collection = MockODLAPI.mock_collection(self._db)
         collection.external_integration.set_setting(
@@ -1459,7 +1688,7 @@ class TestODLHoldReaper(DatabaseTest, BaseODLTest):
             data_source.name
         )
         api = MockODLAPI(self._db, collection)
-        reaper = ODLHoldReaper(self._db, collection, api=api)
+        reaper = ODLHoldReaper(self._db, collection, api=api, bulk=bulk)
 
         now = datetime.datetime.utcnow()
         yesterday = now - datetime.timedelta(days=1)
@@ -1476,11 +1705,28 @@ class TestODLHoldReaper(DatabaseTest, BaseODLTest):
         # so the end date is not reliable.
         bad_end_date, ignore = pool.on_hold_to(self._patron(), end=yesterday, position=4)
 
+        # This pool has one license, which was reserved for a hold that
+        # expired. The next hold in line gets it, but the one after
+        # that keeps waiting.
+        pool2 = self._licensepool(None, collection=collection)
+        pool2.licenses_owned = 1
+        pool2.licenses_available = 0
+        pool2.licenses_reserved = 1
+        pool2.on_hold_to(self._patron(), end=yesterday, position=0)
+        next_hold, ignore = pool2.on_hold_to(
+            self._patron(), start=yesterday, position=1
+        )
+        waiting_hold, ignore = pool2.on_hold_to(
+            self._patron(), start=now, position=2
+        )
+
         progress = reaper.run_once(reaper.timestamp().to_data())
 
         # The expired holds have been deleted and the other holds have been updated.
-        assert 2 == self._db.query(Hold).count()
-        assert [current_hold, bad_end_date] == self._db.query(Hold).order_by(Hold.start).all()
+        assert 4 == self._db.query(Hold).count()
+        assert [current_hold, bad_end_date] == self._db.query(Hold).filter(
+            Hold.license_pool==pool
+        ).order_by(Hold.start).all()
         assert 0 == current_hold.position
         assert 0 == bad_end_date.position
         assert current_hold.end > now
@@ -1488,8 +1734,20 @@ class TestODLHoldReaper(DatabaseTest, BaseODLTest):
         assert 1 == pool.licenses_available
         assert 2 == pool.licenses_reserved
 
+        assert 0 == next_hold.position
+        assert next_hold.end > now
+        # The hold that's still waiting has a new estimated end date,
+        # based on when the next hold will be done with the book.
+        assert 2 == waiting_hold.position
+        loan_period = collection.default_loan_period(waiting_hold.library)
+        assert (next_hold.end + datetime.timedelta(days=loan_period)
+                == waiting_hold.end)
+        assert 0 == pool2.licenses_available
+        assert 1 == pool2.licenses_reserved
+        assert 2 == pool2.patrons_in_hold_queue
+
         # The TimestampData returned reflects what work was done.
-        assert 'Holds deleted: 3. License pools updated: 1' == progress.achievements
+        assert 'Holds deleted: 4. License pools updated: 2' == progress.achievements
 
         # The TimestampData does not include any timing information --
         # that will be applied by run().
@@ -10,6 +10,7 @@ import pytest
 from lxml import etree
 from mock import create_autospec
 import feedparser
+from sqlalchemy import inspect
 from core.testing import DatabaseTest
 
 from core.analytics import Analytics
@@ -772,6 +773,59 @@ class TestLibraryAnnotator(VendorIDTest):
         )
         assert expect == analytics_link
 
+    def test_work_entry_links_are_cached(self):
+        work = self._work(with_license_pool=True, series=u"A Series")
+        [pool] = work.license_pools
+        identifier = pool.identifier
+        edition = pool.presentation_edition
+
+        class Mock(LibraryAnnotator):
+            calls = 0
+            def _work_entry_links(self, *args):
+                Mock.calls += 1
+                return super(Mock, self)._work_entry_links(*args)
+
+        def annotate(annotator):
+            feed = AcquisitionFeed(self._db, "test", "url", [], annotator)
+            entry = feed._make_entry_xml(work, edition)
+            annotator.annotate_work_entry(
+                work, pool, edition, identifier, feed, entry
+            )
+            [parsed] = feedparser.parse(etree.tostring(entry))['entries']
+            return sorted((x['rel'], x['href']) for x in parsed['links'])
+
+        annotator = Mock(
+            None, self.lane, self._default_library, test_mode=True
+        )
+        links = annotate(annotator)
+        assert 1 == Mock.calls
+        for rel in ['issues', 'related', 'contributor', 'series']:
+            assert rel in [x[0] for x in links]
+
+        # A second annotator for the same library -- perhaps handling
+        # a request from a different patron -- reuses the
+        # patron-independent links, and ends up with the same entry.
+        annotator = Mock(
+            None, self.lane, self._default_library, test_mode=True
+        )
+        assert links == annotate(annotator)
+        assert 1 == Mock.calls
+
+        # Once the work's presentation changes, the links are
+        # generated again.
+        work.last_update_time = datetime.datetime.utcnow()
+        annotate(annotator)
+        assert 2 == Mock.calls
+
+        # A library that doesn't identify patrons gets its own
+        # set of links.
+        annotator = Mock(
+            None, self.lane, self._default_library, test_mode=True,
+            library_identifies_patrons=False
+        )
+        annotate(annotator)
+        assert 3 == Mock.calls
+
     def test_annotate_feed(self):
         lane = self._lane()
         linksets = []
@@ -989,6 +1043,40 @@ class TestLibraryAnnotator(VendorIDTest):
         [entry] = feed.entries
         assert annotation_rel not in [x['rel'] for x in entry['links']]
 
+    def test_preload_loans_and_holds(self):
+        patron = self._patron()
+        on_loan = self._work(with_license_pool=True)
+        [loan_pool] = on_loan.license_pools
+        loan, ignore = loan_pool.loan_to(patron)
+        on_hold = self._work(with_license_pool=True)
+        [hold_pool] = on_hold.license_pools
+        hold, ignore = hold_pool.on_hold_to(patron)
+
+        # A loan whose license pool has no work can't be shown in the
+        # feed, so it's left out.
+        no_work = self._licensepool(None)
+        no_work.loan_to(patron)
+        self._db.commit()
+        self._db.expire_all()
+
+        loans, holds = LibraryLoanAndHoldAnnotator.preload_loans_and_holds(
+            patron
+        )
+        assert {on_loan: loan} == loans
+        assert {on_hold: hold} == holds
+
+        # Everything needed to render the entries has already been
+        # loaded.
+        for item in (loan, hold):
+            state = inspect(item.license_pool)
+            for relationship in (
+                'work', 'identifier', 'delivery_mechanisms'
+            ):
+                assert relationship not in state.unloaded
+            for lpdm in item.license_pool.delivery_mechanisms:
+                assert 'delivery_mechanism' not in inspect(lpdm).unloaded
+        assert 'fulfillment' not in inspect(loan).unloaded
+
     def test_active_loan_feed(self):
         self.initialize_adobe(self._default_library)
         patron = self._patron()
@@ -15,6 +15,7 @@ from api.overdrive import (
     OverdriveCollectionReaper,
     OverdriveFormatSweep,
     OverdriveManifestFulfillmentInfo,
+    OverdrivePatronToken,
     RecentOverdriveCollectionMonitor
 )
 
@@ -36,6 +37,7 @@ from core.model import (
     Collection,
     CirculationEvent,
     ConfigurationSetting,
+    Credential,
     DataSource,
     DeliveryMechanism,
     Edition,
@@ -1211,6 +1213,37 @@ class TestOverdriveAPI(OverdriveAPITest):
         pool, was_new, changed = self.api.update_licensepool(book)
         assert None == pool
 
+        # If the lookup was done ahead of time and raised an
+        # exception, the exception is treated the same way as an
+        # error response.
+        lookup = Exception("Could not connect")
+        pool, was_new, changed = self.api.update_licensepool(
+            book, lookup=lookup
+        )
+        assert None == pool
+        assert False == changed
+
+    def test_update_licensepool_with_lookup(self):
+        # If a lookup is passed in, update_licensepool() uses it
+        # instead of asking Overdrive again.
+        identifier = self._identifier(
+            identifier_type=Identifier.OVERDRIVE_ID
+        )
+        ignore, not_found = self.sample_json(
+            "overdrive_availability_not_found.json"
+        )
+        book = dict(id=identifier.identifier, availability_link=self._url)
+
+        # Only the metadata lookup needs a response from 'Overdrive'.
+        self.api.queue_response(404, content=not_found)
+        lookup = (book, (404, {}, not_found))
+        pool, was_new, changed = self.api.update_licensepool(
+            identifier.identifier, lookup=lookup
+        )
+        assert identifier == pool.identifier
+        assert True == was_new
+        assert 0 == pool.licenses_owned
+
     def test_update_licensepool_not_found(self):
         # If the Overdrive API says a book is not found in the
         # collection, that's treated as useful information, not an error.
@@ -1452,6 +1485,67 @@ class TestOverdriveAPI(OverdriveAPITest):
 
 class TestOverdriveAPICredentials(OverdriveAPITest):
 
+    def test_patron_token_cache(self):
+        api = self.api
+        api.PATRON_TOKENS.clear()
+        patron = self._patron()
+        patron.authorization_identifier = 'barcode'
+
+        # The first time we need a token for this patron, it's looked
+        # up (and in this case, created) through a Credential.
+        credential = api.get_patron_credential(patron, "a pin")
+        assert isinstance(credential, Credential)
+        assert 1 == len(api.access_token_requests)
+
+        # The token is now in memory, and the next time it's needed,
+        # the database isn't consulted.
+        token = api.PATRON_TOKENS[api.patron_token_key(patron)]
+        assert isinstance(token, OverdrivePatronToken)
+        assert credential.credential == token.credential
+        assert credential.expires == token.expires
+        assert token == api.get_patron_credential(patron, "a pin")
+        assert 1 == len(api.access_token_requests)
+
+        # When the token is about to expire, it's still used, but a
+        # new token is requested in the background.
+        refreshes = []
+        def refresh_in_background(token, patron, pin):
+            refreshes.append((token, patron, pin))
+        api.refresh_patron_token_in_background = refresh_in_background
+        now = datetime.utcnow()
+        token.expires = now + timedelta(minutes=1)
+        assert token == api.get_patron_credential(patron, "a pin")
+        assert [(token, patron, "a pin")] == refreshes
+
+        # Here's what happens in the background: the token is
+        # updated in place.
+        token.credential = "old token"
+        token.refreshing = True
+        payload = api.patron_access_token_payload(patron, "a pin")
+        api._refresh_patron_token(token, payload)
+        assert "old token" != token.credential
+        assert token.expires > now + timedelta(minutes=1)
+        assert False == token.refreshing
+        assert 2 == len(api.access_token_requests)
+
+        # Once a token has expired, it's looked up through its
+        # Credential again.
+        token.expires = now - timedelta(minutes=1)
+        assert credential == api.get_patron_credential(patron, "a pin")
+        assert [(token, patron, "a pin")] == refreshes
+        api.PATRON_TOKENS.clear()
+
+    def test_refresh_patron_token_in_background(self):
+        # Only one refresh is started at a time for a given token.
+        class MockAPI(MockOverdriveAPI):
+            def patron_access_token_payload(self, patron, pin):
+                raise Exception("A refresh should not have been started.")
+
+        api = MockAPI(self._db, self.collection)
+        token = OverdrivePatronToken("a token", datetime.utcnow())
+        token.refreshing = True
+        api.refresh_patron_token_in_background(token, self._patron(), None)
+
     def test_patron_correct_credentials_for_multiple_overdrive_collections(self):
         # Verify that the correct credential will be used
         # when a library has more than one OverDrive collection.
@@ -1962,13 +2056,21 @@ class TestOverdriveCirculationMonitor(OverdriveAPITest):
         # The method stops when should_stop() -- called on every book
         # -- returns True.
         class MockAPI(object):
+            token = "a token"
+            collection_token = "a collection token"
+
             def __init__(self, *ignore, **kwignore):
                 self.licensepools = []
                 self.update_licensepool_calls = []
+                self.lookups = []
 
-            def update_licensepool(self, book_id):
+            def circulation_lookup(self, book_id):
+                return ("availability for", book_id)
+
+            def update_licensepool(self, book_id, lookup=None):
                 pool, is_new, is_changed = self.licensepools.pop(0)
                 self.update_licensepool_calls.append((book_id, pool))
+                self.lookups.append(lookup)
                 return pool, is_new, is_changed
 
         class MockAnalytics(object):
@@ -2034,6 +2136,15 @@ class TestOverdriveCirculationMonitor(OverdriveAPITest):
         # queue.
         assert [(1, lp1),(2, lp2),(3, lp3)] == api.update_licensepool_calls
 
+        # Availability for each book was looked up ahead of time, in
+        # worker threads, and the results were passed into
+        # update_licensepool().
+        assert (
+            [("availability for", 1),
+             ("availability for", 2),
+             ("availability for", 3)] ==
+            api.lookups)
+
         # After each book was processed, should_stop was called, using
         # the LicensePool, the start date, plus information about
         # whether the LicensePool was changed (or created) during
@@ -2066,8 +2177,23 @@ class TestOverdriveCirculationMonitor(OverdriveAPITest):
         # a summary of what happened.
         #
         # We processed four books: 1, 2, None (which was ignored)
-        # and 3.
-        assert "Books processed: 4." == progress.achievements
+        # and 3. The processing rate is also recorded.
+        assert progress.achievements.startswith(
+            "Books processed: 4. Books per second: "
+        )
+
+    def test_batches(self):
+        class MockMonitor(OverdriveCirculationMonitor):
+            BATCH_SIZE = 2
+
+        monitor = MockMonitor(self._db, self.collection)
+
+        # Empty entries are left out of the batches, but counted.
+        assert (
+            [([1, 2], 1), ([3, 4], 0), ([5], 2)] ==
+            list(monitor.batches([1, None, 2, 3, 4, None, 5, None])))
+        assert [([], 1)] == list(monitor.batches([None]))
+        assert [] == list(monitor.batches([]))
 
 
 class TestNewTitlesOverdriveCollectionMonitor(OverdriveAPITest):
@@ -10,6 +10,10 @@ from core.app_server import ErrorHandler
 
 from api import app
 from api import routes
+from api.app import (
+    initializer,
+    warm_up,
+)
 from api.opds import CirculationManagerAnnotator
 from api.controller import CirculationManager
 from api.routes import (
@@ -289,6 +293,74 @@ class TestAppConfiguration(object):
     def test_configuration(self):
         assert False == routes.app.url_map.merge_slashes
 
+    def test_warm_up(self):
+        test_app = flask.Flask(__name__)
+        calls = []
+
+        def first():
+            calls.append("first")
+        initializer(first, test_app)
+
+        def second():
+            calls.append("second")
+        initializer(second, test_app)
+
+        @test_app.route("/")
+        def index():
+            return "ok"
+
+        # warm_up runs the setup functions in order and reports how
+        # long each one took.
+        timings = warm_up(test_app)
+        assert ["first", "second"] == calls
+        assert ["first", "second"] == [name for name, ignore in timings]
+
+        # Since the setup has happened, it won't happen again when the
+        # first request comes in...
+        response = test_app.test_client().get("/")
+        assert "ok" == response.data
+        assert ["first", "second"] == calls
+
+        # ...or if warm_up is called again.
+        assert [] == warm_up(test_app)
+        assert ["first", "second"] == calls
+
+        # Calling a setup function directly still runs it.
+        first()
+        assert ["first", "second", "first"] == calls
+
+    def test_warm_up_failure(self):
+        test_app = flask.Flask(__name__)
+        calls = []
+
+        def first():
+            calls.append("first")
+        initializer(first, test_app)
+
+        def second():
+            calls.append("second")
+            if calls.count("second") == 1:
+                raise Exception("The database is down!")
+        initializer(second, test_app)
+
+        def third():
+            calls.append("third")
+        initializer(third, test_app)
+
+        @test_app.route("/")
+        def index():
+            return "ok"
+
+        # If part of the setup fails, warm_up stops, but doesn't raise
+        # an exception.
+        assert ["first"] == [name for name, ignore in warm_up(test_app)]
+        assert ["first", "second"] == calls
+
+        # The rest of the setup happens when the first request comes in.
+        response = test_app.test_client().get("/")
+        assert "ok" == response.data
+        assert ["first", "second", "second", "third"] == calls
+
 
 class TestIndex(RouteTest):
 
@@ -72,7 +72,6 @@ from core.s3 import MockS3Uploader
 
 from core.mirror import MirrorUploader
 
-from core.marc import MARCExporter
 from core.scripts import CollectionType
 
 from core.util.flask_util import (
@@ -80,7 +79,10 @@ from core.util.flask_util import (
     OPDSFeedResponse
 )
 
-from api.marc import LibraryAnnotator as  MARCLibraryAnnotator
+from api.marc import (
+    LibraryAnnotator as MARCLibraryAnnotator,
+    MARCExporter,
+)
 
 from core.testing import (
     DatabaseTest,
@@ -251,6 +253,300 @@ class TestCacheRepresentationPerLane(TestLaneScript):
         assert (lane, facets2, page1) == c3
         assert (lane, facets2, page2) == c4
 
+        # A report on the lane was recorded.
+        [(identifier, elapsed, size, feeds)] = script.lane_reports
+        assert lane.full_identifier == identifier
+        assert elapsed >= 0
+        assert 4 * len("mock response") == size
+        assert 4 == feeds
+
+        # process_lane_by_id looks up a lane and returns its report.
+        report = script.process_lane_by_id(lane.id)
+        assert script.lane_reports[-1] == report
+        assert 2 == len(script.lane_reports)
+        assert lane.full_identifier == report[0]
+
+    def test_workers(self):
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=[]
+        )
+        assert 1 == script.workers
+
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=["--workers=4"]
+        )
+        assert 4 == script.workers
+        assert ["--workers=4"] == script.cmd_args
+
+    def test_report(self):
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=["--workers=2"]
+        )
+        class MockLog(object):
+            def __init__(self):
+                self.messages = []
+            def info(self, message, *args):
+                self.messages.append(message % args)
+        script.log = MockLog()
+        script.report([("fast", 1, 100, 2), ("slow", 3, 200, 2)], 3.5)
+
+        # Wall-clock time is reported separately from the time spent
+        # on the individual lanes, which can be more when several
+        # workers are running at once.
+        summary, slow, fast = script.log.messages
+        assert (
+            "Generated 4 feeds (300 bytes) for 2 lanes in 3.50 sec "
+            "(4.00 sec spent on lanes, 2 worker(s))." == summary
+        )
+        assert "slow: 2 feeds, 200 bytes, 3.00 sec." == slow
+        assert "fast: 2 feeds, 100 bytes, 1.00 sec." == fast
+
+    def test_lanes_for_library(self):
+        parent = self._lane(display_name="parent")
+        child = self._lane(display_name="child", parent=parent)
+        grandchild = self._lane(display_name="grandchild", parent=child)
+        script = CacheRepresentationPerLane(
+            self._db, ["--max-depth=1", "--min-depth=0"], manager=object()
+        )
+
+        # The top-level WorkList isn't a Lane, so it's not processed,
+        # and the grandchild is too deep.
+        lanes = list(script.lanes_for_library(self._default_library))
+        assert [parent, child] == lanes
+
+    def test_process_lanes_in_parallel_handles_worklists_locally(self):
+        # A WorkList that isn't a Lane can't be sent to a worker
+        # process; it's processed in the parent instead.
+        worklist = WorkList()
+        worklist.initialize(self._default_library, display_name="In memory")
+
+        class Mock(CacheRepresentationPerLane):
+            processed = []
+            def lanes_for_library(self, library):
+                return [worklist]
+
+            def process_lane(self, lane):
+                self.processed.append(lane)
+
+        script = Mock(self._db, manager=object(), cmd_args=["--workers=2"])
+        script.process_lanes_in_parallel(self._default_library)
+        assert [worklist] == script.processed
+
+    def test_changed_works(self):
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=["--incremental"]
+        )
+        assert True == script.incremental
+
+        # The script has never run, so we can't tell what's changed.
+        assert None == script.previous_run_start()
+        assert None == script.changed_works()
+
+        # Now it's run once.
+        now = datetime.datetime.utcnow()
+        last_run = now - datetime.timedelta(hours=1)
+        timestamp, ignore = create(
+            self._db, Timestamp, service=script.script_name,
+            service_type=Timestamp.SCRIPT_TYPE, collection=None,
+            start=last_run, finish=last_run
+        )
+        assert last_run == script.previous_run_start()
+
+        old = self._work(with_license_pool=True)
+        old.last_update_time = last_run - datetime.timedelta(hours=1)
+        old.license_pools[0].last_checked = old.last_update_time
+        changed = self._work(with_license_pool=True)
+        changed.last_update_time = now
+        available = self._work(with_license_pool=True)
+        available.last_update_time = old.last_update_time
+        available.license_pools[0].last_checked = now
+
+        # changed_works() caches its answer, so make a new script.
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=["--incremental"]
+        )
+        expect = dict(
+            (w.license_pools[0].identifier.urn, w.id)
+            for w in (changed, available)
+        )
+        assert expect == script.changed_works()
+
+        # If the last run failed, we can't trust its start time.
+        timestamp.exception = "Oops"
+        assert None == script.previous_run_start()
+
+        # If too many works have changed, we give up.
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=["--incremental"]
+        )
+        timestamp.exception = None
+        script.MAX_CHANGED_WORKS = 1
+        assert None == script.changed_works()
+
+    def test_lane_has_changes(self):
+        # This lane only contains Spanish books.
+        lane = self._lane(languages=['spa'])
+        work = self._work(with_license_pool=True, language='eng')
+        urn = work.license_pools[0].identifier.urn
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=["--incremental"]
+        )
+
+        # If we can't tell what's changed, every lane has changed.
+        script._changed_works = None
+        assert True == script.lane_has_changes(lane)
+
+        # If nothing has changed, no lane has changed.
+        script._changed_works = {}
+        assert False == script.lane_has_changes(lane)
+        assert False == script.lane_has_changes(WorkList())
+
+        # The work has changed, but it's not in the lane or in any of
+        # the lane's cached feeds.
+        script._changed_works = {urn: work.id}
+        assert False == script.lane_has_changes(lane)
+
+        # Once anything has changed, a WorkList that's not a Lane
+        # always counts as changed, since it has no cached feeds to
+        # check.
+        assert True == script.lane_has_changes(WorkList())
+
+        # A cached feed that doesn't mention the work doesn't change that.
+        now = datetime.datetime.utcnow()
+        updated = now.strftime(script.FEED_UPDATED_FORMAT)
+        feed, ignore = create(
+            self._db, CachedFeed, lane=lane, library=self._default_library,
+            type=CachedFeed.PAGE_TYPE, facets=u"", pagination=u"",
+            timestamp=now,
+            content=u"<feed><updated>%s</updated></feed>" % updated
+        )
+        assert False == script.lane_has_changes(lane)
+
+        # Once the work shows up in a cached feed for the lane, the lane
+        # has changed -- the work may have left the lane.
+        feed.content = (
+            u"<feed><updated>%s</updated><entry><id>%s</id></entry></feed>"
+            % (updated, urn)
+        )
+        assert True == script.lane_has_changes(lane)
+
+    def test_lane_has_changes_when_feed_is_too_old(self):
+        lane = self._lane()
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=["--incremental"]
+        )
+        script._changed_works = {}
+        now = datetime.datetime.utcnow()
+        feed, ignore = create(
+            self._db, CachedFeed, lane=lane, library=self._default_library,
+            type=CachedFeed.PAGE_TYPE, facets=u"", pagination=u"",
+            timestamp=now
+        )
+        def generated(when):
+            feed.content = u"<feed><updated>%s</updated></feed>" % (
+                when.strftime(script.FEED_UPDATED_FORMAT)
+            )
+
+        generated(now)
+        assert now.replace(microsecond=0) == script.feed_generated(feed)
+        assert False == script.lane_has_changes(lane)
+
+        # Even though nothing has changed, a feed generated longer ago
+        # than the lane's maximum cache age won't be kept any longer,
+        # however recently its timestamp was moved forward.
+        generated(now - datetime.timedelta(seconds=lane.MAX_CACHE_AGE+60))
+        assert True == script.lane_has_changes(lane)
+
+        # Neither will a feed when we can't tell how old it is.
+        feed.content = u"<feed/>"
+        assert None == script.feed_generated(feed)
+        assert True == script.lane_has_changes(lane)
+
+    def test_lane_has_changes_when_lane_definition_changes(self):
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=["--incremental"]
+        )
+        script._changed_works = {}
+        now = datetime.datetime.utcnow()
+        last_run = now - datetime.timedelta(hours=1)
+        long_ago = last_run - datetime.timedelta(hours=1)
+        create(
+            self._db, Timestamp, service=script.script_name,
+            service_type=Timestamp.SCRIPT_TYPE, collection=None,
+            start=last_run, finish=last_run
+        )
+        customlist, ignore = self._customlist(num_entries=0)
+        customlist.updated = long_ago
+        lane = self._lane()
+        lane.customlists.append(customlist)
+        child = self._lane(parent=lane)
+        child.inherit_parent_restrictions = True
+        other = self._lane()
+        for l in (lane, child, other):
+            assert False == script.lane_has_changes(l)
+
+        # A work is added to the lane's custom list. The lane has
+        # changed, and so has the sublane that inherits its
+        # restrictions.
+        work = self._work(with_license_pool=True)
+        entry, ignore = customlist.add_entry(work)
+        entry.first_appearance = entry.most_recent_appearance = now
+        customlist.updated = long_ago
+        assert True == script.lane_has_changes(lane)
+        assert True == script.lane_has_changes(child)
+        assert False == script.lane_has_changes(other)
+
+        # A list that was changed in some other way (e.g. a work was
+        # removed from it) also counts.
+        entry.first_appearance = entry.most_recent_appearance = long_ago
+        assert False == script.lane_has_changes(lane)
+        customlist.updated = now
+        assert True == script.lane_has_changes(lane)
+        customlist.updated = long_ago
+
+        # Once the library's lanes are changed through the admin
+        # interface, every lane in the library has changed.
+        Configuration.set_lanes_updated(self._default_library, now)
+        for l in (lane, child, other):
+            assert True == script.lane_has_changes(l)
+
+    def test_process_lane_incremental(self):
+        lane = self._lane()
+        now = datetime.datetime.utcnow()
+        long_ago = now - datetime.timedelta(days=10)
+        feed, ignore = create(
+            self._db, CachedFeed, lane=lane, library=self._default_library,
+            type=CachedFeed.PAGE_TYPE, facets=u"", pagination=u"",
+            timestamp=long_ago,
+            content=u"<feed><updated>%s</updated></feed>" % (
+                now.strftime(CacheRepresentationPerLane.FEED_UPDATED_FORMAT)
+            )
+        )
+
+        class Mock(CacheRepresentationPerLane):
+            generated = []
+            def do_generate(self, lane, facets, pagination):
+                self.generated.append(lane)
+                return Response("mock response")
+
+        # Nothing has changed since the last run.
+        script = Mock(self._db, manager=object(), cmd_args=["--incremental"])
+        script._changed_works = {}
+        assert [] == script.process_lane(lane)
+        assert [] == script.generated
+        [(identifier, elapsed, size, feeds)] = script.lane_reports
+        assert 0 == feeds
+
+        # The lane's cached feed was kept fresh.
+        self._db.expire(feed)
+        assert feed.timestamp > long_ago
+
+        # Without --incremental, the lane is regenerated regardless.
+        script = Mock(self._db, manager=object(), cmd_args=[])
+        script._changed_works = {}
+        [response] = script.process_lane(lane)
+        assert [lane] == script.generated
+
     def test_default_facets(self):
         # By default, do_generate will only be called once, with facets=None.
         script = CacheRepresentationPerLane(
@@ -588,8 +884,8 @@ class TestCacheMARCFiles(TestLaneScript):
         class MockMARCExporter(MARCExporter):
             called_with = []
 
-            def records(self, lane, annotator, mirror_integration, start_time=None):
-                self.called_with += [(lane, annotator, mirror_integration, start_time)]
+            def full_and_delta_records(self, lane, annotator, mirror_integration, delta_start_time=None):
+                self.called_with += [(lane, annotator, mirror_integration, delta_start_time)]
 
         exporter = MockMARCExporter(None, None, integration)
 
@@ -611,7 +907,7 @@ class TestCacheMARCFiles(TestLaneScript):
         script.process_lane(lane, exporter)
 
         # If the script has never been run before, it runs the exporter once
-        # to create a file with all records.
+        # to create a file with all records, and no file of changes.
         assert 1 == len(exporter.called_with)
 
         assert lane == exporter.called_with[0][0]
@@ -619,9 +915,10 @@ class TestCacheMARCFiles(TestLaneScript):
         assert the_linked_integration == exporter.called_with[0][2]
         assert None == exporter.called_with[0][3]
 
-        # If we have a cached file already, and it's old enough, the script will
-        # run the exporter twice, first to update that file and second to create
-        # a file with changes since that first file was originally created.
+        # If we have a cached file already, and it's old enough, the
+        # script will run the exporter to update that file and, in
+        # the same pass, to create a file with changes since that
+        # first file was originally created.
         exporter.called_with = []
         now = datetime.datetime.utcnow()
         yesterday = now - datetime.timedelta(days=1)
@@ -636,17 +933,12 @@ class TestCacheMARCFiles(TestLaneScript):
 
         script.process_lane(lane, exporter)
 
-        assert 2 == len(exporter.called_with)
+        assert 1 == len(exporter.called_with)
 
         assert lane == exporter.called_with[0][0]
         assert isinstance(exporter.called_with[0][1], MARCLibraryAnnotator)
         assert the_linked_integration == exporter.called_with[0][2]
-        assert None == exporter.called_with[0][3]
-
-        assert lane == exporter.called_with[1][0]
-        assert isinstance(exporter.called_with[1][1], MARCLibraryAnnotator)
-        assert the_linked_integration == exporter.called_with[1][2]
-        assert exporter.called_with[1][3] < last_week
+        assert exporter.called_with[0][3] < last_week
 
         # If we already have a recent cached file, the script won't do anything.
         cached.end_time = yesterday
@@ -658,18 +950,13 @@ class TestCacheMARCFiles(TestLaneScript):
         script = CacheMARCFiles(self._db, cmd_args=["--force"])
         script.process_lane(lane, exporter)
 
-        assert 2 == len(exporter.called_with)
+        assert 1 == len(exporter.called_with)
 
         assert lane == exporter.called_with[0][0]
         assert isinstance(exporter.called_with[0][1], MARCLibraryAnnotator)
         assert the_linked_integration == exporter.called_with[0][2]
-        assert None == exporter.called_with[0][3]
-
-        assert lane == exporter.called_with[1][0]
-        assert isinstance(exporter.called_with[1][1], MARCLibraryAnnotator)
-        assert the_linked_integration == exporter.called_with[1][2]
-        assert exporter.called_with[1][3] < yesterday
-        assert exporter.called_with[1][3] > last_week
+        assert exporter.called_with[0][3] < yesterday
+        assert exporter.called_with[0][3] > last_week
 
         # The update frequency can also be 0, in which case it will always run.
         ConfigurationSetting.for_library_and_externalintegration(
@@ -679,18 +966,64 @@ class TestCacheMARCFiles(TestLaneScript):
         script = CacheMARCFiles(self._db, cmd_args=[])
         script.process_lane(lane, exporter)
 
-        assert 2 == len(exporter.called_with)
+        assert 1 == len(exporter.called_with)
 
         assert lane == exporter.called_with[0][0]
         assert isinstance(exporter.called_with[0][1], MARCLibraryAnnotator)
         assert the_linked_integration == exporter.called_with[0][2]
-        assert None == exporter.called_with[0][3]
+        assert exporter.called_with[0][3] < yesterday
+        assert exporter.called_with[0][3] > last_week
+
+    def test_checkpoint(self):
+        lane = self._lane()
+        script = CacheMARCFiles(self._db, cmd_args=["--workers=3"])
+        assert 3 == script.workers
+        assert None == script.current_run_start()
+        assert False == script.done_in_current_run(self._default_library, lane)
+
+        # A run starts.
+        script.start_checkpoint()
+        start = script.current_run_start()
+        assert start is not None
+        assert False == script.done_in_current_run(self._default_library, lane)
+
+        # The lane's full MARC file was generated during the run.
+        representation, ignore = self._representation()
+        cached, ignore = create(
+            self._db, CachedMARCFile, library=self._default_library,
+            lane=lane, representation=representation,
+            end_time=datetime.datetime.utcnow()
+        )
+        assert True == script.done_in_current_run(self._default_library, lane)
+
+        # A file of changes doesn't count.
+        cached.start_time = start - datetime.timedelta(days=1)
+        assert False == script.done_in_current_run(self._default_library, lane)
+        cached.start_time = None
+
+        # The run was interrupted, so the next run picks up where it
+        # left off, and won't redo the lane.
+        class MockMARCExporter(object):
+            called = False
+            def full_and_delta_records(self, *args, **kwargs):
+                self.called = True
+
+        script = CacheMARCFiles(self._db, cmd_args=["--force"])
+        script.start_checkpoint()
+        assert start == script.current_run_start()
+        exporter = MockMARCExporter()
+        script.process_lane(lane, exporter)
+        assert False == exporter.called
+
+        # Once a run finishes, no run is in progress.
+        script.finish_checkpoint()
+        assert None == script.current_run_start()
+        assert False == script.done_in_current_run(self._default_library, lane)
 
-        assert lane == exporter.called_with[1][0]
-        assert isinstance(exporter.called_with[1][1], MARCLibraryAnnotator)
-        assert the_linked_integration == exporter.called_with[1][2]
-        assert exporter.called_with[1][3] < yesterday
-        assert exporter.called_with[1][3] > last_week
+        # The next run starts from scratch.
+        script.start_checkpoint()
+        assert script.current_run_start() > start
+        assert False == script.done_in_current_run(self._default_library, lane)
 
 
 
@@ -1436,9 +1769,9 @@ class TestLocalAnalyticsExportScript(DatabaseTest):
     def test_do_run(self):
 
         class MockLocalAnalyticsExporter(object):
-            def export(self, _db, start, end):
+            def export_chunks(self, _db, start, end):
                 self.called_with = [start, end]
-                return "test"
+                return iter(["te", "st"])
 
         output = StringIO()
         cmd_args = ['--start=20190820', '--end=20190827']
@@ -0,0 +1,84 @@
+from io import BytesIO
+
+from core.testing import MockRequestsResponse
+
+from api.util.xmlparser import StreamingXMLParser
+
+
+class MockParser(StreamingXMLParser):
+    """Turn each <book> tag into its title."""
+
+    def __init__(self):
+        self.seen = []
+
+    def process_one(self, tag, namespaces):
+        # Every earlier <book> has already been cleared out of the tree.
+        self.seen.append(len(tag.getparent()))
+        title = self.text_of_optional_subtag(tag, "b:title", namespaces)
+        if title == "skip":
+            return None
+        return title
+
+
+class TestStreamingXMLParser(object):
+
+    NAMESPACES = dict(b="http://books/")
+
+    DOCUMENT = b"""<?xml version="1.0" encoding="utf-8"?>
+<books xmlns="http://books/">
+  <book><title>First</title></book>
+  <book><title>skip</title></book>
+  <book><title>Third</title></book>
+</books>"""
+
+    def test_qualified_tag(self):
+        m = StreamingXMLParser.qualified_tag
+        assert "{http://books/}book" == m("b:book", self.NAMESPACES)
+        assert "book" == m("book", self.NAMESPACES)
+
+        # An unknown prefix is left alone.
+        assert "x:book" == m("x:book", self.NAMESPACES)
+
+    def test_process_stream(self):
+        # The handler is called on each matching element as it's
+        # parsed. If the handler returns None, nothing is yielded.
+        parser = MockParser()
+        titles = list(
+            parser.process_stream(BytesIO(self.DOCUMENT), "b:book", self.NAMESPACES)
+        )
+        assert ["First", "Third"] == titles
+
+        # When the handler was called, the element it was given was
+        # the only <book> left in the tree.
+        assert [1, 1, 1] == parser.seen
+
+        # A string works as well as a file-like object.
+        assert titles == list(
+            MockParser().process_stream(self.DOCUMENT, "b:book", self.NAMESPACES)
+        )
+
+    def test_response_stream(self):
+        # A response with no raw stream (or one that has already been
+        # read) is read from its content.
+        response = MockRequestsResponse(200, content=self.DOCUMENT)
+        stream = StreamingXMLParser.response_stream(response)
+        assert self.DOCUMENT == stream.read()
+
+        assert ["First", "Third"] == list(
+            MockParser().process_stream(response, "b:book", self.NAMESPACES)
+        )
+
+        # A response with an unread raw stream is read directly from
+        # that stream.
+        class MockStreamingResponse(object):
+            _content_consumed = False
+            raw = BytesIO(self.DOCUMENT)
+
+            @property
+            def content(self):
+                raise Exception("The whole body should not be read!")
+
+        response = MockStreamingResponse()
+        stream = StreamingXMLParser.response_stream(response)
+        assert response.raw == stream
+        assert True == stream.decode_content